@@ -23,20 +23,56 @@ float I_ivp_1;
 float V_ivp_1;
 float P_ivp_1;
 
-const int SERIAL_BAUD_RATE = 9600;
+// long, since rates above 32767 overflow an int; raise to 115200 (and pass the same
+// baud_rate in Python) to get more measurements per second, especially with binary frames
+const long SERIAL_BAUD_RATE = 9600;
 
 // inbound commands
 const int MOTOR_CONTROL = 1000;
 const int SEND_MEASUREMENT = 2000;
 const int RESET = 6666;
+const int PROTOCOL_REQUEST = 3000;
+const int SEQUENCED_MESSAGE = 4000;
+const int BINARY_MODE_REQUEST = 5000;
+
+// highest protocol version supported (2 = sequenced messages)
+const int PROTOCOL_VERSION = 2;
 
 // outbound codes
 const int ACKNOWLEDGE = 1111;
 const int ERROR_MESSAGE = 9999;
+// state of the response to a reset, so Python can tell it from a state at the home position
+const int RESET_STATE = 6666;
 
 int active_index;
 int active_state;
 bool send_data;
+// sequence id of the message being processed, -1 for lock-step messages
+int sequence_id = -1;
+// true to broadcast states as binary frames instead of ASCII lines
+bool binary_frames = false;
+
+// BINARY FRAMES
+// --------------------
+
+// first bytes of a frame (0xA5 0x5A), never part of an ASCII message
+const uint16_t FRAME_SYNC_WORD = 0x5AA5;
+// sequence id of a frame answering a lock-step message
+const uint16_t NO_SEQUENCE_ID = 0xFFFF;
+
+// state frame, sent little-endian and unpadded (see telemetry_frames.py)
+struct __attribute__((packed)) StateFrame {
+  uint16_t sync;
+  uint16_t sequence_id;
+  uint16_t state;
+  uint32_t duration_ms;
+  uint8_t motor_1_position;
+  uint8_t motor_2_position;
+  float I_ivp_1;
+  float V_ivp_1;
+  float P_ivp_1;
+  uint16_t checksum;
+};
 
 // MESSAGE PROCESSING
 // --------------------
@@ -134,6 +170,16 @@ void state_update_sequence() {
 // -----------------------------
 
 void process_input_request() {
+  // sequenced message: remember the id and shift the request to the front
+  sequence_id = -1;
+  if (code_array[0] == SEQUENCED_MESSAGE) {
+    sequence_id = code_array[1];
+    for (int i = 0; i < CODE_ARRAY_SIZE - 2; i++) {
+      code_array[i] = code_array[i + 2];
+    }
+    code_array[CODE_ARRAY_SIZE - 2] = 0;
+    code_array[CODE_ARRAY_SIZE - 1] = 0;
+  }
   // motor control
   if (code_array[0] == 1000) {
     motor_control(code_array[1], code_array[2]);
@@ -146,9 +192,28 @@ void process_input_request() {
   }
   else if (code_array[0] == 6666) {
     setup();
+    if (active_state == ACKNOWLEDGE) {
+      active_state = RESET_STATE;
+      broadcast_state();
+      active_state = ACKNOWLEDGE;
+    }
+    else {
+      broadcast_state();
+    }
+  }
+  else if (code_array[0] == PROTOCOL_REQUEST) {
+    broadcast_protocol();
+  }
+  else if (code_array[0] == BINARY_MODE_REQUEST) {
+    binary_frames = code_array[1] != 0;
+    broadcast_binary_mode();
   }
   else {
     active_state = ERROR_MESSAGE;
+    // sequenced messages always get a response so the sender can match it
+    if (sequence_id >= 0) {
+      broadcast_error();
+    }
   }
 }
 
@@ -222,9 +287,81 @@ void process_input_message (String serial_message) {
 // BROADCASTING RELATED
 // -----------------------------
 
+// prefixes a response with the id of a sequenced message
+void broadcast_sequence_prefix() {
+  if (sequence_id >= 0) {
+    Serial.print(SEQUENCED_MESSAGE);
+    Serial.print(DELIMITER);
+    Serial.print(sequence_id);
+    Serial.print(DELIMITER);
+  }
+}
+
+// sends out the supported protocol version
+void broadcast_protocol() {
+  broadcast_sequence_prefix();
+  Serial.print(PROTOCOL_REQUEST);
+  Serial.print(DELIMITER);
+  Serial.print(PROTOCOL_VERSION);
+  Serial.println(END_CHAR);
+}
+
+// sends out whether states are broadcast as binary frames
+void broadcast_binary_mode() {
+  broadcast_sequence_prefix();
+  Serial.print(BINARY_MODE_REQUEST);
+  Serial.print(DELIMITER);
+  Serial.print(binary_frames ? 1 : 0);
+  Serial.println(END_CHAR);
+}
+
+// Fletcher-16 checksum of a byte range
+uint16_t fletcher16(const uint8_t *data, int length) {
+  uint16_t sum_1 = 0;
+  uint16_t sum_2 = 0;
+  for (int i = 0; i < length; i++) {
+    sum_1 = (sum_1 + data[i]) % 255;
+    sum_2 = (sum_2 + sum_1) % 255;
+  }
+  return (sum_2 << 8) | sum_1;
+}
+
+// sends out a state as one binary frame, the checksum covers the bytes between sync and checksum
+void broadcast_state_frame(int state, uint32_t duration_ms) {
+  StateFrame frame;
+  frame.sync = FRAME_SYNC_WORD;
+  frame.sequence_id = sequence_id >= 0 ? sequence_id : NO_SEQUENCE_ID;
+  frame.state = state;
+  frame.duration_ms = duration_ms;
+  frame.motor_1_position = servo_1_position;
+  frame.motor_2_position = servo_2_position;
+  frame.I_ivp_1 = I_ivp_1;
+  frame.V_ivp_1 = V_ivp_1;
+  frame.P_ivp_1 = P_ivp_1;
+  frame.checksum = fletcher16((const uint8_t *)&frame + 2, sizeof(StateFrame) - 4);
+  Serial.write((const uint8_t *)&frame, sizeof(StateFrame));
+}
+
+// sends out the error state
+void broadcast_error() {
+  if (binary_frames) {
+    broadcast_state_frame(ERROR_MESSAGE, 0);
+    return;
+  }
+  broadcast_sequence_prefix();
+  Serial.print(ERROR_MESSAGE);
+  Serial.println(END_CHAR);
+}
+
 // sends out the Arduino's state
 void broadcast_state() {
+  if (binary_frames) {
+    broadcast_state_frame(active_state, millis() - start_ms);
+    start_ms = millis();
+    return;
+  }
   float elapsed_s = (millis() - start_ms) / 1000.0;
+  broadcast_sequence_prefix();
   Serial.print(active_state);
   Serial.print(DELIMITER);
   Serial.print(elapsed_s, 3);
@@ -273,6 +410,8 @@ void setup() {
 
   // Set to nominal state, change to error if anything arises
   active_state = ACKNOWLEDGE;
+  // a reset returns to ASCII broadcasts
+  binary_frames = false;
   
   // Configure motor pins
   servo_1.attach(servo_1_pin);
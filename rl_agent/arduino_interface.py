@@ -1,22 +1,45 @@
 import serial
+import serial.tools.list_ports
 import time
 import random
 import pandas as pd
 
+# Module imports
+from telemetry_frames import FRAME_SIZE, FrameParser, map_frame_to_dict
+
 # Request codes
 MOTOR_CONTROL = 1000
 STATE_REQUEST = 2000
 RESET_CODE = 6666
 
+# Extended protocol codes (see firmware/README.md)
+PROTOCOL_REQUEST = 3000
+SEQUENCED_MESSAGE = 4000
+BINARY_MODE_REQUEST = 5000
+
+# Protocol versions: lock-step messages only, or sequenced messages that may be pipelined
+LOCKSTEP_PROTOCOL_VERSION = 1
+SEQUENCED_PROTOCOL_VERSION = 2
+
+# Sequence ids wrap at this value to keep messages within the firmware buffer
+SEQUENCE_MODULUS = 1000
+
 # Response codes
 NOMINAL = 1111
 ERROR = 9999
 
+# State code of the response to RESET_CODE from firmware with the extended protocol
+RESET_STATE = 6666
+
 # Constants for communication
 END_CHAR = '>'
 MESSAGE_TERMINATOR = '\n'
 DELIMITER = ','
 
+# Baud rates: the firmware default, and the rate to build the firmware with (SERIAL_BAUD_RATE) for binary telemetry
+DEFAULT_BAUD_RATE = 9600
+HIGH_BAUD_RATE = 115200
+
 
 def read_serial_line(serial_device: serial.Serial, print_message=True):
     """
@@ -37,11 +60,13 @@ def read_serial_line(serial_device: serial.Serial, print_message=True):
     return data_list
 
 
-def write_serial_line(serial_device: serial.Serial, code_array, write_timeout=3, print_message=True):
+def write_serial_line(serial_device: serial.Serial, code_array, write_timeout=3, print_message=True, reset_output=True):
     """
     Args:
         serial_device (serial.Serial): The Serial device
         code_array (list): The sequence of codes/values to send to Arduino
+        reset_output (bool): False to keep unsent bytes instead of resetting the output buffer after the timeout 
+            (a pseudo-terminal, such as SimulatedArduino.start_pty, may not have taken the message yet)
 
     Returns:
         (bool): True for successful write, False for timeout
@@ -63,12 +88,21 @@ def write_serial_line(serial_device: serial.Serial, code_array, write_timeout=3,
         write_success = False
 
     # Reset buffer
-    serial_device.reset_output_buffer()
+    if reset_output:
+        serial_device.reset_output_buffer()
 
     return write_success
 
 
-def initialize_serial(serial_port='/dev/cu.usbmodem14101', baud_rate=9600, timeout=2):
+def find_serial_ports(name_pattern='usbmodem'):
+    """
+    Returns:
+        list: sorted device paths of the serial ports whose name contains name_pattern (one per connected Arduino)
+    """
+    return sorted([port.device for port in serial.tools.list_ports.comports() if name_pattern in port.device])
+
+
+def initialize_serial(serial_port='/dev/cu.usbmodem14101', baud_rate=DEFAULT_BAUD_RATE, timeout=2):
     serial_device = serial.Serial(port=serial_port, baudrate=baud_rate, timeout=timeout)
     serial_device.flush()
     time.sleep(2)
@@ -91,7 +125,105 @@ def map_message_to_dict(timestamp, input_message):
     return final_dict
 
 
-def loop(arduino, runtime=12):
+def set_binary_mode(serial_device: serial.Serial, enabled=True, print_message=False, reset_output=True):
+    """
+    Switch the state broadcasts of the Arduino between ASCII lines and binary frames (see telemetry_frames)
+
+        * A reset returns the Arduino to ASCII lines
+
+    Args:
+        serial_device (serial.Serial): The Serial device
+    Kwargs:
+        enabled (bool): True for binary frames, False for ASCII lines
+        reset_output (bool): passed to write_serial_line
+    Returns:
+        (bool): True if the Arduino acknowledged the mode, False for firmware without binary frames
+    """
+    serial_device.reset_input_buffer()
+    write_serial_line(serial_device, [BINARY_MODE_REQUEST, int(enabled)], print_message=print_message,
+                      reset_output=reset_output)
+    try:
+        response = read_serial_line(serial_device, print_message=print_message)
+    except UnicodeDecodeError:
+        response = None
+    return response == [str(BINARY_MODE_REQUEST), str(int(enabled))]
+
+
+def read_state_frame(serial_device: serial.Serial, frame_parser: FrameParser):
+    """
+    Reads the next state frame from Serial (from Arduino in binary mode)
+
+    Args:
+        serial_device (serial.Serial): The Serial device
+        frame_parser (FrameParser): the parser of the device's frames, holding any partial frame between reads
+    Returns:
+        (StateFrame): the frame, or None if the read timed out
+    """
+    while True:
+        data = serial_device.read(FRAME_SIZE - len(frame_parser.pending))
+        if not data:
+            return None
+        frame = frame_parser.feed_frame(data)
+        if frame is not None:
+            return frame
+
+
+def loop(arduino, runtime=12, random_seed=None, binary_frames=False, recorder=None):
+    """
+    Move the motors to random positions every few seconds and request a measurement every second
+
+    Args:
+        arduino (serial.Serial): The Serial device
+    Kwargs:
+        runtime (float): seconds to run for
+        random_seed (int): seed of the motor positions, or None for a different run each time
+        binary_frames (bool): True to read binary frames (see set_binary_mode)
+        recorder (TelemetryRecorder): a recorder over arduino that is not started yet; responses are then read on
+            its thread and flushed to its file as they arrive instead of held in memory (see telemetry_recorder)
+    Returns:
+        DataFrame: the responses (read back from the recorder's file when recording)
+    """
+    # Motor positions are drawn from a local generator, so a seeded run repeats its moves
+    motor_generator = random.Random(random_seed)
+    # Binary frames are read without decoding strings, fall back to ASCII lines for older firmware
+    frame_parser = FrameParser()
+    if binary_frames and not set_binary_mode(arduino):
+        print('WARNING: Arduino does not support binary frames, reading ASCII lines')
+        binary_frames = False
+    if recorder is not None:
+        recorder.binary_frames = binary_frames
+        recorder.start()
+
+    def read_response():
+        """
+        Returns:
+            dict: the response, or None if a binary frame did not arrive in time (a missed response)
+        """
+        if binary_frames:
+            frame = read_state_frame(arduino, frame_parser)
+            return map_frame_to_dict(time.time(), frame) if frame is not None else None
+        return map_message_to_dict(time.time(), read_serial_line(arduino, print_message=False))
+
+    def mark_request():
+        if recorder is None:
+            return None
+        return recorder.get_record_count(), recorder.get_bytes_received()
+
+    def wait_for_response(timeout, request_mark, any_bytes=False):
+        """
+        Returns:
+            bool: True once a response to the request sent after request_mark has arrived (any bytes for a reset,
+                which is answered in ASCII)
+        """
+        if recorder is not None:
+            if any_bytes:
+                return recorder.wait_for_bytes(request_mark[1] + 1, timeout)
+            return recorder.wait_for_records(request_mark[0] + 1, timeout)
+        wait_start = time.time()
+        while arduino.in_waiting <= 0 and time.time() - wait_start < timeout:
+            time.sleep(0.001)
+        return arduino.in_waiting > 0
+
     # Run start
     run_start = time.time()
     data_dict_list = []
@@ -116,8 +248,9 @@ def loop(arduino, runtime=12):
 
         # every N seconds adjust motor position randomly
         if motor_interval != last_motor_interval:
-            motor_1_position = random.randint(0, 181)
-            motor_2_position = random.randint(0, 181)
+            motor_1_position = motor_generator.randint(0, 181)
+            motor_2_position = motor_generator.randint(0, 181)
+            request_mark = mark_request()
             write_serial_line(arduino, [MOTOR_CONTROL, motor_1_position, motor_2_position], print_message=False)
             # print([1000, motor_1_position, motor_2_position])
             last_motor_interval = motor_interval
@@ -126,30 +259,41 @@ def loop(arduino, runtime=12):
         # otherwise, request a measurement every N seconds
         else:
             if measure_interval != last_measure_interval:
+                request_mark = mark_request()
                 write_serial_line(arduino, [STATE_REQUEST], print_message=False)
                 last_measure_interval = measure_interval
                 expecting_response = True
 
         # Wait for response from arduino before proceeding
         if expecting_response:
-            wait_start = time.time()
-            while arduino.in_waiting <= 0 and time.time() - wait_start < response_timeout:
-                time.sleep(0.001)
-            # Case for successful response
-            if arduino.in_waiting > 0:
-                data_dict_list.append(map_message_to_dict(time.time(), read_serial_line(arduino, print_message=False)))
+            # Case for successful response, where a binary frame that times out while being read is a missed one
+            response_received = wait_for_response(response_timeout, request_mark)
+            if response_received and recorder is None:
+                response = read_response()
+                response_received = response is not None
+                if response_received:
+                    data_dict_list.append(response)
+            if response_received:
                 expecting_response = False
             # If no response, send a reset request
             else:
                 print('WARNING: Arduino unresponsive, requesting reset...')
+                request_mark = mark_request()
                 write_serial_line(arduino, [RESET_CODE])
                 # Verify the reset
-                wait_start = time.time()
-                while arduino.in_waiting <= 0 and time.time() - wait_start < reset_timeout:
-                    time.sleep(0.005)
-                if arduino.in_waiting > 0:
+                if wait_for_response(reset_timeout, request_mark, any_bytes=True):
                     print('SUCCESS: Arduino reset successfully.')
-                    data_dict_list.append(map_message_to_dict(time.time(), read_serial_line(arduino, print_message=False)))
+                    # The reset's state line answers in place of the missed response
+                    expecting_response = False
+                    if recorder is None:
+                        data_dict_list.append(map_message_to_dict(time.time(), read_serial_line(arduino, print_message=False)))
+                        # Drop the partial frame of a missed response
+                        frame_parser = FrameParser()
+                        if binary_frames and not set_binary_mode(arduino):
+                            binary_frames = False
+                    elif binary_frames:
+                        # The recorder skips the ASCII acknowledgement
+                        write_serial_line(arduino, [BINARY_MODE_REQUEST, 1], print_message=False)
                 else:
                     print('FATAL ERROR: Arduino unresponsive to reset.')
                     abort = True
@@ -159,6 +303,9 @@ def loop(arduino, runtime=12):
     else:
         write_serial_line(arduino, [RESET_CODE], print_message=False)
 
+    if recorder is not None:
+        recorder.stop()
+        return recorder.load_records()
     return pd.DataFrame(data_dict_list)
 
 if __name__ == '__main__':
@@ -167,7 +314,7 @@ if __name__ == '__main__':
     # Initialize serial port
     print('\nIniitalizing device...')
     serial_port = '/dev/cu.usbmodem14101'
-    baud_rate = 9600
+    baud_rate = DEFAULT_BAUD_RATE
     timeout = 3
     arduino = initialize_serial(serial_port=serial_port, baud_rate=baud_rate, timeout=timeout)
     print('\t - SUCCESS: Device initialized.')
@@ -0,0 +1,373 @@
+import os
+import time
+import asyncio
+import collections
+
+import serial
+
+from arduino_interface import MOTOR_CONTROL, STATE_REQUEST, RESET_CODE, PROTOCOL_REQUEST, SEQUENCED_MESSAGE, \
+    LOCKSTEP_PROTOCOL_VERSION, SEQUENCED_PROTOCOL_VERSION, SEQUENCE_MODULUS, NOMINAL, ERROR, RESET_STATE, \
+    END_CHAR, MESSAGE_TERMINATOR, DELIMITER, map_message_to_dict
+
+
+class ArduinoUnresponsiveError(Exception):
+    """
+    Raised when the Arduino does not answer a request or the resets that follow it
+    """
+    pass
+
+
+async def open_serial_connection(serial_port='/dev/cu.usbmodem14101', baud_rate=9600, startup_delay=2):
+    """
+    Open a serial port as asyncio streams (POSIX only -- the port's file descriptor is registered with the event loop)
+
+    Args:
+        serial_port (str): the serial port, or the path returned by SimulatedArduino.start_pty
+    Kwargs:
+        baud_rate (int): baud rate of the port
+        startup_delay (float): seconds to wait for the Arduino to boot after the port opens
+    Returns:
+        StreamReader, StreamWriter, serial.Serial: the streams and the underlying port (keep it open while in use)
+    """
+    serial_device = serial.Serial(port=serial_port, baudrate=baud_rate, timeout=0)
+    serial_device.reset_input_buffer()
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                 os.fdopen(os.dup(serial_device.fileno()), 'rb', buffering=0))
+    write_transport, write_protocol = await loop.connect_write_pipe(
+        lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()),
+        os.fdopen(os.dup(serial_device.fileno()), 'wb', buffering=0))
+    writer = asyncio.StreamWriter(write_transport, write_protocol, None, loop)
+    if startup_delay:
+        await asyncio.sleep(startup_delay)
+    return reader, writer, serial_device
+
+
+def is_reset_response(message):
+    """
+    Returns:
+        bool: True if a lock-step message is the state firmware with the extended protocol answers RESET_CODE with
+    """
+    return message[0] == str(RESET_STATE)
+
+
+def is_state_response(message):
+    """
+    Returns:
+        bool: True if a lock-step message is a state (state code, duration, motor positions, measurements)
+    """
+    return len(message) > 3
+
+
+def format_message(code_array):
+    """
+    Args:
+        code_array (list): The sequence of codes/values to send to Arduino
+    Returns:
+        bytes: the encoded message
+    """
+    return (DELIMITER.join([str(x) for x in code_array]) + END_CHAR + MESSAGE_TERMINATOR).encode()
+
+
+class AsyncArduinoDriver:
+    def __init__(self, reader, writer, response_timeout=3, reset_timeout=5, max_resets=1, max_in_flight=3,
+                 negotiation_timeout=1, stale_response_timeout=None):
+        """
+        Non-blocking driver for the Arduino protocol in firmware/README.md
+
+            * A reader task frames incoming messages on END_CHAR and resolves the waiting request
+            * Requests are lock-step (one in flight) until negotiate_protocol agrees on sequenced messages,
+              after which up to max_in_flight requests are pipelined and matched to responses by sequence id
+            * A timeout or an ERROR state triggers RESET_CODE and a retry, up to max_resets times
+            * Lock-step responses carry no id, so after a lock-step request times out the next lock-step message
+              first waits up to stale_response_timeout for the late response and discards it, and a reset skips
+              messages until the RESET_STATE state (the next state for firmware without the extended protocol, 
+              which answers a reset with an ordinary state); a late response cannot answer a later request
+
+        Args:
+            reader (StreamReader): stream of bytes from the Arduino
+            writer (StreamWriter): stream of bytes to the Arduino
+        Kwargs:
+            response_timeout (float): seconds to wait for a response to a request
+            reset_timeout (float): seconds to wait for a response to a reset
+            max_resets (int): resets attempted for a single request before giving up
+            max_in_flight (int): sequenced requests sent before their responses arrive (bounded by the firmware buffer)
+            negotiation_timeout (float): seconds to wait for a response to PROTOCOL_REQUEST
+            stale_response_timeout (float): seconds to wait for the late response of a timed out lock-step request,
+                or None for response_timeout
+        """
+        self.reader = reader
+        self.writer = writer
+        self.response_timeout = response_timeout
+        self.reset_timeout = reset_timeout
+        self.max_resets = max_resets
+        self.negotiation_timeout = negotiation_timeout
+        self.stale_response_timeout = response_timeout if stale_response_timeout is None else stale_response_timeout
+        self.stale_response_pending = False
+        self.stale_responses = 0
+        self.protocol_version = LOCKSTEP_PROTOCOL_VERSION
+        self.pending_responses = collections.deque()
+        self.sequenced_responses = {}
+        self.next_sequence_id = 0
+        self.request_lock = asyncio.Lock()
+        self.in_flight_window = asyncio.Semaphore(max_in_flight)
+        self.reader_task = None
+        self.unsolicited_messages = 0
+        self.reset_count = 0
+        self.reset_state_reported = True
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def start(self):
+        """
+        Start the reader task (must be called from a running event loop)
+        """
+        if self.reader_task is None:
+            self.reader_task = asyncio.ensure_future(self.read_loop())
+
+    async def close(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            try:
+                await self.reader_task
+            except asyncio.CancelledError:
+                pass
+            self.reader_task = None
+        self.writer.close()
+
+    # Reading
+    # =============================================
+    async def read_message(self):
+        """
+        Returns:
+            list: the fields of the next message framed on END_CHAR
+        """
+        data = await self.reader.readuntil(END_CHAR.encode())
+        return data.decode(errors='replace').strip().replace(END_CHAR, '').split(DELIMITER)
+
+    def deliver_message(self, message):
+        """
+        Resolve the sequenced request matching a received message's id, or else the oldest lock-step request
+        """
+        if message[0] == str(SEQUENCED_MESSAGE) and len(message) > 2:
+            try:
+                response_future = self.sequenced_responses.pop(int(message[1]), None)
+            except ValueError:
+                response_future = None
+            if response_future is not None and not response_future.done():
+                response_future.set_result(message[2:])
+            else:
+                self.unsolicited_messages += 1
+            return
+        while self.pending_responses:
+            response_future = self.pending_responses.popleft()
+            if not response_future.done():
+                response_future.set_result(message)
+                return
+        self.unsolicited_messages += 1
+
+    async def read_loop(self):
+        try:
+            while True:
+                self.deliver_message(await self.read_message())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # Device closed, fail everything still waiting
+            waiting_futures = list(self.pending_responses) + list(self.sequenced_responses.values())
+            self.pending_responses.clear()
+            self.sequenced_responses.clear()
+            for response_future in waiting_futures:
+                if not response_future.done():
+                    response_future.set_exception(ConnectionError('Arduino connection closed'))
+
+    # Requests
+    # =============================================
+    async def wait_for_response(self, timeout, code_array=None):
+        """
+        Wait for the next lock-step message, sending code_array first if given
+
+        Returns:
+            list: the message fields, or None on timeout
+        """
+        response_future = asyncio.get_running_loop().create_future()
+        self.pending_responses.append(response_future)
+        try:
+            if code_array is not None:
+                self.writer.write(format_message(code_array))
+                await self.writer.drain()
+            return await asyncio.wait_for(response_future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if response_future in self.pending_responses:
+                self.pending_responses.remove(response_future)
+
+    async def discard_stale_response(self):
+        """
+        Wait for the late response of a timed out lock-step request and drop it
+        """
+        self.stale_response_pending = False
+        if await self.wait_for_response(self.stale_response_timeout) is not None:
+            self.stale_responses += 1
+
+    async def send_and_wait(self, code_array, timeout):
+        """
+        Send one message and wait for the next response
+
+        Returns:
+            list: the response fields, or None on timeout
+        """
+        if self.stale_response_pending:
+            await self.discard_stale_response()
+        response = await self.wait_for_response(timeout, code_array)
+        if response is None:
+            self.stale_response_pending = True
+        return response
+
+    async def send_sequenced_and_wait(self, code_array, timeout):
+        """
+        Send one sequenced message and wait for the response carrying its id
+
+        Returns:
+            list: the response fields without the sequence prefix, or None on timeout
+        """
+        sequence_id = self.next_sequence_id
+        self.next_sequence_id = (sequence_id + 1) % SEQUENCE_MODULUS
+        response_future = asyncio.get_running_loop().create_future()
+        self.sequenced_responses[sequence_id] = response_future
+        self.writer.write(format_message([SEQUENCED_MESSAGE, sequence_id] + list(code_array)))
+        await self.writer.drain()
+        try:
+            return await asyncio.wait_for(response_future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.sequenced_responses.pop(sequence_id, None)
+
+    async def negotiate_protocol(self):
+        """
+        Ask the Arduino for its protocol version and switch to sequenced messages if it supports them
+
+            * Firmware without the extended protocol does not answer PROTOCOL_REQUEST, so the error state it
+              sets is cleared with a reset and the driver stays lock-step
+
+        Returns:
+            int: the protocol version in use
+        """
+        async with self.request_lock:
+            response = await self.send_and_wait([PROTOCOL_REQUEST], self.negotiation_timeout)
+            if response is not None and response[0] == str(PROTOCOL_REQUEST) and len(response) > 1:
+                self.protocol_version = min(int(response[1]), SEQUENCED_PROTOCOL_VERSION)
+            else:
+                # Older firmware never answers PROTOCOL_REQUEST, so there is no late response to wait for, and may 
+                # not answer the reset either, so a missing response is not an error here
+                self.stale_response_pending = False
+                response = await self.send_reset(is_state_response)
+                self.reset_state_reported = response is not None and is_reset_response(response)
+                self.protocol_version = LOCKSTEP_PROTOCOL_VERSION
+        return self.protocol_version
+
+    async def send_reset(self, is_answer):
+        """
+        Send RESET_CODE and wait for its answer, skipping responses to earlier requests that arrived after their 
+        stale wait
+
+        Args:
+            is_answer (function): True for the message that answers the reset
+        Returns:
+            list: the answer, or None if none came within reset_timeout
+        """
+        self.reset_count += 1
+        loop = asyncio.get_running_loop()
+        reset_deadline = loop.time() + self.reset_timeout
+        response = await self.send_and_wait([RESET_CODE], self.reset_timeout)
+        while response is not None and not is_answer(response):
+            self.stale_responses += 1
+            response = await self.wait_for_response(max(reset_deadline - loop.time(), 0))
+        # Once the answer is consumed nothing is left in flight, without it the answer may still arrive late
+        self.stale_response_pending = response is None
+        return response
+
+    async def reset(self):
+        """
+        Send RESET_CODE and wait for the Arduino to answer
+
+        Returns:
+            list: the response to the reset
+        """
+        response = await self.send_reset(is_reset_response if self.reset_state_reported else is_state_response)
+        if response is None:
+            raise ArduinoUnresponsiveError('Arduino unresponsive to reset')
+        return response
+
+    async def request(self, code_array, timeout=None):
+        """
+        Send a request and await its response, resetting the Arduino on a timeout or ERROR state
+
+        Args:
+            code_array (list): The sequence of codes/values to send to Arduino
+        Kwargs:
+            timeout (float): seconds to wait for the response, or None for response_timeout
+        Returns:
+            list: the response fields (state, duration, motor positions, measurements)
+        """
+        timeout = self.response_timeout if timeout is None else timeout
+        if self.protocol_version >= SEQUENCED_PROTOCOL_VERSION:
+            return await self.request_sequenced(code_array, timeout)
+        async with self.request_lock:
+            for attempt in range(self.max_resets + 1):
+                response = await self.send_and_wait(code_array, timeout)
+                if response is not None and response[0] != str(ERROR):
+                    return response
+                if attempt < self.max_resets:
+                    await self.reset()
+            raise ArduinoUnresponsiveError('No valid response to ' + str(code_array))
+
+    async def request_sequenced(self, code_array, timeout):
+        """
+        Send a sequenced request within the in-flight window, resetting the Arduino on a timeout or ERROR state
+
+            * Requests that fail together share one reset (a reset made after a request was sent covers it)
+        """
+        async with self.in_flight_window:
+            for attempt in range(self.max_resets + 1):
+                reset_count = self.reset_count
+                response = await self.send_sequenced_and_wait(code_array, timeout)
+                if response is not None and response[0] != str(ERROR):
+                    return response
+                if attempt < self.max_resets:
+                    async with self.request_lock:
+                        if self.reset_count == reset_count:
+                            await self.reset()
+            raise ArduinoUnresponsiveError('No valid response to ' + str(code_array))
+
+    async def request_many(self, code_arrays, timeout=None):
+        """
+        Send several requests, pipelined when the sequenced protocol is in use
+
+        Args:
+            code_arrays (list): list of code arrays
+        Kwargs:
+            timeout (float): seconds to wait for each response, or None for response_timeout
+        Returns:
+            list: the responses in the order of code_arrays
+        """
+        return await asyncio.gather(*[self.request(code_array, timeout=timeout) for code_array in code_arrays])
+
+    async def move_motors(self, motor_1_position, motor_2_position, timeout=None):
+        return await self.request([MOTOR_CONTROL, motor_1_position, motor_2_position], timeout=timeout)
+
+    async def request_state(self, timeout=None):
+        return await self.request([STATE_REQUEST], timeout=timeout)
+
+    async def request_state_dict(self, timeout=None):
+        """
+        Returns:
+            dict: a measurement in the format of arduino_interface.map_message_to_dict
+        """
+        return map_message_to_dict(time.time(), await self.request_state(timeout=timeout))
@@ -0,0 +1,3 @@
+"""
+Benchmarks of the simulation stack, run from rl_agent/ with python -m benchmarks (see README.md)
+"""
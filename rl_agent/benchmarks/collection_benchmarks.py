@@ -0,0 +1,81 @@
+import time
+import random
+import asyncio
+
+# Module imports
+from async_arduino_interface import AsyncArduinoDriver
+from collection_scheduler import MAX_MOTOR_DEGREE, create_serpentine_plan, estimate_plan_time, run_collection
+from simulated_arduino import SimulatedArduino
+
+from benchmarks.results import create_result, format_case
+from benchmarks.env_benchmarks import INDOOR_DATA_PATH, load_value_array
+
+# Seconds between the random moves of arduino_interface.loop, the previous way of collecting data
+RANDOM_MOVE_INTERVAL = 3
+
+
+def count_random_moves_to_cover(degree_discretization, random_seed):
+    """
+    Returns:
+        int: random moves, drawn like arduino_interface.loop, until every grid cell has been visited once
+    """
+    motor_generator = random.Random(random_seed)
+    grid_size = MAX_MOTOR_DEGREE // degree_discretization + 1
+    unvisited_cells = {(row, column) for row in range(grid_size) for column in range(grid_size)}
+    moves = 0
+    while unvisited_cells:
+        # The firmware clamps positions past the servo range
+        motor_1_position = min(motor_generator.randint(0, 181), MAX_MOTOR_DEGREE)
+        motor_2_position = min(motor_generator.randint(0, 181), MAX_MOTOR_DEGREE)
+        unvisited_cells.discard((motor_1_position // degree_discretization, motor_2_position // degree_discretization))
+        moves += 1
+    return moves
+
+
+async def measure_simulated_collection(device, degree_discretization):
+    """
+    Returns:
+        float: seconds of run_collection over the grid of a simulated panel
+    """
+    reader, writer = await device.open_connection()
+    async with AsyncArduinoDriver(reader, writer) as driver:
+        collection_start = time.perf_counter()
+        await run_collection(driver, degree_discretization=degree_discretization, hide_progress_bar=True)
+        return time.perf_counter() - collection_start
+
+
+def benchmark_collection_time(quick=False, degree_discretization=5, time_scale=0.01):
+    """
+    Time to cover every grid cell when collecting simulation data, serpentine plan against random moves
+
+        * plan=random_3s: random positions every RANDOM_MOVE_INTERVAL seconds as in arduino_interface.loop, averaged
+          over seeds of the moves it takes to visit every cell
+        * plan=serpentine: servo time of create_serpentine_plan from the firmware's stepped writes
+          (collection_scheduler.estimate_plan_time)
+        * simulated: wall time of run_collection against a SimulatedArduino whose servo delays are scaled by
+          time_scale, which includes the host side of each request
+
+    Kwargs:
+        quick (bool): True for fewer random seeds and a coarser simulated grid
+        degree_discretization (int): degrees between grid positions
+        time_scale (float): multiplier on the simulated firmware's servo delays
+    Returns:
+        list: result records
+    """
+    num_seeds = 5 if quick else 20
+    random_moves = sum([count_random_moves_to_cover(degree_discretization, seed) for seed in range(num_seeds)])
+    random_time = random_moves / num_seeds * RANDOM_MOVE_INTERVAL
+    serpentine_time = estimate_plan_time(create_serpentine_plan(degree_discretization))
+    results = [create_result('collection_time', format_case(plan='random_3s', degrees=degree_discretization),
+                             'coverage_time_s', random_time, 's', False),
+               create_result('collection_time', format_case(plan='serpentine', degrees=degree_discretization),
+                             'coverage_time_s', serpentine_time, 's', False)]
+
+    simulated_discretization = 15 if quick else degree_discretization
+    device = SimulatedArduino(load_value_array(INDOOR_DATA_PATH, simulated_discretization),
+                              degree_discretization=simulated_discretization, time_scale=time_scale)
+    collection_time = asyncio.run(measure_simulated_collection(device, simulated_discretization))
+    results.append(create_result('collection_time', format_case(plan='serpentine', degrees=simulated_discretization,
+                                                                time_scale=time_scale),
+                                 'simulated_collection_s', collection_time, 's', False))
+    return results
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+
+# Module imports
+import solar_env
+import sweep_runner
+
+from benchmarks.results import create_result, format_case, time_best
+
+# Light scans bundled with the repo
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'simulation_data', 'data',
+                        'initial_environments')
+INDOOR_DATA_PATH = os.path.join(DATA_DIR, 'indoor_light_scan.csv')
+OUTDOOR_DATA_PATH = os.path.join(DATA_DIR, 'outdoor_light_scan.csv')
+
+
+def load_value_array(data_path, degree_discretization=5):
+    """
+    Returns:
+        numpy array: the reward grid of a light scan
+    """
+    return solar_env.convert_solar_df_to_value_array(solar_env.load_and_format_solar_df(data_path),
+                                                     degree_discretization)
+
+
+def benchmark_env_build(quick=False):
+    """
+    Time to build a SolarEnv from each bundled light scan
+
+        * csv: parsing the csv and discretizing it (sweep_runner.create_env_from_data_path)
+        * cache_compile: writing the compiled environment (solar_env.compile_env_cache)
+        * cache_load: building the env from an up-to-date compiled environment (solar_env.create_env_from_cache)
+
+    Kwargs:
+        quick (bool): True for fewer repeats
+    Returns:
+        list: result records
+    """
+    repeats = 5 if quick else 20
+    results = []
+    cache_dir = tempfile.mkdtemp()
+    try:
+        for data_path in [INDOOR_DATA_PATH, OUTDOOR_DATA_PATH]:
+            data_name = os.path.splitext(os.path.basename(data_path))[0]
+            build_functions = {
+                'csv': lambda: sweep_runner.create_env_from_data_path(data_path, 500),
+                'cache_compile': lambda: solar_env.compile_env_cache(data_path, cache_dir=cache_dir),
+                'cache_load': lambda: solar_env.create_env_from_cache(data_path, cache_dir=cache_dir)
+            }
+            for source, build_function in build_functions.items():
+                build_time = time_best(build_function, repeats)
+                results.append(create_result('env_build', format_case(data=data_name, source=source), 'build_ms',
+                                             build_time * 1000, 'ms', False))
+    finally:
+        shutil.rmtree(cache_dir)
+    return results
@@ -0,0 +1,147 @@
+import time
+import tracemalloc
+
+import numpy as np
+
+# Module imports
+import experiment_functions as ef
+from rl_agent import SoftmaxAgent
+from solar_env import SolarEnv, VectorSolarEnv
+
+from benchmarks.results import create_result, format_case, time_best
+from benchmarks.env_benchmarks import INDOOR_DATA_PATH, load_value_array
+
+# Degrees per grid index giving 13x13, 19x19 and 37x37 grids over the 0-180 degree motor range
+GRID_DISCRETIZATIONS = (15, 10, 5)
+DAY_PARTITIONS = (1, 6, 24)
+
+# Streams of the VectorSoftmaxAgent runs
+NUM_STREAMS = (1, 2, 8)
+
+# Agent hyperparameters of the benchmark runs
+BENCHMARK_AGENT_SETTINGS = {'actor_step_size': 0.1, 'critic_step_size': 0.1, 'avg_reward_step_size': 0.01,
+                            'temperature_value': 0.5, 'reward_rolling_avg_window': 5000}
+
+
+def create_benchmark_env(value_array, day_partitions):
+    """
+    Returns:
+        SolarEnv: env over value_array, cycling through day_partitions times of day so every partition is visited
+    """
+    return SolarEnv(value_array, roll_frequency=500, time_of_day_max=day_partitions)
+
+
+def create_benchmark_agent(env, day_partitions, seed=1, **agent_kwargs):
+    agent = SoftmaxAgent(env_shape=env.get_env_shape(), day_partitions=day_partitions, random_seed=seed,
+                         **dict(BENCHMARK_AGENT_SETTINGS, **agent_kwargs))
+    agent.agent_start()
+    return agent
+
+
+def benchmark_experiment_steps(quick=False):
+    """
+    Steps per second of run_agent_experiment across grid sizes and day partitions
+
+        * Grids come from the indoor scan at several discretizations, with lazy tables so every size fits
+        * The agent is built outside the timed run, so only stepping (and tracking every 1000 steps) is measured
+        * The fast engine is measured at the full grid with the dense tables it requires
+
+    Kwargs:
+        quick (bool): True for fewer steps and repeats
+    Returns:
+        list: result records
+    """
+    steps = 1000 if quick else 5000
+    repeats = 1 if quick else 3
+    results = []
+    cases = [(degree_discretization, day_partitions, 'python', 'lazy') for degree_discretization in GRID_DISCRETIZATIONS
+             for day_partitions in DAY_PARTITIONS]
+    cases.append((GRID_DISCRETIZATIONS[-1], DAY_PARTITIONS[-1], 'fast', 'dense'))
+    for degree_discretization, day_partitions, engine, table_storage in cases:
+        value_array = load_value_array(INDOOR_DATA_PATH, degree_discretization)
+        engine_steps = steps * 10 if engine == 'fast' else steps
+        run_times = []
+        for i in range(repeats):
+            env = create_benchmark_env(value_array, day_partitions)
+            agent = create_benchmark_agent(env, day_partitions, table_storage=table_storage)
+            run_start = time.perf_counter()
+            ef.run_agent_experiment(env, engine_steps, None, day_partitions, None, None, None, None,
+                                    hide_progress_bar=True, engine=engine, agent=agent)
+            run_times.append(time.perf_counter() - run_start)
+            del agent
+        case = format_case(grid='x'.join([str(size) for size in value_array.shape]), day_partitions=day_partitions,
+                           engine=engine, table_storage=table_storage)
+        results.append(create_result('experiment_steps', case, 'steps_per_s', engine_steps / min(run_times),
+                                     'steps/s', True))
+    return results
+
+
+def benchmark_vector_steps(quick=False):
+    """
+    Time per iteration and samples per second of run_vector_agent_experiment across the number of streams
+
+        * Dense tables take every stream's update in one batched operation, lazy tables one stream after another
+        * All streams run on copies of the 13x13 indoor grid with 24 day partitions
+
+    Kwargs:
+        quick (bool): True for fewer steps and repeats
+    Returns:
+        list: result records
+    """
+    steps = 1000 if quick else 5000
+    repeats = 1 if quick else 3
+    value_array = load_value_array(INDOOR_DATA_PATH, GRID_DISCRETIZATIONS[0])
+    results = []
+    for table_storage in ('dense', 'lazy'):
+        for num_streams in NUM_STREAMS:
+            run_time = time_best(lambda: ef.run_vector_agent_experiment(
+                VectorSolarEnv([value_array] * num_streams, roll_frequency=500, time_of_day_max=DAY_PARTITIONS[-1]),
+                steps, 1, DAY_PARTITIONS[-1], BENCHMARK_AGENT_SETTINGS['actor_step_size'], 
+                BENCHMARK_AGENT_SETTINGS['critic_step_size'], BENCHMARK_AGENT_SETTINGS['avg_reward_step_size'], 
+                BENCHMARK_AGENT_SETTINGS['temperature_value'], hide_progress_bar=True, table_storage=table_storage), 
+                repeats)
+            case = format_case(streams=num_streams, table_storage=table_storage)
+            results.append(create_result('vector_steps', case, 'us_per_iteration', run_time / steps * 1e6, 'us',
+                                         False))
+            results.append(create_result('vector_steps', case, 'samples_per_s', steps * num_streams / run_time,
+                                         'samples/s', True))
+    return results
+
+
+def benchmark_agent_memory(quick=False):
+    """
+    Peak memory (traced by tracemalloc) and time of building and starting a SoftmaxAgent on the full grid
+
+        * Dense tables are allocated zeroed, so their peak is the size of the tables even before the pages are used
+
+    Kwargs:
+        quick (bool): True for fewer repeats of the construction timing
+    Returns:
+        list: result records
+    """
+    repeats = 1 if quick else 3
+    value_array = load_value_array(INDOOR_DATA_PATH, GRID_DISCRETIZATIONS[-1])
+    env = create_benchmark_env(value_array, DAY_PARTITIONS[-1])
+    cases = [{'table_storage': 'dense', 'table_dtype': np.float64, 'action_space': 'full'},
+             {'table_storage': 'dense', 'table_dtype': np.float32, 'action_space': 'full'},
+             {'table_storage': 'lazy', 'table_dtype': np.float64, 'action_space': 'full'},
+             {'table_storage': 'dense', 'table_dtype': np.float64, 'action_space': 'local'}]
+    results = []
+    for day_partitions in (1, DAY_PARTITIONS[-1]):
+        for agent_kwargs in cases:
+            case = format_case(day_partitions=day_partitions, table_storage=agent_kwargs['table_storage'],
+                               table_dtype=np.dtype(agent_kwargs['table_dtype']).name,
+                               action_space=agent_kwargs['action_space'])
+            construction_time = time_best(lambda: create_benchmark_agent(env, day_partitions, **agent_kwargs),
+                                          repeats)
+            tracemalloc.start()
+            try:
+                agent = create_benchmark_agent(env, day_partitions, **agent_kwargs)
+                peak_bytes = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            del agent
+            results.append(create_result('agent_memory', case, 'peak_mb', peak_bytes / 2**20, 'MB', False))
+            results.append(create_result('agent_memory', case, 'construction_ms', construction_time * 1000, 'ms',
+                                         False))
+    return results
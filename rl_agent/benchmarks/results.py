@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+# Relative change beyond which a metric counts as a regression or an improvement
+DEFAULT_TOLERANCE = 0.25
+
+# Columns identifying a result across runs
+RESULT_KEY_NAMES = ['benchmark', 'case', 'metric']
+
+
+# Results
+# =============================================
+def create_result(benchmark, case, metric, value, unit, higher_is_better):
+    """
+    Args:
+        benchmark (str): name of the benchmark (see suite.BENCHMARKS)
+        case (str): the parameters of the measurement, e.g. 'grid=37x37,day_partitions=24'
+        metric (str): name of the measured quantity
+        value (float): the measured value
+        unit (str): unit of the value
+        higher_is_better (bool): True for throughputs, False for times and memory
+    Returns:
+        dict: a result record
+    """
+    return {'benchmark': benchmark, 'case': case, 'metric': metric, 'value': float(value), 'unit': unit,
+            'higher_is_better': higher_is_better}
+
+
+def format_case(**params):
+    return ','.join([name + '=' + str(value) for name, value in params.items()])
+
+
+def time_best(function, repeats):
+    """
+    Returns:
+        float: the fastest of repeats calls of function, in seconds (the least disturbed by other load)
+    """
+    run_times = []
+    for i in range(repeats):
+        run_start = time.perf_counter()
+        function()
+        run_times.append(time.perf_counter() - run_start)
+    return min(run_times)
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def create_metadata(quick=False):
+    """
+    Returns:
+        dict: the machine and code the results were measured on
+    """
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': get_git_commit(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'quick': quick
+    }
+
+
+# Storage
+# =============================================
+def save_results(results_path, results, metadata):
+    """
+    Write results as JSON: {'metadata': {...}, 'results': [result records]}
+    """
+    results_dir = os.path.dirname(results_path)
+    if results_dir:
+        os.makedirs(results_dir, exist_ok=True)
+    with open(results_path, 'w') as results_file:
+        json.dump({'metadata': metadata, 'results': results}, results_file, indent=2)
+
+
+def load_results(results_path):
+    """
+    Returns:
+        list, dict: the result records, the metadata written by save_results
+    """
+    with open(results_path) as results_file:
+        stored = json.load(results_file)
+    return stored['results'], stored['metadata']
+
+
+# Comparison
+# =============================================
+def compare_results(results, baseline_results, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare results with a baseline, matching records by benchmark, case and metric
+
+        * change is the relative change in the direction of better (positive is an improvement, for both
+          throughputs and times), and a change below -tolerance is a regression
+        * Timings are only comparable between runs on the same machine with the same quick setting
+
+    Args:
+        results (list): result records (see create_result)
+        baseline_results (list): result records of the baseline
+    Kwargs:
+        tolerance (float): relative change counted as noise
+    Returns:
+        DataFrame: per result, the baseline and current values, the change and a status of 'regression',
+            'improvement', 'ok', 'new' (not in the baseline) or 'missing' (only in the baseline)
+    """
+    baseline_records = {tuple([record[name] for name in RESULT_KEY_NAMES]): record for record in baseline_results}
+    result_keys = set()
+    results_dict_list = []
+    for record in results:
+        key = tuple([record[name] for name in RESULT_KEY_NAMES])
+        result_keys.add(key)
+        baseline_value = baseline_records[key]['value'] if key in baseline_records else np.nan
+        if key not in baseline_records:
+            change = np.nan
+            status = 'new'
+        else:
+            if baseline_value == 0:
+                ratio = 1.0 if record['value'] == 0 else np.inf
+            else:
+                ratio = record['value'] / baseline_value
+            change = ratio - 1 if record['higher_is_better'] else (1 / ratio - 1 if ratio else np.inf)
+            status = 'regression' if change < -tolerance else 'improvement' if change > tolerance else 'ok'
+        results_dict_list.append(dict(zip(RESULT_KEY_NAMES, key), unit=record['unit'], baseline=baseline_value,
+                                      current=record['value'], change=change, status=status))
+    for key, record in baseline_records.items():
+        if key not in result_keys:
+            results_dict_list.append(dict(zip(RESULT_KEY_NAMES, key), unit=record['unit'], baseline=record['value'],
+                                          current=np.nan, change=np.nan, status='missing'))
+    return pd.DataFrame(results_dict_list)
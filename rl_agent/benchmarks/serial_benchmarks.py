@@ -0,0 +1,107 @@
+import time
+import asyncio
+
+import numpy as np
+
+# Module imports
+import arduino_interface
+from arduino_interface import MOTOR_CONTROL, STATE_REQUEST
+from async_arduino_interface import AsyncArduinoDriver
+from simulated_arduino import SimulatedArduino, SimulatedSerial
+from telemetry_frames import FrameParser
+
+from benchmarks.results import create_result, format_case
+from benchmarks.env_benchmarks import INDOOR_DATA_PATH, load_value_array
+
+# Motor positions alternated between by move requests
+MOVE_POSITIONS = [(85, 90), (90, 95)]
+
+
+def get_latency_results(case, latencies_list):
+    """
+    Args:
+        case (str): the case of the results
+        latencies_list (list): round trip latencies (s) of each repeat of a measurement
+    Returns:
+        list: round trips per second and p50/p99 latency result records, each the best over the repeats
+    """
+    return [create_result('serial_round_trips', case, 'round_trips_per_s',
+                          max([len(latencies) / np.sum(latencies) for latencies in latencies_list]), 'round_trips/s',
+                          True),
+            create_result('serial_round_trips', case, 'latency_p50_us',
+                          min([np.percentile(latencies, 50) for latencies in latencies_list]) * 1e6, 'us', False),
+            create_result('serial_round_trips', case, 'latency_p99_us',
+                          min([np.percentile(latencies, 99) for latencies in latencies_list]) * 1e6, 'us', False)]
+
+
+def measure_serial_round_trips(device, num_requests, request, binary_frames=False):
+    """
+    Returns:
+        list: seconds of each lock-step request and response through arduino_interface over a SimulatedSerial
+    """
+    serial_device = SimulatedSerial(device, timeout=2)
+    frame_parser = FrameParser()
+    if binary_frames and not arduino_interface.set_binary_mode(serial_device, reset_output=False):
+        raise RuntimeError('Simulated device did not enter binary mode')
+    latencies = []
+    for i in range(num_requests):
+        request_start = time.perf_counter()
+        arduino_interface.write_serial_line(serial_device, request(i), print_message=False, reset_output=False)
+        if binary_frames:
+            response = arduino_interface.read_state_frame(serial_device, frame_parser)
+        else:
+            response = arduino_interface.read_serial_line(serial_device, print_message=False)
+        latencies.append(time.perf_counter() - request_start)
+        if response is None:
+            raise RuntimeError('Simulated device did not respond')
+    serial_device.close()
+    return latencies
+
+
+async def measure_async_round_trips(device, num_requests):
+    """
+    Returns:
+        list: seconds of each AsyncArduinoDriver.move_motors over the device's in-memory streams
+    """
+    reader, writer = await device.open_connection()
+    latencies = []
+    async with AsyncArduinoDriver(reader, writer) as driver:
+        for i in range(num_requests):
+            request_start = time.perf_counter()
+            await driver.move_motors(*MOVE_POSITIONS[i % 2])
+            latencies.append(time.perf_counter() - request_start)
+    return latencies
+
+
+def benchmark_serial_round_trips(quick=False):
+    """
+    Round trips of the serial drivers against a SimulatedArduino with instant firmware and link
+
+        * With no device or link delays, the measurement is the host side of a round trip: formatting, writing,
+          reading and parsing in arduino_interface (ASCII lines or binary frames) or AsyncArduinoDriver
+        * Each case is repeated and the best value of each metric kept, as sub-millisecond latencies are easily 
+          disturbed by other load
+
+    Kwargs:
+        quick (bool): True for fewer requests and repeats
+    Returns:
+        list: result records
+    """
+    num_requests = 500 if quick else 2000
+    repeats = 1 if quick else 5
+    value_array = load_value_array(INDOOR_DATA_PATH)
+    state_request = lambda i: [STATE_REQUEST]
+    move_request = lambda i: [MOTOR_CONTROL, *MOVE_POSITIONS[i % 2]]
+    results = []
+    for driver, request_name, request, binary_frames in [('arduino_interface', 'state', state_request, False),
+                                                          ('arduino_interface', 'move', move_request, False),
+                                                          ('arduino_interface', 'state', state_request, True)]:
+        latencies_list = [measure_serial_round_trips(SimulatedArduino(value_array), num_requests, request,
+                                                     binary_frames) for i in range(repeats)]
+        case = format_case(driver=driver, request=request_name, format='binary' if binary_frames else 'ascii')
+        results += get_latency_results(case, latencies_list)
+    latencies_list = [asyncio.run(measure_async_round_trips(SimulatedArduino(value_array), num_requests))
+                      for i in range(repeats)]
+    results += get_latency_results(format_case(driver='async_arduino_interface', request='move', format='ascii'),
+                                   latencies_list)
+    return results
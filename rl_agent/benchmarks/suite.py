@@ -0,0 +1,96 @@
+import os
+import sys
+import argparse
+
+import pandas as pd
+
+from benchmarks import results as benchmark_results
+from benchmarks.experiment_benchmarks import benchmark_experiment_steps, benchmark_vector_steps, \
+    benchmark_agent_memory
+from benchmarks.env_benchmarks import benchmark_env_build
+from benchmarks.sweep_benchmarks import benchmark_sweep_throughput
+from benchmarks.serial_benchmarks import benchmark_serial_round_trips
+from benchmarks.collection_benchmarks import benchmark_collection_time
+
+# Benchmarks by name, each taking quick and returning result records
+BENCHMARKS = {
+    'experiment_steps': benchmark_experiment_steps,
+    'vector_steps': benchmark_vector_steps,
+    'agent_memory': benchmark_agent_memory,
+    'env_build': benchmark_env_build,
+    'sweep_throughput': benchmark_sweep_throughput,
+    'serial_round_trips': benchmark_serial_round_trips,
+    'collection_time': benchmark_collection_time
+}
+
+# Results are kept next to the benchmarks, one file per run plus the baseline runs are compared with
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+BASELINE_PATH = os.path.join(RESULTS_DIR, 'baseline.json')
+
+
+def run_benchmarks(names=None, quick=False, print_progress=True):
+    """
+    Args:
+        names (list): names of BENCHMARKS to run, or None for all of them
+    Kwargs:
+        quick (bool): True for shorter runs (only comparable with baselines that were also quick)
+        print_progress (bool): True to print each benchmark's name as it starts
+    Returns:
+        list: result records (see results.create_result)
+    """
+    results = []
+    for name in names or list(BENCHMARKS.keys()):
+        if name not in BENCHMARKS:
+            raise ValueError('Unknown benchmark ' + str(name) + ', expected one of ' + str(list(BENCHMARKS.keys())))
+        if print_progress:
+            print('Running ' + name + '...', flush=True)
+        results += BENCHMARKS[name](quick=quick)
+    return results
+
+
+def main(args=None):
+    """
+    Run the benchmarks, save the results as JSON and compare them with the baseline
+
+    Returns:
+        int: 1 if a metric regressed beyond the tolerance, else 0
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmarks of the rl_agent stack')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default all): ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--quick', action='store_true', help='shorter runs, for a smoke test')
+    parser.add_argument('--output', default=None, help='results JSON (default results/<timestamp>.json)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline JSON to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='also save the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=benchmark_results.DEFAULT_TOLERANCE,
+                        help='relative change counted as noise')
+    args = parser.parse_args(args)
+
+    metadata = benchmark_results.create_metadata(quick=args.quick)
+    results = run_benchmarks(args.names, quick=args.quick)
+    output_path = args.output or os.path.join(RESULTS_DIR, metadata['created'].replace(':', '') + '.json')
+    benchmark_results.save_results(output_path, results, metadata)
+    print('Saved results to ' + output_path)
+
+    exit_code = 0
+    with pd.option_context('display.max_rows', None, 'display.width', 200, 'display.max_colwidth', 80):
+        if os.path.exists(args.baseline):
+            baseline_results, baseline_metadata = benchmark_results.load_results(args.baseline)
+            if baseline_metadata.get('quick') != args.quick:
+                print('Warning: the baseline was run with quick=' + str(baseline_metadata.get('quick')))
+            comparison_df = benchmark_results.compare_results(results, baseline_results, tolerance=args.tolerance)
+            if args.names:
+                comparison_df = comparison_df[comparison_df['benchmark'].isin(args.names)]
+            print('Compared with ' + args.baseline + ' (' + str(baseline_metadata.get('git_commit')) + ', ' +
+                  str(baseline_metadata.get('created')) + ')')
+            print(comparison_df.to_string(index=False, float_format=lambda value: '%.3f' % value))
+            exit_code = int((comparison_df['status'] == 'regression').any())
+        else:
+            print(pd.DataFrame(results).to_string(index=False, float_format=lambda value: '%.3f' % value))
+    if args.save_baseline:
+        benchmark_results.save_results(args.baseline, results, metadata)
+        print('Saved baseline to ' + args.baseline)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import os
+
+# Module imports
+import sweep_runner
+
+from benchmarks.results import create_result, format_case, time_best
+from benchmarks.env_benchmarks import INDOOR_DATA_PATH
+
+# Grid of the benchmark study, 8 combinations
+SWEEP_VALUES = {'temperature_values': [1, 0.1], 'actor_step_size_values': [0.1, 0.01],
+                'critic_step_size_values': [0.1, 0.01], 'avg_reward_step_size_values': [0.01]}
+
+
+def get_default_core_counts():
+    """
+    Returns:
+        list: 1, 2, 4, ... up to the number of cores of the machine
+    """
+    core_counts = [1]
+    while core_counts[-1] * 2 <= (os.cpu_count() or 1):
+        core_counts.append(core_counts[-1] * 2)
+    return core_counts
+
+
+def benchmark_sweep_throughput(quick=False, core_counts=None):
+    """
+    Combinations per second of sweep_runner.run_hyperparam_study against the number of cores
+
+        * Includes starting the pool and sharing the reward array, as a study run from a script would
+
+    Kwargs:
+        quick (bool): True for fewer steps per combination
+        core_counts (list): numbers of cores to measure, or None for get_default_core_counts
+    Returns:
+        list: result records
+    """
+    steps = 500 if quick else 2000
+    num_combinations = 1
+    for values in SWEEP_VALUES.values():
+        num_combinations *= len(values)
+    results = []
+    for cores in core_counts or get_default_core_counts():
+        run_time = time_best(lambda: sweep_runner.run_hyperparam_study(INDOOR_DATA_PATH, 500, steps, seed=1,
+                                                                       day_partitions=24, cores=cores,
+                                                                       hide_progress_bar=True, **SWEEP_VALUES), 1)
+        case = format_case(cores=cores, combinations=num_combinations, steps=steps)
+        results.append(create_result('sweep_throughput', case, 'combinations_per_s', num_combinations / run_time,
+                                     'combinations/s', True))
+    return results
@@ -0,0 +1,393 @@
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+
+# Format version of checkpoint directories
+CHECKPOINT_VERSION = 3
+
+# Name of the file that commits a checkpoint, written last
+CHECKPOINT_META_FILE = 'checkpoint.json'
+
+# Rewrite the row log once it holds this many records per distinct row
+COMPACTION_FACTOR = 4
+
+# Records copied at a time when compacting or restoring the row log
+RECORD_CHUNK_SIZE = 1024
+
+
+def get_row_dtype(num_actions, table_dtype):
+    """
+    Returns:
+        numpy dtype: a record of the row log, one actor/critic row pair of the agent tables
+    """
+    return np.dtype([('partition', '<i4'), ('state', '<i4'), ('actor', table_dtype, (num_actions,)),
+                     ('critic', table_dtype, (num_actions,))])
+
+
+def get_checkpoint_path(directory, name, generation):
+    return os.path.join(directory, name + '_' + str(generation).zfill(6) + ('.bin' if name == 'rows' else '.npz'))
+
+
+def load_checkpoint_meta(directory):
+    """
+    Args:
+        directory (str): a checkpoint directory
+    Returns:
+        dict: the committed checkpoint metadata, or None if there is no checkpoint
+    """
+    meta_path = os.path.join(directory, CHECKPOINT_META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as meta_file:
+        meta = json.load(meta_file)
+    if meta.get('version') != CHECKPOINT_VERSION:
+        return None
+    return meta
+
+
+def get_agent_settings(agent):
+    """
+    Settings of an agent that a checkpoint of it can only be restored into an agent with the same values of
+
+    Args:
+        agent (SoftmaxAgent): the checkpointed agent
+    Returns:
+        dict: json-compatible settings (hyperparameters, seed, random generator, table dtype and shape)
+    """
+    if isinstance(agent.random_seed, np.random.SeedSequence):
+        random_seed = {'entropy': agent.random_seed.entropy, 'spawn_key': list(agent.random_seed.spawn_key)}
+    else:
+        random_seed = agent.random_seed
+    settings = {
+        'actor_step_size': agent.actor_step_size,
+        'critic_step_size': agent.critic_step_size,
+        'avg_reward_step_size': agent.avg_reward_step_size,
+        'temperature': agent.temperature,
+        'rolling_window': agent.rolling_window,
+        'critic_means': agent.critic_means,
+        'action_space': agent.action_space,
+        'random_seed': random_seed,
+        'rng': agent.rng,
+        'table_dtype': np.dtype(agent.actor_array.dtype).str,
+        'agent_shape': agent.agent_shape
+    }
+    # Round trip through json so settings compare equal to the stored ones (tuples become lists, numpy scalars
+    # become python numbers)
+    return json.loads(json.dumps(settings, default=lambda value: value.item()))
+
+
+def get_env_settings(env):
+    """
+    Settings of an environment that a checkpoint can only be restored against an environment with the same values of
+
+    Args:
+        env (SolarEnv): the environment of the checkpointed experiment
+    Returns:
+        dict: json-compatible settings (shape, roll frequency, times of day, movement penalty and a hash of the values)
+    """
+    reward_array = np.ascontiguousarray(env.reward_array_original, dtype=np.float64)
+    settings = {
+        'env_shape': env.get_env_shape(),
+        'roll_frequency': env.roll_frequency,
+        'time_of_day_max': env.time_of_day_max,
+        'movement_penalty': env.movement_penalty,
+        'reward_hash': hashlib.sha256(reward_array.tobytes()).hexdigest()
+    }
+    return json.loads(json.dumps(settings, default=lambda value: value.item()))
+
+
+def format_mismatched_settings(stored_settings, settings):
+    """
+    Returns:
+        str: the settings whose values differ from the stored ones, as 'name stored != current' joined by commas
+            ('' if all match)
+    """
+    return ', '.join([name + ' ' + str(stored_settings.get(name)) + ' != ' + str(settings[name])
+                      for name in settings if stored_settings.get(name) != settings[name]])
+
+
+def check_agent_settings(meta, agent):
+    """
+    Raise a ValueError if an agent does not have the settings of the agent a checkpoint was written from
+    """
+    mismatched = format_mismatched_settings(meta['agent_settings'], get_agent_settings(agent))
+    if mismatched:
+        raise ValueError('Checkpoint was written by an agent with different settings: ' + mismatched)
+
+
+def check_env_settings(meta, env):
+    """
+    Raise a ValueError if an environment does not have the settings of the one a checkpoint was written against
+    """
+    mismatched = format_mismatched_settings(meta['env_settings'], get_env_settings(env))
+    if mismatched:
+        raise ValueError('Checkpoint was written for an environment with different settings: ' + mismatched)
+
+
+def is_checkpoint_finished(directory):
+    meta = load_checkpoint_meta(directory)
+    return meta is not None and meta['finished']
+
+
+def merge_records(pending_records, records, num_states):
+    """
+    Merge the row records of a snapshot into those of an unwritten earlier one
+
+    Returns:
+        numpy array: the records of records and of the rows of pending_records that records does not update
+    """
+    pending_rows = pending_records['partition'].astype(np.int64) * num_states + pending_records['state']
+    rows = records['partition'].astype(np.int64) * num_states + records['state']
+    return np.concatenate([pending_records[~np.isin(pending_rows, rows)], records])
+
+
+def get_latest_record_indices(records, num_states):
+    """
+    Returns:
+        numpy array: sorted indices of the last record of each row in a row log
+    """
+    flat_rows = records['partition'].astype(np.int64) * num_states + records['state']
+    _, reversed_first = np.unique(flat_rows[::-1], return_index=True)
+    return np.sort(len(records) - 1 - reversed_first)
+
+
+class CheckpointWriter:
+    def __init__(self, directory, agent):
+        """
+        Writes incremental checkpoints of a SoftmaxAgent and its SolarEnv from a background thread
+
+            * Each checkpoint appends the actor/critic rows updated since the last one (agent.dirty_rows) to a
+              binary row log, saves the small arrays (state visits, RNG key) and then commits a json metadata file
+            * The step loop only copies the dirty rows, writing and fsync happen on the writer thread
+            * A checkpoint taken while the previous one still waits to be written is merged into it rather than
+              blocking the step loop, so at most one snapshot is pending behind the one being written
+            * The row log is rewritten with one record per row once it grows COMPACTION_FACTOR times larger
+
+        Args:
+            directory (str): directory to write the checkpoint to, continuing a committed checkpoint in it
+            agent (SoftmaxAgent): the agent that will be checkpointed
+        """
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.row_dtype = get_row_dtype(agent.agent_shape[2], agent.actor_array.dtype)
+        meta = load_checkpoint_meta(self.directory)
+        self.generation = meta['generation'] if meta is not None else 0
+        self.row_generation = meta['row_generation'] if meta is not None else 0
+        self.row_records = meta['row_records'] if meta is not None else 0
+        self.distinct_rows = meta['distinct_rows'] if meta is not None else 0
+        self.row_written = np.zeros(agent.agent_shape[:2], dtype=bool)
+        # Drop records written after the last commit
+        with open(get_checkpoint_path(self.directory, 'rows', self.row_generation), 'ab') as rows_file:
+            rows_file.truncate(self.row_records * self.row_dtype.itemsize)
+        if self.row_records > 0:
+            records = np.memmap(get_checkpoint_path(self.directory, 'rows', self.row_generation), dtype=self.row_dtype,
+                                mode='r', shape=(self.row_records,))
+            self.row_written[records['partition'], records['state']] = True
+            del records
+        self.agent_settings = get_agent_settings(agent)
+        # Taken from the env of the first checkpoint
+        self.env_settings = None
+        # A snapshot can be as large as the tables, so at most one waits behind the one being written
+        self.pending_condition = threading.Condition()
+        self.pending_snapshot = None
+        self.closing = False
+        self.write_error = None
+        self.writer_thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer_thread.start()
+
+    def checkpoint(self, step, env, agent, finished=False):
+        """
+        Snapshot the state changed since the last checkpoint and queue it for writing
+
+        Args:
+            step (int): the number of experiment steps completed
+            env (SolarEnv): the environment of the experiment
+            agent (SoftmaxAgent): the agent of the experiment
+        Kwargs:
+            finished (bool): True to mark the experiment as complete
+        Returns:
+            None
+        """
+        if self.write_error is not None:
+            raise self.write_error
+        if self.env_settings is None:
+            self.env_settings = get_env_settings(env)
+        partitions, states = np.nonzero(agent.dirty_rows)
+        records = np.empty(len(partitions), dtype=self.row_dtype)
+        records['partition'] = partitions
+        records['state'] = states
+        if agent.table_storage == 'dense':
+            records['actor'] = agent.actor_array[partitions, states]
+            records['critic'] = agent.critic_array[partitions, states]
+        else:
+            for i in range(len(records)):
+                records['actor'][i] = agent.actor_array[partitions[i], states[i]]
+                records['critic'][i] = agent.critic_array[partitions[i], states[i]]
+        agent.dirty_rows[partitions, states] = False
+        self.row_written[partitions, states] = True
+
+        arrays = {'state_visits': agent.state_visits.copy()}
+        meta = {
+            'version': CHECKPOINT_VERSION,
+            'step': int(step),
+            'finished': bool(finished),
+            'last_state': [int(agent.last_state[0]), int(agent.last_state[1])],
+            'avg_reward': float(agent.avg_reward),
+            'total_reward': float(agent.total_reward),
+            'rolling_reward': float(agent.rolling_reward),
+            'last_delta': float(agent.last_delta),
+            'env_total_steps': int(env.total_steps),
+            'env_time_of_day': int(env.time_of_day),
+            'agent_settings': self.agent_settings,
+            'env_settings': self.env_settings
+        }
+        if isinstance(agent.random_generator, np.random.RandomState):
+            rng_state = agent.random_generator.get_state()
+            arrays['rng_key'] = rng_state[1].copy()
+            meta.update({'rng_pos': int(rng_state[2]), 'rng_has_gauss': int(rng_state[3]),
+                         'rng_cached_gaussian': float(rng_state[4])})
+        else:
+            # Generator bit generator states (e.g. PCG64) are small dicts of ints
+            meta['rng_state'] = agent.random_generator.bit_generator.state
+        with self.pending_condition:
+            if self.pending_snapshot is not None:
+                records = merge_records(self.pending_snapshot[0], records, self.row_written.shape[1])
+            self.pending_snapshot = (records, arrays, meta, int(self.row_written.sum()))
+            self.pending_condition.notify()
+
+    def write_loop(self):
+        while True:
+            with self.pending_condition:
+                while self.pending_snapshot is None and not self.closing:
+                    self.pending_condition.wait()
+                snapshot = self.pending_snapshot
+                self.pending_snapshot = None
+            if snapshot is None:
+                return
+            try:
+                self.write_checkpoint(*snapshot)
+            except Exception as error:
+                self.write_error = error
+            # Release the snapshot while waiting for the next one
+            snapshot = None
+
+    def write_checkpoint(self, records, arrays, meta, distinct_rows):
+        rows_path = get_checkpoint_path(self.directory, 'rows', self.row_generation)
+        with open(rows_path, 'ab') as rows_file:
+            records.tofile(rows_file)
+            rows_file.flush()
+            os.fsync(rows_file.fileno())
+        self.row_records += len(records)
+        self.distinct_rows = distinct_rows
+
+        # Arrays go to a new generation so the committed one stays intact until the metadata is replaced
+        last_generation = self.generation
+        self.generation += 1
+        with open(get_checkpoint_path(self.directory, 'arrays', self.generation), 'wb') as arrays_file:
+            np.savez(arrays_file, **arrays)
+            arrays_file.flush()
+            os.fsync(arrays_file.fileno())
+
+        last_row_generation = self.row_generation
+        if self.row_records > COMPACTION_FACTOR * max(self.distinct_rows, 1):
+            self.compact_rows()
+
+        meta.update({'generation': self.generation, 'row_generation': self.row_generation,
+                     'row_records': self.row_records, 'distinct_rows': self.distinct_rows})
+        meta_path = os.path.join(self.directory, CHECKPOINT_META_FILE)
+        with open(meta_path + '.tmp', 'w') as meta_file:
+            json.dump(meta, meta_file)
+            meta_file.flush()
+            os.fsync(meta_file.fileno())
+        os.replace(meta_path + '.tmp', meta_path)
+
+        # Remove files the new commit no longer references
+        if last_generation > 0:
+            os.remove(get_checkpoint_path(self.directory, 'arrays', last_generation))
+        if last_row_generation != self.row_generation:
+            os.remove(get_checkpoint_path(self.directory, 'rows', last_row_generation))
+
+    def compact_rows(self):
+        """
+        Rewrite the row log as a new generation with only the latest record of each row
+        """
+        records = np.memmap(get_checkpoint_path(self.directory, 'rows', self.row_generation), dtype=self.row_dtype,
+                            mode='r', shape=(self.row_records,))
+        latest_indices = get_latest_record_indices(records, self.row_written.shape[1])
+        self.row_generation += 1
+        with open(get_checkpoint_path(self.directory, 'rows', self.row_generation), 'wb') as rows_file:
+            for start in range(0, len(latest_indices), RECORD_CHUNK_SIZE):
+                records[latest_indices[start:start + RECORD_CHUNK_SIZE]].tofile(rows_file)
+            rows_file.flush()
+            os.fsync(rows_file.fileno())
+        self.row_records = len(latest_indices)
+        del records
+
+    def close(self):
+        """
+        Wait for the pending checkpoint to be written
+        """
+        with self.pending_condition:
+            self.closing = True
+            self.pending_condition.notify()
+        self.writer_thread.join()
+        if self.write_error is not None:
+            raise self.write_error
+
+
+def restore_checkpoint(directory, env, agent):
+    """
+    Restore an agent and environment from the committed checkpoint of a directory
+
+        * Raises a ValueError, before changing anything, if the agent's or environment's settings differ from those
+          of the checkpointed ones (see get_agent_settings and get_env_settings)
+
+    Args:
+        directory (str): a checkpoint directory
+        env (SolarEnv): a new environment with the settings of the checkpointed one
+        agent (SoftmaxAgent): a new started agent with the settings of the checkpointed one
+    Returns:
+        dict: the checkpoint metadata ('step' is the number of completed steps), or None if there is no checkpoint
+    """
+    meta = load_checkpoint_meta(directory)
+    if meta is None:
+        return None
+    check_agent_settings(meta, agent)
+    check_env_settings(meta, env)
+    row_dtype = get_row_dtype(agent.agent_shape[2], agent.actor_array.dtype)
+    if meta['row_records'] > 0:
+        records = np.memmap(get_checkpoint_path(directory, 'rows', meta['row_generation']), dtype=row_dtype,
+                            mode='r', shape=(meta['row_records'],))
+        # Records are in write order, so only the last record of each row is applied
+        latest_indices = get_latest_record_indices(records, agent.agent_shape[1])
+        for start in range(0, len(latest_indices), RECORD_CHUNK_SIZE):
+            chunk = records[latest_indices[start:start + RECORD_CHUNK_SIZE]]
+            if agent.table_storage == 'dense':
+                agent.actor_array[chunk['partition'], chunk['state']] = chunk['actor']
+                agent.critic_array[chunk['partition'], chunk['state']] = chunk['critic']
+            else:
+                for record in chunk:
+                    agent.actor_array[record['partition'], record['state']] = record['actor']
+                    agent.critic_array[record['partition'], record['state']] = record['critic']
+        del records
+    agent.refresh_critic_sums()
+
+    with np.load(get_checkpoint_path(directory, 'arrays', meta['generation'])) as arrays:
+        agent.state_visits[...] = arrays['state_visits']
+        if 'rng_state' in meta:
+            agent.random_generator.bit_generator.state = meta['rng_state']
+        else:
+            agent.random_generator.set_state(('MT19937', arrays['rng_key'], meta['rng_pos'], meta['rng_has_gauss'],
+                                              meta['rng_cached_gaussian']))
+    agent.last_state = tuple(meta['last_state'])
+    agent.last_action = agent.last_state[1]
+    agent.avg_reward = meta['avg_reward']
+    agent.total_reward = meta['total_reward']
+    agent.rolling_reward = meta['rolling_reward']
+    agent.last_delta = meta['last_delta']
+    env.total_steps = meta['env_total_steps']
+    env.time_of_day = meta['env_time_of_day']
+    return meta
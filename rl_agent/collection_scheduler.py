@@ -0,0 +1,209 @@
+import time
+import asyncio
+
+import numpy as np
+import pandas as pd
+
+import tqdm
+from tqdm import tqdm
+
+# Module imports
+import async_arduino_interface as aai
+from async_arduino_interface import AsyncArduinoDriver
+from arduino_interface import map_message_to_dict
+from simulated_arduino import SERVO_DEGREE_STEP, SERVO_STEP_DELAY, SERVO_SWITCH_DELAY
+
+# Servo range of the firmware
+MAX_MOTOR_DEGREE = 180
+
+# Columns of collected data, matching the csv files in simulation_data/data
+COLLECTION_COLUMNS = ['timestamp', 'state', 'arduino_duration', 'motor_1_position', 'motor_2_position', 'I_ivp_1',
+                      'V_ivp_1', 'P_ivp_1', 't_relative']
+
+
+# Planning
+# =============================================
+def create_serpentine_plan(degree_discretization=5, start_position=(90, 90), max_degree=MAX_MOTOR_DEGREE):
+    """
+    Plan a visit of every grid position in a serpentine order, so each move is a single grid step
+
+        * Motor 1 steps once per row while motor 2 sweeps back and forth, which is the shortest tour of the grid
+        * The tour starts from the corner closest to start_position
+
+    Kwargs:
+        degree_discretization (int): degrees between grid positions
+        start_position (tuple): motor positions before the first move
+        max_degree (int): largest motor position
+    Returns:
+        list: (motor 1 position, motor 2 position) tuples in visiting order
+    """
+    degrees = list(range(0, max_degree + 1, degree_discretization))
+    motor_1_degrees = degrees if start_position[0] <= max_degree / 2 else degrees[::-1]
+    motor_2_degrees = degrees if start_position[1] <= max_degree / 2 else degrees[::-1]
+    plan = []
+    for row, motor_1_degree in enumerate(motor_1_degrees):
+        row_degrees = motor_2_degrees if row % 2 == 0 else motor_2_degrees[::-1]
+        plan.extend([(motor_1_degree, motor_2_degree) for motor_2_degree in row_degrees])
+    return plan
+
+
+def create_refinement_plan(value_array, degree_discretization=5, refine_radius=1, refine_degree_step=1,
+                           start_position=(90, 90), max_degree=MAX_MOTOR_DEGREE):
+    """
+    Plan finer positions inside the cells around the power maximum of a coverage pass
+
+        * Refined rows fall into the same cells as the grid positions, so use convert_solar_df_to_value_array
+          with reduction='mean' or 'max' to make use of them
+
+    Args:
+        value_array (numpy array): power per cell from the coverage pass
+    Kwargs:
+        degree_discretization (int): degrees per cell
+        refine_radius (int): cells around the maximum to refine (1 refines a 3x3 block)
+        refine_degree_step (int): degrees between refined positions
+        start_position (tuple): motor positions before the first refined move
+        max_degree (int): largest motor position
+    Returns:
+        list: (motor 1 position, motor 2 position) tuples in serpentine order
+    """
+    max_cell = np.unravel_index(np.argmax(value_array), value_array.shape)
+    cell_ranges = [range(max(0, max_cell[axis] - refine_radius), min(value_array.shape[axis], max_cell[axis] + refine_radius + 1))
+                   for axis in range(2)]
+    axis_degrees = [sorted({cell * degree_discretization + offset for cell in cell_range
+                            for offset in range(0, degree_discretization, refine_degree_step)
+                            if cell * degree_discretization + offset <= max_degree})
+                    for cell_range in cell_ranges]
+    if abs(start_position[0] - axis_degrees[0][-1]) < abs(start_position[0] - axis_degrees[0][0]):
+        axis_degrees[0] = axis_degrees[0][::-1]
+    plan = []
+    for row, motor_1_degree in enumerate(axis_degrees[0]):
+        row_degrees = axis_degrees[1] if row % 2 == 0 else axis_degrees[1][::-1]
+        plan.extend([(motor_1_degree, motor_2_degree) for motor_2_degree in row_degrees
+                     if motor_1_degree % degree_discretization or motor_2_degree % degree_discretization])
+    return plan
+
+
+def estimate_move_time(from_position, to_position):
+    """
+    Returns:
+        float: seconds the firmware takes to move the servos between two positions (stepped writes + switch delay)
+    """
+    move_steps = (abs(from_position[0] - to_position[0]) // SERVO_DEGREE_STEP +
+                  abs(from_position[1] - to_position[1]) // SERVO_DEGREE_STEP)
+    return move_steps * SERVO_STEP_DELAY + SERVO_SWITCH_DELAY
+
+
+def estimate_plan_time(plan, start_position=(90, 90)):
+    """
+    Returns:
+        float: seconds of servo time to visit every position of a plan in order
+    """
+    positions = [start_position] + list(plan)
+    return sum([estimate_move_time(positions[i], positions[i + 1]) for i in range(len(plan))])
+
+
+# Collection
+# =============================================
+def get_measured_power(response):
+    return abs(float(response[4])) * float(response[5])
+
+
+def get_row_power(row):
+    return abs(float(row['I_ivp_1'])) * float(row['V_ivp_1'])
+
+
+async def measure_position(driver:AsyncArduinoDriver, position, settle_reads=0, settle_tolerance=0.001):
+    """
+    Move to a position and return its measurement once it has settled
+
+        * The response to the move is the first reading; with settle_reads, the state is requested again until
+          the power changes by at most settle_tolerance between readings
+
+    Args:
+        driver (AsyncArduinoDriver): a started driver
+        position (tuple): motor positions to measure
+    Kwargs:
+        settle_reads (int): maximum extra readings to wait for the power to settle
+        settle_tolerance (float): change in power (W) between readings considered settled
+    Returns:
+        dict: the measurement as a row of collected data
+    """
+    response = await driver.move_motors(position[0], position[1])
+    for read in range(settle_reads):
+        next_response = await driver.request_state()
+        settled = abs(get_measured_power(next_response) - get_measured_power(response)) <= settle_tolerance
+        response = next_response
+        if settled:
+            break
+    return map_message_to_dict(time.time(), response)
+
+
+async def run_collection(driver:AsyncArduinoDriver, degree_discretization=5, start_position=(90, 90), settle_reads=0,
+                         settle_tolerance=0.001, refine=False, refine_radius=1, refine_degree_step=1,
+                         hide_progress_bar=False):
+    """
+    Measure every grid position in serpentine order, sending each move as soon as the last measurement settles
+
+    Args:
+        driver (AsyncArduinoDriver): a started driver
+    Kwargs:
+        degree_discretization (int): degrees between grid positions
+        start_position (tuple): motor positions before the first move
+        settle_reads (int): maximum extra readings to wait for the power to settle at each position
+        settle_tolerance (float): change in power (W) between readings considered settled
+        refine (bool): True to measure finer positions around the power maximum after the coverage pass
+        refine_radius (int): cells around the maximum to refine
+        refine_degree_step (int): degrees between refined positions
+        hide_progress_bar (bool): Set to True to hide the tqdm bar
+    Returns:
+        DataFrame: the collected data with COLLECTION_COLUMNS
+    """
+    plan = create_serpentine_plan(degree_discretization, start_position=start_position)
+    data_dict_list = []
+    for position in tqdm(plan, disable=hide_progress_bar):
+        data_dict_list.append(await measure_position(driver, position, settle_reads, settle_tolerance))
+
+    if refine:
+        grid_size = MAX_MOTOR_DEGREE // degree_discretization + 1
+        value_array = np.zeros((grid_size, grid_size))
+        for row in data_dict_list:
+            value_array[int(row['motor_1_position']) // degree_discretization,
+                        int(row['motor_2_position']) // degree_discretization] = get_row_power(row)
+        refinement_plan = create_refinement_plan(value_array, degree_discretization, refine_radius, refine_degree_step,
+                                                 start_position=plan[-1])
+        for position in tqdm(refinement_plan, disable=hide_progress_bar):
+            data_dict_list.append(await measure_position(driver, position, settle_reads, settle_tolerance))
+
+    # Return to the start position
+    await driver.move_motors(start_position[0], start_position[1])
+
+    data_df = pd.DataFrame(data_dict_list)
+    data_df['t_relative'] = data_df['timestamp'] - data_df['timestamp'].iloc[0]
+    return data_df[COLLECTION_COLUMNS]
+
+
+def collect_simulation_data(serial_port, output_path=None, baud_rate=9600, **collection_kwargs):
+    """
+    Collect a simulation data set from the panel with run_collection
+
+    Args:
+        serial_port (str): the serial port of the Arduino
+    Kwargs:
+        output_path (str): csv path to write the data to, or None to only return it
+        baud_rate (int): baud rate of the port
+        collection_kwargs: passed to run_collection
+    Returns:
+        DataFrame: the collected data
+    """
+    async def collect():
+        reader, writer, serial_device = await aai.open_serial_connection(serial_port, baud_rate=baud_rate)
+        try:
+            async with AsyncArduinoDriver(reader, writer) as driver:
+                return await run_collection(driver, **collection_kwargs)
+        finally:
+            serial_device.close()
+
+    data_df = asyncio.run(collect())
+    if output_path is not None:
+        data_df.to_csv(output_path, index=False)
+    return data_df
@@ -36,4 +36,15 @@ def convert_motor_positions_to_1d_index(position_tuple, dimensions=ARRAY_DIMENSI
     return convert_2d_index_to_1d_index(convert_motor_positions_to_2d_index(position_tuple), dimensions)
 
 def convert_1d_index_to_motor_positions(index, dimensions=ARRAY_DIMENSION_TUPLE):
-    return convert_2d_index_to_motor_positions(convert_1d_index_to_2d_index(index, dimensions))
\ No newline at end of file
+    return convert_2d_index_to_motor_positions(convert_1d_index_to_2d_index(index, dimensions))
+
+# Result files
+
+def repair_result_file(results_path):
+    """
+    Drop a partly written last row of an appended csv, left when a run is interrupted during a write
+    """
+    with open(results_path, 'rb+') as results_file:
+        data = results_file.read()
+        if data and not data.endswith(b'\n'):
+            results_file.truncate(data.rfind(b'\n') + 1)
@@ -1,6 +1,8 @@
 # Normal imports
+import os
 import serial
 import time
+import math
 import random
 import pandas as pd
 import numpy as np
@@ -15,16 +17,27 @@ from tqdm import tqdm
 
 # Module imports
 import rl_agent
-from rl_agent import SoftmaxAgent
+from rl_agent import SoftmaxAgent, BatchSoftmaxAgent, VectorSoftmaxAgent
 
 import solar_env
-from solar_env import SolarEnv
+from solar_env import SolarEnv, VectorSolarEnv
+
+import simulation_kernel
+import tracking
+import checkpoint
+import step_profiler
 
 from common_functions import *
 
+# Max steps per kernel call of the fast engine, so the progress bar still updates
+FAST_ENGINE_CHUNK_STEPS = 100000
+
+# Subdirectory of a checkpoint directory that the tracking of an experiment without a tracking_dir is streamed to
+CHECKPOINT_TRACKING_DIR = 'tracking'
+
 
 # Run individual step of experiment
-def run_experiment_step(env:SolarEnv, agent:SoftmaxAgent, step):
+def run_experiment_step(env:SolarEnv, agent:SoftmaxAgent, step, profiler=None):
     """
     Carry out one step of interaction between agent and environment
     
@@ -32,17 +45,29 @@ def run_experiment_step(env:SolarEnv, agent:SoftmaxAgent, step):
         env (SolarEnv): the environment being used in the experiment
         agent (SoftmaxAgent): the agent being used in the experiment
         step (int): the step number of the experiment
+    Kwargs:
+        profiler (StepProfiler): a started step_profiler.StepProfiler to time the index conversions with as a phase 
+            (the agent and environment phases are timed by instrumenting them), or None
     Returns:
         None
     """
     
     action = agent.agent_policy()
-    reward, next_state_tuple = env.env_step(convert_1d_index_to_2d_index(action, env.get_env_shape()), 
-                                            convert_1d_index_to_2d_index(agent.get_agent_last_state()[1], env.get_env_shape()))
+    if profiler is not None:
+        profiler.enter('index_conversion')
+    action_tuple = convert_1d_index_to_2d_index(action, env.get_env_shape())
+    last_state_tuple = convert_1d_index_to_2d_index(agent.get_agent_last_state()[1], env.get_env_shape())
+    if profiler is not None:
+        profiler.exit()
+    reward, next_state_tuple = env.env_step(action_tuple, last_state_tuple)
+    if profiler is not None:
+        profiler.enter('index_conversion')
     next_state_tuple = (next_state_tuple[0], convert_2d_index_to_1d_index(next_state_tuple[1], env.get_env_shape()))
+    if profiler is not None:
+        profiler.exit()
     agent.agent_step(reward, next_state_tuple)
-    
-    
+
+
 # Creates a dict for metrics at a single step of an experiment
 def create_tracking_dict(step, env:SolarEnv, agent:SoftmaxAgent):
     """
@@ -69,10 +94,45 @@ def create_tracking_dict(step, env:SolarEnv, agent:SoftmaxAgent):
     return tracking_dict
 
 
+# Runs the steps of an experiment through the simulation kernel
+def run_kernel_experiment_steps(env:SolarEnv, agent:SoftmaxAgent, steps, log_tracking, logging_interval, 
+                                hide_progress_bar=False, start_step=0):
+    """
+    Run the steps of an experiment in kernel calls that stop at each logging point
+    
+    Args:
+        env (SolarEnv): the environment being used in the experiment
+        agent (SoftmaxAgent): the started agent being used in the experiment
+        steps (int): the number of steps to run
+        log_tracking (function): called with the step number at each logging point
+        logging_interval (int): frequency of steps to log metrics, None to avoid logging
+    Kwargs:
+        hide_progress_bar (bool): Set to True to hide the tqdm bar
+        start_step (int): the number of steps already completed, when resuming
+    Returns:
+        None
+    """
+    progress_bar = tqdm(total=steps, initial=start_step, disable=hide_progress_bar)
+    step = start_step
+    while step < steps:
+        chunk_steps = min(steps - step, FAST_ENGINE_CHUNK_STEPS)
+        if logging_interval is not None:
+            chunk_steps = min(chunk_steps, logging_interval - step % logging_interval)
+        simulation_kernel.run_kernel_steps(env, agent, chunk_steps)
+        step += chunk_steps
+        progress_bar.update(chunk_steps)
+        if logging_interval is not None and step % logging_interval == 0:
+            log_tracking(step)
+    progress_bar.close()
+
+
 # Runs an experiment end to end
 def run_agent_experiment(environment:SolarEnv, steps, seed, day_partitions, actor_step_size, critic_step_size, 
                          avg_reward_step_size, temperature, rolling_steps_measurement=10, 
-                         logging_interval=1000, hide_progress_bar=False, metric='total_reward'):
+                         logging_interval=1000, hide_progress_bar=False, metric='total_reward', 
+                         table_storage='dense', table_dtype=np.float64, engine='python', tracking_dir=None, 
+                         agent=None, checkpoint_dir=None, checkpoint_interval=100000, critic_means='reduce', 
+                         action_space='full', neighborhood_radius=2, rng='legacy', profiler=None):
     """
     Run an end-to-end experiment with the agent and determine the total reward during the experiment
     
@@ -88,40 +148,138 @@ def run_agent_experiment(environment:SolarEnv, steps, seed, day_partitions, acto
         rolling_steps_measurement (int): For tracking, the rolling avg steps for calculating running power from agent
         logging_interval (int): Frequency of steps to log metrics from experiment, None to avoid logging
         hide_progress_bar (bool): Set to True to hide the tqdm bar
+        table_storage (str): 'dense' or 'lazy' actor/critic storage for the agent
+        table_dtype (numpy dtype): dtype of the agent's actor/critic
+        engine (str): 'python' to step through run_experiment_step, 'fast' to run steps in the simulation kernel
+            (compiled with numba when installed, see simulation_kernel)
+        tracking_dir (str): directory to stream tracking metrics to with a tracking.TrackingLogger, or None to keep 
+            them in memory (streamed to CHECKPOINT_TRACKING_DIR of checkpoint_dir when checkpointing); a resumed 
+            experiment keeps the metrics logged before its checkpoint and appends to them
+        agent (SoftmaxAgent): a started agent to continue training instead of creating a new one, with the 
+            environment it was trained on (agent settings above are then ignored)
+        checkpoint_dir (str): directory to checkpoint the agent and environment to every checkpoint_interval steps; 
+            an experiment with a checkpoint there resumes from it (see checkpoint.CheckpointWriter)
+        checkpoint_interval (int): frequency of steps to checkpoint at
+        critic_means (str): 'reduce' or 'running' critic state values for the agent (see SoftmaxAgent)
+        action_space (str): 'full' or 'local' action space for the agent (see SoftmaxAgent)
+        neighborhood_radius (int): largest move along each motor axis for action_space='local'
+        rng (str): 'legacy' or 'pcg64' random generator for the agent (see rl_agent.create_random_generator)
+        profiler (StepProfiler): a step_profiler.StepProfiler to time the phases of each step with, dumping its 
+            summary table and collapsed stacks at the end of the experiment (python engine only)
     Returns:
         float, DataFrame: the total reward the agent achieved in experiment, the tracking df of results in steps
+            (a tracking.TrackingStore instead of the df when tracking_dir is set)
     """
     
-    # Create agent with properties
-    experiment_agent = SoftmaxAgent(actor_step_size=actor_step_size, critic_step_size=critic_step_size,
-                                avg_reward_step_size=avg_reward_step_size,
-                                temperature_value=temperature, env_shape=environment.get_env_shape(), 
-                                reward_rolling_avg_window=rolling_steps_measurement, day_partitions=day_partitions, 
-                                    random_seed=seed)
-    # Initialize Agent
-    experiment_agent.agent_start()
+    if profiler is not None and engine != 'python':
+        raise ValueError('profiler requires engine="python", got ' + str(engine))
+    
+    # Create agent with properties, unless continuing one
+    if agent is not None:
+        experiment_agent = agent
+    else:
+        experiment_agent = SoftmaxAgent(actor_step_size=actor_step_size, critic_step_size=critic_step_size,
+                                    avg_reward_step_size=avg_reward_step_size,
+                                    temperature_value=temperature, env_shape=environment.get_env_shape(), 
+                                    reward_rolling_avg_window=rolling_steps_measurement, day_partitions=day_partitions, 
+                                        random_seed=seed, table_storage=table_storage, table_dtype=table_dtype, 
+                                        critic_means=critic_means, action_space=action_space, 
+                                        neighborhood_radius=neighborhood_radius, rng=rng)
+        # Initialize Agent
+        experiment_agent.agent_start()
     
-    # Initialize a tradcking dict
-    tracking_dict_list = []
-    tracking_dict_list.append(create_tracking_dict(step=0, env=environment, agent=experiment_agent))
+    # Resume from the checkpoint of a previous run, if any
+    start_step = 0
+    if checkpoint_dir is not None:
+        checkpoint_meta = checkpoint.restore_checkpoint(checkpoint_dir, environment, experiment_agent)
+        if checkpoint_meta is not None:
+            start_step = checkpoint_meta['step']
+        checkpoint_writer = checkpoint.CheckpointWriter(checkpoint_dir, experiment_agent)
     
-    # Only do one conditional logging check to improve runtime
-    if logging_interval is not None:
-        # Run specified number of steps
-        for i in tqdm(range(1, steps + 1), disable=hide_progress_bar):
-            run_experiment_step(environment, experiment_agent, step=i)
-            if i % logging_interval == 0:
-                tracking_dict_list.append(create_tracking_dict(step=i, env=environment, agent=experiment_agent))
-        tracking_df = pd.DataFrame(tracking_dict_list)
+    # Initialize a tracking sink -- a streaming logger if a directory is given, otherwise a list of tracking dicts.
+    # A checkpointed experiment streams its tracking next to the checkpoint, so a resumed run keeps the earlier rows
+    tracking_path = tracking_dir
+    if tracking_path is None and checkpoint_dir is not None:
+        tracking_path = os.path.join(checkpoint_dir, CHECKPOINT_TRACKING_DIR)
+    stream_tracking = tracking_path is not None and logging_interval is not None
+    if stream_tracking:
+        tracking_logger = tracking.TrackingLogger(tracking_path, environment.get_env_shape(), 
+                                                  resume_step=start_step if checkpoint_dir is not None else None)
+        log_tracking = lambda step: tracking_logger.log(step, environment, experiment_agent)
+    else:
+        tracking_dict_list = []
+        log_tracking = lambda step: tracking_dict_list.append(create_tracking_dict(step=step, env=environment, 
+                                                                                   agent=experiment_agent))
+    log_tracking(start_step)
     
-    # If no logging, just run the experiment straight
+    # Logging and checkpointing happen at multiples of a common event interval
+    def handle_event(step):
+        if logging_interval is not None and step % logging_interval == 0:
+            log_tracking(step)
+        if checkpoint_dir is not None and step % checkpoint_interval == 0:
+            # Tracking on disk covers every step up to the checkpoint a later run resumes from
+            if stream_tracking:
+                tracking_logger.flush()
+            checkpoint_writer.checkpoint(step, environment, experiment_agent)
+    if checkpoint_dir is None:
+        event_interval = logging_interval
+    elif logging_interval is None:
+        event_interval = checkpoint_interval
     else:
-        for i in tqdm(range(1, steps + 1), disable=hide_progress_bar):
-            run_experiment_step(environment, experiment_agent, step=i)
+        event_interval = math.gcd(logging_interval, checkpoint_interval)
+    
+    # Time the phases of each step, and logging and checkpointing, through the profiler, removing its wrappers 
+    # and stopping it even if the experiment fails
+    step_function = run_experiment_step
+    try:
+        if profiler is not None:
+            profiler.instrument(experiment_agent, step_profiler.AGENT_PHASES)
+            profiler.instrument(environment, step_profiler.ENV_PHASES)
+            profile_step = profiler.wrap('run_experiment_step', run_experiment_step)
+            step_function = lambda env, agent, step: profile_step(env, agent, step, profiler=profiler)
+            handle_event = profiler.wrap('handle_event', handle_event)
+            profiler.start()
+        
+        # Fast engine handles logging between kernel calls
+        if engine == 'fast':
+            run_kernel_experiment_steps(environment, experiment_agent, steps, handle_event, event_interval,
+                                        hide_progress_bar=hide_progress_bar, start_step=start_step)
+        
+        # Only do one conditional logging check to improve runtime
+        elif event_interval is not None:
+            # Run specified number of steps
+            for i in tqdm(range(start_step + 1, steps + 1), disable=hide_progress_bar):
+                step_function(environment, experiment_agent, step=i)
+                if i % event_interval == 0:
+                    handle_event(i)
+        
+        # If no logging, just run the experiment straight
+        else:
+            for i in tqdm(range(start_step + 1, steps + 1), disable=hide_progress_bar):
+                step_function(environment, experiment_agent, step=i)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    if profiler is not None:
+        profiler.dump()
+    
+    # Mark the checkpoint complete
+    if checkpoint_dir is not None:
+        checkpoint_writer.checkpoint(steps, environment, experiment_agent, finished=True)
+        checkpoint_writer.close()
+    
+    # Collect the tracking results
+    if logging_interval is None:
         tracking_df = pd.DataFrame() # empty df
+    elif stream_tracking:
+        tracking_df = tracking_logger.close()
+        if tracking_dir is None:
+            tracking_df = tracking_df.get_tracking_df()
+    else:
+        tracking_df = pd.DataFrame(tracking_dict_list)
     
     # Return total reward from experiment
-    if not tracking_df.empty:
+    if logging_interval is not None:
         if metric == 'total_reward':
             return experiment_agent.get_agent_total_reward(), tracking_df
         else:
@@ -130,4 +288,157 @@ def run_agent_experiment(environment:SolarEnv, steps, seed, day_partitions, acto
         if metric == 'total_reward': 
             return experiment_agent.get_agent_total_reward()
         else:
-            return experiment_agent.get_agent_rolling_reward()
\ No newline at end of file
+            return experiment_agent.get_agent_rolling_reward()
+
+
+# Run individual step of a batched experiment
+def run_batch_experiment_step(env:SolarEnv, agent:BatchSoftmaxAgent, step):
+    """
+    Carry out one step of interaction between every agent of a batch and the environment
+    
+        * SolarEnv indexing and index conversions are array-aware, so one env_step serves all agents
+    
+    Args:
+        env (SolarEnv): the environment being used in the experiment
+        agent (BatchSoftmaxAgent): the batch of agents being used in the experiment
+        step (int): the step number of the experiment
+    Returns:
+        None
+    """
+    
+    actions = agent.agent_policy()
+    reward, next_state_tuple = env.env_step(convert_1d_index_to_2d_index(actions, env.get_env_shape()), 
+                                            convert_1d_index_to_2d_index(agent.get_agent_last_state()[1], env.get_env_shape()))
+    next_state_tuple = (next_state_tuple[0], convert_2d_index_to_1d_index(next_state_tuple[1], env.get_env_shape()))
+    agent.agent_step(reward, next_state_tuple)
+
+
+# Runs a batch of experiments end to end
+def run_batch_agent_experiment(environment:SolarEnv, steps, seed, day_partitions, actor_step_sizes, critic_step_sizes, 
+                               avg_reward_step_sizes, temperatures, rolling_steps_measurement=10, 
+                               hide_progress_bar=False, metric='total_reward', table_storage='dense', 
+                               table_dtype=np.float64, rng='legacy'):
+    """
+    Run one experiment per hyperparameter combination in lock-step with a BatchSoftmaxAgent
+    
+        * Matches calling run_agent_experiment once per combination with logging_interval=None and the same 
+          table_storage and table_dtype
+        * Dense tables take 2 * N * day_partitions * states**2 entries (about 720 MB per agent for the 37x37 grid 
+          with 24 partitions in float64), so use table_storage='lazy' or split large sweeps into batches
+    
+    Args:
+        environment (SolarEnv): The environment class for the agents to interact with
+        steps (int): The number of steps to run the experiment for
+        seed (int or list): The random seed for all agents (spawned into a SeedSequence child per agent for 
+            rng='pcg64', see BatchSoftmaxAgent), or one seed per agent
+        day_partitions (int): The number of time of day partitions tracked as state
+        actor_step_sizes (list): Step-size parameter for actor of each agent
+        critic_step_sizes (list): Step-size parameter for critic of each agent
+        avg_reward_step_sizes (list): Step-size parameter for avg reward of each agent
+        temperatures (list): Temperature parameter for actor policy of each agent
+    Kwargs:
+        rolling_steps_measurement (int): For tracking, the rolling avg steps for calculating running power from agent
+        hide_progress_bar (bool): Set to True to hide the tqdm bar
+        metric (str): 'total_reward' or 'rolling_reward'
+        table_storage (str): 'dense' or 'lazy' actor/critic storage for the agents
+        table_dtype (numpy dtype): dtype of the agents' actor/critic
+        rng (str): 'legacy' or 'pcg64' random generators for the agents (see rl_agent.create_random_generator)
+    Returns:
+        numpy array: the metric each agent achieved in the experiment
+    """
+    
+    # Create the batch of agents
+    experiment_agent = BatchSoftmaxAgent(actor_step_sizes=actor_step_sizes, critic_step_sizes=critic_step_sizes,
+                                         avg_reward_step_sizes=avg_reward_step_sizes, 
+                                         temperature_values=temperatures, env_shape=environment.get_env_shape(),
+                                         reward_rolling_avg_window=rolling_steps_measurement, 
+                                         day_partitions=day_partitions, random_seeds=seed, 
+                                         table_storage=table_storage, table_dtype=table_dtype, rng=rng)
+    experiment_agent.agent_start()
+    
+    for i in tqdm(range(1, steps + 1), disable=hide_progress_bar):
+        run_batch_experiment_step(environment, experiment_agent, step=i)
+    
+    if metric == 'total_reward':
+        return experiment_agent.get_agent_total_reward()
+    else:
+        return experiment_agent.get_agent_rolling_reward()
+
+
+def run_vector_experiment_step(env:VectorSolarEnv, agent:VectorSoftmaxAgent, step):
+    """
+    Carry out one step of interaction between a shared agent and every environment of a VectorSolarEnv
+    
+    Args:
+        env (VectorSolarEnv): the environments being used in the experiment
+        agent (VectorSoftmaxAgent): the agent being used in the experiment
+        step (int): the step number of the experiment
+    Returns:
+        None
+    """
+    
+    actions = agent.agent_policy()
+    reward, next_state_tuple = env.env_step(convert_1d_index_to_2d_index(actions, env.get_env_shape()), 
+                                            convert_1d_index_to_2d_index(agent.get_agent_last_state()[1], env.get_env_shape()))
+    next_state_tuple = (next_state_tuple[0], convert_2d_index_to_1d_index(next_state_tuple[1], env.get_env_shape()))
+    agent.agent_step(reward, next_state_tuple)
+
+
+# Runs one agent over several environments end to end
+def run_vector_agent_experiment(environment:VectorSolarEnv, steps, seed, day_partitions, actor_step_size, 
+                                critic_step_size, avg_reward_step_size, temperature, rolling_steps_measurement=10, 
+                                hide_progress_bar=False, metric='total_reward', agent=None, table_storage='dense', 
+                                table_dtype=np.float64, critic_means='reduce', action_space='full', 
+                                neighborhood_radius=2, rng='legacy'):
+    """
+    Run an experiment with one agent learning from every environment of a VectorSolarEnv each step
+    
+        * Each step gives the agent one transition per environment, so steps * M transitions in total
+        * With a single environment, matches run_agent_experiment with logging_interval=None
+    
+    Args:
+        environment (VectorSolarEnv): The environments for the agent to interact with
+        steps (int): The number of steps to run the experiment for
+        seed (int): The random seed number to use for the agent
+        day_partitions (int): The number of time of day partitions tracked as state
+        actor_step_size (float): Step-size parameter for actor in agent
+        critic_step_size (float): Step-size parameter for critic in agent
+        avg_reward_step_size (float): Step-size parameter for avg reward in agent
+        temperature (float): Temperature parameter for actor policy
+    Kwargs:
+        rolling_steps_measurement (int): For tracking, the rolling avg steps for calculating running power from agent
+        hide_progress_bar (bool): Set to True to hide the tqdm bar
+        metric (str): 'total_reward' or 'rolling_reward'
+        agent (VectorSoftmaxAgent): a started agent to continue training instead of creating a new one
+        table_storage (str): 'dense' or 'lazy' actor/critic storage for the agent
+        table_dtype (numpy dtype): dtype of the agent's actor/critic
+        critic_means (str): 'reduce' or 'running' critic state values for the agent (see SoftmaxAgent)
+        action_space (str): 'full' or 'local' action space for the agent (see SoftmaxAgent)
+        neighborhood_radius (int): largest move along each motor axis for action_space='local'
+        rng (str): 'legacy' or 'pcg64' random generator for the agent (see rl_agent.create_random_generator)
+    Returns:
+        numpy array: the metric the agent achieved in each environment
+    """
+    
+    # Create the agent, starting each stream at its environment's time of day
+    if agent is not None:
+        experiment_agent = agent
+    else:
+        experiment_agent = VectorSoftmaxAgent(actor_step_size=actor_step_size, critic_step_size=critic_step_size,
+                                              avg_reward_step_size=avg_reward_step_size, 
+                                              temperature_value=temperature, env_shape=environment.get_env_shape(),
+                                              reward_rolling_avg_window=rolling_steps_measurement, 
+                                              day_partitions=day_partitions, num_streams=environment.get_num_envs(), 
+                                              random_seed=seed, table_storage=table_storage, 
+                                              table_dtype=table_dtype, critic_means=critic_means, 
+                                              action_space=action_space, neighborhood_radius=neighborhood_radius, 
+                                              rng=rng)
+        experiment_agent.agent_start(environment.time_of_day)
+    
+    for i in tqdm(range(1, steps + 1), disable=hide_progress_bar):
+        run_vector_experiment_step(environment, experiment_agent, step=i)
+    
+    if metric == 'total_reward':
+        return experiment_agent.get_agent_total_reward()
+    else:
+        return experiment_agent.get_agent_rolling_reward()
@@ -0,0 +1,147 @@
+import os
+import csv
+import multiprocessing as mp
+
+import pandas as pd
+
+import tqdm
+from tqdm import tqdm
+
+# Module imports
+from common_functions import repair_result_file
+
+
+# Result files
+# =============================================
+def get_key_value(value):
+    """
+    Returns:
+        str: a task value as compared between tasks and result rows, numbers as repr(float) so 1, 1.0 and '1' 
+            (as read back from a csv) match
+    """
+    try:
+        return repr(float(value))
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def get_task_key(task, key_names):
+    """
+    Returns:
+        tuple: the values of a task that identify it in a result file (see get_key_value)
+    """
+    return tuple([get_key_value(task[name]) for name in key_names])
+
+
+def load_stored_rows(results_path, key_names):
+    """
+    Args:
+        results_path (str): a csv written by ResultWriter
+        key_names (list): the columns identifying a task
+    Returns:
+        dict: the result rows in the file keyed by get_task_key
+    """
+    if not os.path.exists(results_path) or os.path.getsize(results_path) == 0:
+        return {}
+    repair_result_file(results_path)
+    stored_df = pd.read_csv(results_path, float_precision='round_trip')
+    return {get_task_key(row, key_names): row for row in stored_df.to_dict('records')}
+
+
+class ResultWriter:
+    def __init__(self, results_path, columns):
+        """
+        Appends result rows to a csv as they arrive, so finished results survive an interrupted run
+
+        Args:
+            results_path (str): csv to append to, created with a header row if it does not exist
+            columns (list): columns of a result row
+        """
+        self.columns = list(columns)
+        write_header = not os.path.exists(results_path) or os.path.getsize(results_path) == 0
+        if not write_header:
+            repair_result_file(results_path)
+        self.results_file = open(results_path, 'a', newline='')
+        self.csv_writer = csv.DictWriter(self.results_file, fieldnames=self.columns)
+        if write_header:
+            self.csv_writer.writeheader()
+            self.results_file.flush()
+
+    def write(self, row):
+        self.csv_writer.writerow(row)
+        self.results_file.flush()
+        os.fsync(self.results_file.fileno())
+
+    def close(self):
+        self.results_file.close()
+
+
+# Runner
+# =============================================
+def _run_indexed_task(indexed_task):
+    """
+    Run one task in a pool worker
+
+    Returns:
+        int, dict: the index of the task, the result columns returned by the experiment function
+    """
+    experiment_function, task_index, task = indexed_task
+    return task_index, experiment_function(task)
+
+
+def run_experiments(experiment_function, tasks, cores, results_path=None, key_names=None, initializer=None,
+                    initargs=(), chunksize=1, hide_progress_bar=False):
+    """
+    Run experiments on a process pool, handling each result as soon as its worker finishes
+
+        * Results are taken in completion order (imap_unordered), so a slow task does not hold back the others
+        * With results_path, each result is appended to a csv as it arrives, and tasks whose keys are already in
+          the csv are skipped, so an interrupted run restarts where it left off
+        * One progress bar counts finished tasks across all workers
+
+    Args:
+        experiment_function (function): module-level function taking a task dict and returning a dict of result
+            columns, e.g. {'metric': value}
+        tasks (list): dicts of task parameters
+        cores (int): number of worker processes
+    Kwargs:
+        results_path (str): csv to stream results to and resume from, or None to keep results in memory only
+        key_names (list): task parameters identifying a task in the csv, or None for every parameter
+        initializer (function): pool initializer, e.g. to share data with the workers once
+        initargs (tuple): arguments of the initializer
+        chunksize (int): number of tasks sent to a worker at a time
+        hide_progress_bar (bool): Set to True to hide the tqdm bar
+    Returns:
+        DataFrame: a row of task parameters and result columns per task, in the order of tasks
+            (results of earlier runs are read back from the csv)
+    """
+    key_names = list(tasks[0].keys()) if key_names is None and tasks else key_names
+    stored_rows = load_stored_rows(results_path, key_names) if results_path is not None else {}
+    pending_indices = [i for i, task in enumerate(tasks) if get_task_key(task, key_names) not in stored_rows]
+
+    results = {}
+    result_writer = None
+    try:
+        with tqdm(total=len(tasks), initial=len(tasks) - len(pending_indices), disable=hide_progress_bar) as progress_bar:
+            if pending_indices:
+                with mp.Pool(cores, initializer=initializer, initargs=initargs) as pool:
+                    indexed_tasks = [(experiment_function, i, tasks[i]) for i in pending_indices]
+                    for task_index, result in pool.imap_unordered(_run_indexed_task, indexed_tasks,
+                                                                  chunksize=chunksize):
+                        row = dict(tasks[task_index], **result)
+                        results[task_index] = row
+                        if results_path is not None:
+                            if result_writer is None:
+                                result_writer = ResultWriter(results_path, row.keys())
+                            result_writer.write(row)
+                        progress_bar.update(1)
+    finally:
+        if result_writer is not None:
+            result_writer.close()
+
+    # Fill in the results of earlier runs from the csv
+    if len(results) < len(tasks):
+        for i, task in enumerate(tasks):
+            if i not in results:
+                results[i] = dict(stored_rows[get_task_key(task, key_names)], **task)
+    return pd.DataFrame([results[i] for i in range(len(tasks))])
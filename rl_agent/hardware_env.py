@@ -0,0 +1,253 @@
+import time
+import asyncio
+import threading
+import concurrent.futures
+
+import tqdm
+from tqdm import tqdm
+
+# Module imports
+from rl_agent import SoftmaxAgent
+
+from async_arduino_interface import AsyncArduinoDriver
+
+from common_functions import *
+
+# Positions of the current and voltage fields in an Arduino state response
+CURRENT_FIELD_INDEX = 4
+VOLTAGE_FIELD_INDEX = 5
+
+# Hours in a day, as returned by get_hour_of_day
+HOURS_PER_DAY = 24
+
+
+def get_hour_of_day():
+    """
+    Returns:
+        int: the local hour (0-23), used as the time of day of the hardware environment
+    """
+    return time.localtime().tm_hour
+
+
+def convert_hour_to_partition(hour, day_partitions):
+    """
+    Args:
+        hour (int): hour of the day (0-23)
+        day_partitions (int): the number of time of day partitions the day is split into
+    Returns:
+        int: the time of day partition (0 to day_partitions - 1) the hour falls in
+    """
+    return hour * day_partitions // HOURS_PER_DAY
+
+
+def compute_measured_reward(response, action_tuple, last_state_tuple, movement_penalty):
+    """
+    Returns:
+        float: the power of an Arduino state response (I_ivp_1*V_ivp_1) less the penalty for the indices moved
+    """
+    # Reward is power received
+    reward = float(response[CURRENT_FIELD_INDEX]) * float(response[VOLTAGE_FIELD_INDEX])
+    # Add a cost from moving motors to new position
+    cost = movement_penalty * (abs(last_state_tuple[0] - action_tuple[0]) + abs(last_state_tuple[1] - action_tuple[1]))
+    return reward - cost
+
+
+class HardwareSolarEnv:
+    def __init__(self, open_streams, env_shape=ARRAY_DIMENSION_TUPLE, movement_penalty=0.0001,
+                 time_of_day_function=get_hour_of_day, day_partitions=24, negotiate_protocol=True, **driver_kwargs):
+        """
+        SolarEnv backed by the solar panel through the Arduino, with the env_step API of solar_env.SolarEnv
+
+            * An asyncio loop in a worker thread owns an AsyncArduinoDriver, so actions can be submitted without
+              blocking (submit_action) and several can be queued behind the servo
+            * The reward is the measured I_ivp_1*V_ivp_1 less the movement penalty
+            * The time of day of a next state is taken when its action is submitted, so it is known before
+              the measurement arrives, and is the partition of day_partitions the hour falls in
+
+        Args:
+            open_streams (function): coroutine function returning (reader, writer, ...) for the Arduino, e.g.
+                SimulatedArduino.open_connection or a wrapper of async_arduino_interface.open_serial_connection
+        Kwargs:
+            env_shape (tuple): shape of the discretized motor position grid
+            movement_penalty (float): penalty for each index of movement by an agent
+            time_of_day_function (function): returns the current hour of the day (0 to 23)
+            day_partitions (int): the number of time of day partitions of the agent (time_of_day_max)
+            negotiate_protocol (bool): True to pipeline queued actions when the firmware supports it
+            driver_kwargs: passed to AsyncArduinoDriver (timeouts, max_in_flight, ...)
+        """
+        self.env_shape = env_shape
+        self.movement_penalty = movement_penalty
+        self.time_of_day_function = time_of_day_function
+        self.total_steps = 0
+        self.time_of_day_max = day_partitions
+        self.time_of_day = self.get_current_partition()
+        self.last_measurement = None
+
+        # Worker thread running the event loop of the driver
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        self.driver = self.run_coroutine(self.connect(open_streams, negotiate_protocol, driver_kwargs)).result()
+
+    def run_coroutine(self, coroutine):
+        """
+        Returns:
+            concurrent.futures.Future: the result of the coroutine run on the worker loop
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def connect(self, open_streams, negotiate_protocol, driver_kwargs):
+        streams = await open_streams()
+        driver = AsyncArduinoDriver(streams[0], streams[1], **driver_kwargs)
+        driver.start()
+        if negotiate_protocol:
+            await driver.negotiate_protocol()
+        return driver
+
+    def get_current_partition(self):
+        return convert_hour_to_partition(self.time_of_day_function(), self.time_of_day_max)
+
+    def close(self):
+        self.run_coroutine(self.driver.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+
+    # Steps
+    # =============================================
+    async def measure_action(self, action_tuple, last_state_tuple, time_of_day):
+        motor_positions = convert_2d_index_to_motor_positions(action_tuple)
+        response = await self.driver.move_motors(int(motor_positions[0]), int(motor_positions[1]))
+        self.last_measurement = response
+        return compute_measured_reward(response, action_tuple, last_state_tuple, self.movement_penalty), \
+            (time_of_day, action_tuple)
+
+    def submit_action(self, action_tuple, last_state_tuple):
+        """
+        Queue a step of the environment without waiting for the measurement
+
+        Args:
+            action_tuple (tuple): Index pair to move to in env-based index
+            last_state_tuple (tuple): The last state the agent was in, to calculate movement penalty
+        Returns:
+            concurrent.futures.Future: resolves to (reward, next_state_tuple) like env_step
+        """
+        self.total_steps += 1
+        self.time_of_day = self.get_current_partition()
+        return self.run_coroutine(self.measure_action(action_tuple, last_state_tuple, self.time_of_day))
+
+    def env_step(self, action_tuple, last_state_tuple):
+        """
+        Completes a step of the environment
+
+        Args:
+            action_tuple (tuple): Index pair to move to in env-based index
+            last_state_tuple (tuple): The last state the agent was in, to calculate movement penalty
+        Returns:
+            reward, next_state_tuple
+        """
+        return self.submit_action(action_tuple, last_state_tuple).result()
+
+    # Access Functions
+    def get_env_shape(self):
+        return self.env_shape
+
+    def get_time_of_day(self):
+        return self.time_of_day
+
+    def get_last_measurement(self):
+        return self.last_measurement
+
+
+def run_hardware_experiment_steps(env:HardwareSolarEnv, agent:SoftmaxAgent, steps, hide_progress_bar=False):
+    """
+    Run agent steps on the hardware with the next action queued behind the current motor move
+
+        * The next state is (time of day at submit, action), and agent_step only changes the row of the last state,
+          so the next action can be drawn from its row while the motor moves whenever the two rows differ
+        * Random draws happen in the same order as run_experiment_step, so the agent makes the same updates;
+          when the rows are the same the step falls back to waiting for the measurement
+
+    Args:
+        env (HardwareSolarEnv): the hardware environment
+        agent (SoftmaxAgent): a started agent
+        steps (int): the number of steps to run
+    Kwargs:
+        hide_progress_bar (bool): Set to True to hide the tqdm bar
+    Returns:
+        int: the number of steps whose action was queued ahead of the measurement
+    """
+    env_shape = env.get_env_shape()
+    queued_steps = 0
+    action = agent.agent_policy()
+    pending_step = env.submit_action(convert_1d_index_to_2d_index(action, env_shape),
+                                     convert_1d_index_to_2d_index(agent.get_agent_last_state()[1], env_shape))
+    next_step = None
+    try:
+        for i in tqdm(range(1, steps + 1), disable=hide_progress_bar):
+            next_state = (env.get_time_of_day(), action)
+            next_action = None
+            next_step = None
+
+            # Draw and queue the next action while the motor moves
+            if i < steps and next_state != tuple(agent.get_agent_last_state()):
+                next_policy_action, next_softmax_prob = agent.sample_action(next_state)
+                next_action = agent.get_action_target(next_state, next_policy_action)
+                next_step = env.submit_action(convert_1d_index_to_2d_index(next_action, env_shape),
+                                              convert_1d_index_to_2d_index(action, env_shape))
+                queued_steps += 1
+
+            reward, next_state_tuple = pending_step.result()
+            agent.agent_step(reward, (next_state_tuple[0],
+                                      convert_2d_index_to_1d_index(next_state_tuple[1], env_shape)))
+            if i == steps:
+                break
+
+            if next_step is None:
+                next_action = agent.agent_policy()
+                next_step = env.submit_action(convert_1d_index_to_2d_index(next_action, env_shape),
+                                              convert_1d_index_to_2d_index(action, env_shape))
+            else:
+                agent.set_policy_action(next_policy_action, next_softmax_prob)
+            action, pending_step = next_action, next_step
+    except BaseException:
+        # Wait out the actions still in flight, including one queued behind a failed step, so none is left 
+        # running on the driver
+        concurrent.futures.wait([step for step in [pending_step, next_step] if step is not None])
+        raise
+    return queued_steps
+
+
+def run_hardware_agent_experiment(environment:HardwareSolarEnv, steps, seed, day_partitions, actor_step_size,
+                                  critic_step_size, avg_reward_step_size, temperature, rolling_steps_measurement=10,
+                                  hide_progress_bar=False):
+    """
+    Run an experiment with a new agent on the hardware
+
+    Args:
+        environment (HardwareSolarEnv): The hardware environment for the agent to interact with
+        steps (int): The number of steps to run the experiment for
+        seed (int): The random seed number to use for the agent
+        day_partitions (int): the number of distinct time of day points for agent to track as state (the
+            day_partitions the environment was created with)
+        actor_step_size (float): Step-size parameter for actor in agent
+        critic_step_size (float): Step-size parameter for critic in agent
+        avg_reward_step_size (float): Step-size parameter for avg reward in agent
+        temperature (float): Temperature parameter for actor policy
+    Kwargs:
+        rolling_steps_measurement (int): For tracking, the rolling avg steps for calculating running power from agent
+        hide_progress_bar (bool): Set to True to hide the tqdm bar
+    Returns:
+        SoftmaxAgent: the trained agent
+    """
+    if environment.time_of_day_max != day_partitions:
+        raise ValueError('day_partitions must match the environment time_of_day_max of ' + 
+                         str(environment.time_of_day_max) + ', got ' + str(day_partitions))
+    experiment_agent = SoftmaxAgent(actor_step_size=actor_step_size, critic_step_size=critic_step_size,
+                                    avg_reward_step_size=avg_reward_step_size,
+                                    temperature_value=temperature, env_shape=environment.get_env_shape(),
+                                    reward_rolling_avg_window=rolling_steps_measurement, day_partitions=day_partitions,
+                                    random_seed=seed)
+    experiment_agent.agent_start()
+    run_hardware_experiment_steps(environment, experiment_agent, steps, hide_progress_bar=hide_progress_bar)
+    return experiment_agent
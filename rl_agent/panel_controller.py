@@ -0,0 +1,258 @@
+import time
+import asyncio
+
+import numpy as np
+import pandas as pd
+
+# Module imports
+from rl_agent import SoftmaxAgent
+import async_arduino_interface as aai
+from async_arduino_interface import AsyncArduinoDriver
+from arduino_interface import DEFAULT_BAUD_RATE
+from hardware_env import get_hour_of_day, convert_hour_to_partition, compute_measured_reward
+from simulated_arduino import SimulatedArduino
+
+from common_functions import *
+
+
+def create_serial_stream_openers(serial_ports, baud_rate=DEFAULT_BAUD_RATE, startup_delay=2):
+    """
+    Args:
+        serial_ports (list): serial ports of the panels, e.g. from arduino_interface.find_serial_ports
+    Kwargs:
+        baud_rate (int): baud rate of the ports
+        startup_delay (float): seconds to wait for each Arduino to boot (the panels boot concurrently)
+    Returns:
+        list: coroutine functions opening each port as (reader, writer, serial_device), for PanelController
+    """
+    def create_opener(serial_port):
+        async def open_streams():
+            return await aai.open_serial_connection(serial_port, baud_rate=baud_rate, startup_delay=startup_delay)
+        return open_streams
+    return [create_opener(serial_port) for serial_port in serial_ports]
+
+
+class PanelController:
+    def __init__(self, open_streams_list, agents, env_shape=ARRAY_DIMENSION_TUPLE, movement_penalty=0.0001,
+                 time_of_day_function=get_hour_of_day, negotiate_protocol=True, driver_kwargs=None):
+        """
+        Drives many panels concurrently from one asyncio event loop, one started agent per panel
+
+            * Each panel runs its own step loop (policy, move, measure, agent_step), so while one waits on its servo
+              or serial link the others keep stepping; the control rate grows with the number of panels until the
+              agents' CPU time fills the loop
+            * Timeouts and resets (RESET_CODE) are handled per device by its AsyncArduinoDriver; a panel that stays
+              unresponsive after its resets, fails to connect or raises while stepping is marked failed (its error
+              kept in panel_errors) and the others carry on
+            * Per-panel latencies (move request to measurement) and counts are kept for get_metrics_df/get_summary
+
+        Args:
+            open_streams_list (list): coroutine functions returning (reader, writer, ...) for each Arduino, e.g. from
+                create_serial_stream_openers or SimulatedArduino.open_connection
+            agents (list): a started SoftmaxAgent per panel
+        Kwargs:
+            env_shape (tuple): shape of the discretized motor position grid
+            movement_penalty (float): penalty for each index of movement by an agent
+            time_of_day_function (function): returns the current hour of the day (0 to 23), which each panel maps to 
+                a partition of its agent's day_partitions
+            negotiate_protocol (bool): True to negotiate the sequenced protocol with each Arduino
+            driver_kwargs (dict or list): AsyncArduinoDriver kwargs (response_timeout, reset_timeout, max_resets, ...)
+                for every panel, or a list with a dict per panel
+        """
+        self.open_streams_list = open_streams_list
+        self.agents = agents
+        self.num_panels = len(agents)
+        self.env_shape = env_shape
+        self.movement_penalty = movement_penalty
+        self.time_of_day_function = time_of_day_function
+        self.negotiate_protocol = negotiate_protocol
+        if driver_kwargs is None or isinstance(driver_kwargs, dict):
+            driver_kwargs = [driver_kwargs or {}] * self.num_panels
+        self.driver_kwargs = driver_kwargs
+        self.drivers = [None] * self.num_panels
+        self.streams = [None] * self.num_panels
+        self.panel_latencies = [[] for i in range(self.num_panels)]
+        self.panel_steps = [0] * self.num_panels
+        self.panel_errors = [None] * self.num_panels
+        self.panel_reset_counts = [0] * self.num_panels
+        self.run_time = 0.0
+
+    # Connection
+    # =============================================
+    async def connect_panel(self, panel_index):
+        try:
+            streams = await self.open_streams_list[panel_index]()
+            self.streams[panel_index] = streams
+            driver = AsyncArduinoDriver(streams[0], streams[1], **self.driver_kwargs[panel_index])
+            driver.start()
+            self.drivers[panel_index] = driver
+            if self.negotiate_protocol:
+                await driver.negotiate_protocol()
+        except Exception as error:
+            self.panel_errors[panel_index] = error
+
+    async def close(self):
+        for panel_index in range(self.num_panels):
+            if self.drivers[panel_index] is not None:
+                self.panel_reset_counts[panel_index] = self.drivers[panel_index].reset_count
+                await self.drivers[panel_index].close()
+                self.drivers[panel_index] = None
+            # Serial connections also return the port, which stays open until closed
+            if self.streams[panel_index] is not None and len(self.streams[panel_index]) > 2:
+                self.streams[panel_index][2].close()
+            self.streams[panel_index] = None
+
+    # Steps
+    # =============================================
+    async def run_panel(self, panel_index, steps):
+        """
+        Run steps of one panel's agent, like run_experiment_step with the panel as environment
+        """
+        if self.panel_errors[panel_index] is not None:
+            return
+        driver = self.drivers[panel_index]
+        agent = self.agents[panel_index]
+        latencies = self.panel_latencies[panel_index]
+        day_partitions = agent.agent_shape[0]
+        try:
+            for i in range(steps):
+                action = agent.agent_policy()
+                action_tuple = convert_1d_index_to_2d_index(action, self.env_shape)
+                last_state_tuple = convert_1d_index_to_2d_index(agent.get_agent_last_state()[1], self.env_shape)
+                time_of_day = convert_hour_to_partition(self.time_of_day_function(), day_partitions)
+                motor_positions = convert_2d_index_to_motor_positions(action_tuple)
+                request_start = time.perf_counter()
+                response = await driver.move_motors(int(motor_positions[0]), int(motor_positions[1]))
+                latencies.append(time.perf_counter() - request_start)
+                reward = compute_measured_reward(response, action_tuple, last_state_tuple, self.movement_penalty)
+                agent.agent_step(reward, (time_of_day, action))
+                self.panel_steps[panel_index] += 1
+        except Exception as error:
+            # ArduinoUnresponsiveError, a closed connection or a malformed response only stop this panel
+            self.panel_errors[panel_index] = error
+
+    async def run(self, steps):
+        """
+        Connect every panel, run steps on each concurrently and close the connections
+
+        Args:
+            steps (int): the number of steps to run each panel for
+        Returns:
+            dict: the summary of the run (see get_summary)
+        """
+        try:
+            await asyncio.gather(*[self.connect_panel(i) for i in range(self.num_panels)])
+            run_start = time.perf_counter()
+            await asyncio.gather(*[self.run_panel(i, steps) for i in range(self.num_panels)])
+            self.run_time = time.perf_counter() - run_start
+        finally:
+            await self.close()
+        return self.get_summary()
+
+    # Metrics
+    # =============================================
+    def get_metrics_df(self):
+        """
+        Returns:
+            DataFrame: per panel steps, steps per second, resets, failure and latency (ms) mean/p50/p95/max
+        """
+        results_dict_list = []
+        for panel_index in range(self.num_panels):
+            latencies = np.array(self.panel_latencies[panel_index]) * 1000
+            driver = self.drivers[panel_index]
+            results_dict_list.append({
+                'panel': panel_index,
+                'steps': self.panel_steps[panel_index],
+                'steps_per_s': self.panel_steps[panel_index] / self.run_time if self.run_time else 0.0,
+                'resets': self.panel_reset_counts[panel_index] if driver is None else driver.reset_count,
+                'failed': self.panel_errors[panel_index] is not None,
+                'latency_mean_ms': latencies.mean() if len(latencies) else np.nan,
+                'latency_p50_ms': np.percentile(latencies, 50) if len(latencies) else np.nan,
+                'latency_p95_ms': np.percentile(latencies, 95) if len(latencies) else np.nan,
+                'latency_max_ms': latencies.max() if len(latencies) else np.nan
+            })
+        return pd.DataFrame(results_dict_list)
+
+    def get_summary(self):
+        """
+        Returns:
+            dict: panels, failed panels, total steps, run time (s), aggregate steps per second and latency (ms)
+                percentiles over every step of every panel
+        """
+        latencies = np.concatenate([np.array(panel_latencies) for panel_latencies in self.panel_latencies]) * 1000
+        total_steps = sum(self.panel_steps)
+        return {
+            'panels': self.num_panels,
+            'failed_panels': sum([error is not None for error in self.panel_errors]),
+            'total_steps': total_steps,
+            'run_time': self.run_time,
+            'steps_per_s': total_steps / self.run_time if self.run_time else 0.0,
+            'latency_p50_ms': np.percentile(latencies, 50) if len(latencies) else np.nan,
+            'latency_p95_ms': np.percentile(latencies, 95) if len(latencies) else np.nan
+        }
+
+
+def run_panel_experiment(open_streams_list, steps, seed, day_partitions, actor_step_size, critic_step_size,
+                         avg_reward_step_size, temperature, rolling_steps_measurement=10, table_storage='lazy',
+                         **controller_kwargs):
+    """
+    Run an experiment with a new agent on each of several panels at once
+
+        * Panel i's agent is seeded with seed + i, so panels explore independently
+        * Lazy tables keep each agent small (dense tables are 2 x 360 MB per agent at 24 partitions)
+
+    Args:
+        open_streams_list (list): coroutine functions returning (reader, writer, ...) for each Arduino
+        steps (int): The number of steps to run each panel for
+        seed (int): The random seed of the first panel's agent
+        day_partitions (int): the number of distinct time of day points for agent to track as state
+        actor_step_size (float): Step-size parameter for actor in agent
+        critic_step_size (float): Step-size parameter for critic in agent
+        avg_reward_step_size (float): Step-size parameter for avg reward in agent
+        temperature (float): Temperature parameter for actor policy
+    Kwargs:
+        rolling_steps_measurement (int): For tracking, the rolling avg steps for calculating running power from agent
+        table_storage (str): 'dense' or 'lazy' actor/critic storage for the agents
+        controller_kwargs: passed to PanelController (env_shape, driver_kwargs, ...)
+    Returns:
+        list, PanelController: the trained agents, the controller with the metrics of the run
+    """
+    env_shape = controller_kwargs.get('env_shape', ARRAY_DIMENSION_TUPLE)
+    agents = []
+    for panel_index in range(len(open_streams_list)):
+        agent = SoftmaxAgent(actor_step_size=actor_step_size, critic_step_size=critic_step_size,
+                             avg_reward_step_size=avg_reward_step_size, temperature_value=temperature,
+                             env_shape=env_shape, reward_rolling_avg_window=rolling_steps_measurement,
+                             day_partitions=day_partitions, random_seed=seed + panel_index, table_storage=table_storage)
+        agent.agent_start()
+        agents.append(agent)
+    controller = PanelController(open_streams_list, agents, **controller_kwargs)
+    asyncio.run(controller.run(steps))
+    return agents, controller
+
+
+# Benchmarks
+# =============================================
+def benchmark_panel_scaling(panel_counts=(1, 2, 4, 8, 16), steps=100, value_array=None, time_scale=0.02,
+                            link_latency=0.005):
+    """
+    Measure the aggregate control rate of run_panel_experiment against in-process simulated panels
+
+    Kwargs:
+        panel_counts (tuple): numbers of panels to run at once
+        steps (int): steps per panel
+        value_array (numpy array): power at each discretized motor position of every simulated panel
+        time_scale (float): multiplier on the simulated firmware's servo delays
+        link_latency (float): seconds each response spends on the simulated link
+    Returns:
+        DataFrame: a get_summary row per panel count
+    """
+    results_dict_list = []
+    for panel_count in panel_counts:
+        devices = [SimulatedArduino(value_array, time_scale=time_scale, link_latency=link_latency)
+                   for i in range(panel_count)]
+        agents, controller = run_panel_experiment([device.open_connection for device in devices], steps, seed=1,
+                                                  day_partitions=24, actor_step_size=0.1, critic_step_size=0.1,
+                                                  avg_reward_step_size=0.01, temperature=0.5)
+        results_dict_list.append(controller.get_summary())
+    return pd.DataFrame(results_dict_list)
@@ -21,41 +21,220 @@ RANDOM_SEED = 1
 ARRAY_DIMENSION_TUPLE = (37,37)
 MOTOR_ANGLE_POWER_DRAW = 0.0001
 
+# Uniforms drawn at a time per agent of a BatchSoftmaxAgent
+UNIFORM_BLOCK_SIZE = 1024
+
+
+# Random generators
+def create_random_generator(random_seed, rng='legacy'):
+    """
+    Creates the random generator of an agent
+    
+        * Agents only draw uniforms with .random(), which both generator types provide
+    
+    Args:
+        random_seed (int or SeedSequence): the seed, a SeedSequence only for rng='pcg64'
+    Kwargs:
+        rng (str): 'legacy' for np.random.RandomState (the stream of all earlier results and the default), 
+            'pcg64' for np.random.Generator over PCG64
+    Returns:
+        RandomState or Generator: the generator
+    """
+    if rng == 'legacy':
+        return np.random.RandomState(random_seed)
+    elif rng == 'pcg64':
+        return np.random.Generator(np.random.PCG64(random_seed))
+    raise ValueError('rng must be "legacy" or "pcg64", got ' + str(rng))
+
 
 # Policy
-def softmax_prob(actor_av_array, temperature=1):
+def softmax_prob(actor_av_array, temperature=1, out=None):
     """
     Uses a softmax policy to select a value from an array
     
+        * Each step is done in place in one array, so with out given no arrays are allocated
+    
     Args:
         actor_av_array (numpy array): the array of values to select from
     Kwargs:
         temperature (float): temperature factor for softmax
+        out (numpy array): buffer to write the probabilities to, or None to allocate one
     Returns:
         numpy array: array of softmax probabilities
     """
     # Divide all values by temperature
-    temperature_array = actor_av_array/temperature
+    softmax_array = np.divide(actor_av_array, temperature, out=out)
     
     # Find max state value
-    max_value = np.max(temperature_array)
+    max_value = softmax_array.max()
     
     # Generate the numerator for each element by subtracting max value and exponentiating
-    numerator_array = temperature_array - max_value
-    numerator_array = np.exp(numerator_array)
+    np.subtract(softmax_array, max_value, out=softmax_array)
+    np.exp(softmax_array, out=softmax_array)
 
     # Get the denominator by summing all values in the numerator
-    denominator_array = np.sum(numerator_array)
-    
+    denominator_array = softmax_array.sum()
     
     # Calculate the softmax value array and return to agent
-    softmax_array = numerator_array / denominator_array
+    np.divide(softmax_array, denominator_array, out=softmax_array)
     
     return softmax_array
 
+
+def sample_action_index(softmax_prob_array, random_generator, cdf_buffer):
+    """
+    Draws an index with the probabilities of an array, giving the same draw as 
+    random_generator.choice(len(softmax_prob_array), p=softmax_prob_array)
+    
+        * Does the cumulative sum and uniform draw of RandomState.choice without its validation of p, 
+          reusing cdf_buffer instead of allocating
+    
+    Args:
+        softmax_prob_array (numpy array): probabilities summing to 1
+        random_generator (RandomState or Generator): the generator to draw from
+        cdf_buffer (numpy array): float64 buffer of the same length as softmax_prob_array
+    Returns:
+        int: the drawn index
+    """
+    np.cumsum(softmax_prob_array, dtype=np.float64, out=cdf_buffer)
+    cdf_buffer /= cdf_buffer[-1]
+    return int(cdf_buffer.searchsorted(random_generator.random(), side='right'))
+
+def create_neighborhood_targets(env_shape, neighborhood_radius):
+    """
+    Maps the moves of a local action space to the states they lead to
+    
+        * Local action (i, j) moves by (i - neighborhood_radius, j - neighborhood_radius) grid indices
+        * Moves past the edge of the grid are invalid rather than stopping at the edge, which would give edge states 
+          several actions leading to the same state and weight the policy towards it; they are masked out of the 
+          policy (see SoftmaxAgent) and target the state itself
+    
+    Args:
+        env_shape (tuple): shape of the environment reward array
+        neighborhood_radius (int): largest move in grid indices along each motor axis
+    Returns:
+        numpy array, numpy array: (states, (2*neighborhood_radius + 1)**2) arrays of the 1d index each local action 
+            moves to and of whether the move stays on the grid
+    """
+    offsets = np.arange(-neighborhood_radius, neighborhood_radius + 1)
+    state_rows, state_columns = np.divmod(np.arange(env_shape[0] * env_shape[1]), env_shape[1])
+    target_rows = state_rows[:, None, None] + offsets[None, :, None]
+    target_columns = state_columns[:, None, None] + offsets[None, None, :]
+    valid_mask = ((target_rows >= 0) & (target_rows < env_shape[0]) & (target_columns >= 0) & 
+                  (target_columns < env_shape[1])).reshape(len(state_rows), -1)
+    targets = (target_rows * env_shape[1] + target_columns).reshape(len(state_rows), -1)
+    return np.where(valid_mask, targets, np.arange(len(state_rows))[:, None]), valid_mask
+
+
+def get_table_rows(table, partitions, states):
+    """
+    Returns:
+        numpy array: 2d array of the rows (partitions[i], states[i]) of a dense array or LazyActionTable
+    """
+    if isinstance(table, LazyActionTable):
+        return np.stack([table[int(partition), int(state)] for partition, state in zip(partitions, states)])
+    return table[partitions, states]
+
+
+def create_action_table(shape, init_value, dtype, table_storage):
+    """
+    Creates an actor or critic table
+    
+    Args:
+        shape (tuple): (partitions, states, actions) shape of the table
+        init_value (float): init value of the table, or None for zeros
+        dtype (numpy dtype): dtype of the table
+        table_storage (str): 'dense' for a preallocated array, 'lazy' for a LazyActionTable
+    Returns:
+        numpy array or LazyActionTable: the table, indexed as table[partition, state]
+    """
+    if table_storage == 'lazy':
+        return LazyActionTable(shape, init_value if init_value else 0, dtype=dtype)
+    elif table_storage == 'dense':
+        if init_value:
+            return np.full(shape, init_value, dtype=dtype)
+        return np.zeros(shape, dtype=dtype)
+    raise ValueError('table_storage must be "dense" or "lazy", got ' + str(table_storage))
+
+
+class LazyActionTable:
+    def __init__(self, shape, init_value=0, dtype=np.float64):
+        """
+        Sparse stand-in for a dense (day_partitions, states, actions) array that allocates a state's action row
+        on first visit
+        
+            * Rows are indexed as table[partition, state] and returned as writable numpy views
+        
+        Args:
+            shape (tuple): shape of the equivalent dense array
+        Kwargs:
+            init_value (float): value of every entry of an unvisited row
+            dtype (numpy dtype): dtype of the allocated rows
+        """
+        self.shape = shape
+        self.init_value = init_value
+        self.dtype = np.dtype(dtype)
+        self.rows = {}
+    
+    def __getitem__(self, index):
+        row = self.rows.get(index)
+        if row is None:
+            row = np.full(self.shape[2], self.init_value, dtype=self.dtype)
+            self.rows[index] = row
+        return row
+    
+    def __setitem__(self, index, value):
+        self[index][...] = value
+    
+    def toarray(self):
+        """
+        Returns:
+            numpy array: the dense equivalent of the table
+        """
+        dense_array = np.full(self.shape, self.init_value, dtype=self.dtype)
+        for (partition, state), row in self.rows.items():
+            dense_array[partition, state] = row
+        return dense_array
+    
+    def get_allocated_rows(self):
+        return len(self.rows)
+    
+    @property
+    def nbytes(self):
+        return len(self.rows) * self.shape[2] * self.dtype.itemsize
+
+
 class SoftmaxAgent:
     def __init__(self, actor_step_size, critic_step_size, avg_reward_step_size, temperature_value, env_shape, reward_rolling_avg_window, day_partitions, 
-                 random_seed=RANDOM_SEED, actor_init_value=None, critic_init_value=None):
+                 random_seed=RANDOM_SEED, actor_init_value=None, critic_init_value=None, table_storage='dense', 
+                 table_dtype=np.float64, critic_means='reduce', action_space='full', neighborhood_radius=2, 
+                 rng='legacy'):
+        """
+        Softmax actor-critic agent with average reward, tracking (time of day, state) as its state
+        
+        Args:
+            actor_step_size (float): step size of the actor
+            critic_step_size (float): step size of the critic
+            avg_reward_step_size (float): step size of the avg reward
+            temperature_value (float): softmax temperature
+            env_shape (tuple): shape of the environment reward array
+            reward_rolling_avg_window (int): window for the rolling reward tracking metric
+            day_partitions (int): number of time of day partitions tracked as state
+        Kwargs:
+            random_seed (int or SeedSequence): seed of the agent's random generator
+            actor_init_value (float): init value of actor, or None for zeros
+            critic_init_value (float): init value of critic, or None for zeros
+            table_storage (str): 'dense' to preallocate the actor and critic, 'lazy' to allocate rows on first visit
+            table_dtype (numpy dtype): dtype of the actor and critic, e.g. np.float32 to halve memory
+            critic_means (str): 'reduce' to take the state values in delta as the mean of the critic rows, 
+                'running' to keep a running sum of each critic row updated in O(1) per step (equal to the means 
+                up to floating point rounding, so results are not bit-identical to 'reduce' or the fast engine)
+            action_space (str): 'full' for an action per state of the grid, 'local' for an action per move within 
+                neighborhood_radius of the current state (see create_neighborhood_targets), which shrinks the 
+                policy, update and tables from the grid size to (2*neighborhood_radius + 1)**2 actions
+            neighborhood_radius (int): largest move in grid indices along each motor axis for action_space='local'
+            rng (str): 'legacy' or 'pcg64' random generator (see create_random_generator)
+        """
         # Set step sizes
         self.actor_step_size = actor_step_size
         self.critic_step_size = critic_step_size
@@ -66,32 +245,67 @@ class SoftmaxAgent:
         self.env_shape = env_shape
         max_index_2d = self.env_shape[0] - 1
         max_index_1d = convert_2d_index_to_1d_index((max_index_2d, max_index_2d), dimensions=self.env_shape)
-        self.agent_shape = (day_partitions, max_index_1d + 1, max_index_1d + 1)
         
-        # Set init values of actor and critic
-        # Actor
-        if actor_init_value:
-            self.actor_array = np.full(self.agent_shape, actor_init_value)
+        # Actions are states of the grid, or moves to states near the current one, where moves off the grid get a 
+        # logit of -inf so the policy never takes them
+        self.action_space = action_space
+        if self.action_space == 'full':
+            self.action_targets = None
+            self.action_logit_masks = None
+            num_actions = max_index_1d + 1
+        elif self.action_space == 'local':
+            self.action_targets, valid_action_mask = create_neighborhood_targets((max_index_2d + 1, max_index_2d + 1), 
+                                                                                 neighborhood_radius)
+            self.action_logit_masks = np.where(valid_action_mask, 0.0, -np.inf)
+            self.valid_action_counts = valid_action_mask.sum(axis=1)
+            num_actions = self.action_targets.shape[1]
         else:
-            self.actor_array = np.zeros(self.agent_shape)
-        # Critic
-        if critic_init_value:
-            self.critic_array = np.full(self.agent_shape, critic_init_value)
-        else:
-            self.critic_array = np.zeros(self.agent_shape)
+            raise ValueError('action_space must be "full" or "local", got ' + str(action_space))
+        self.agent_shape = (day_partitions, max_index_1d + 1, num_actions)
+        
+        # Set init values of actor and critic
+        self.table_storage = table_storage
+        self.actor_array = self.create_table(actor_init_value, table_dtype)
+        self.critic_array = self.create_table(critic_init_value, table_dtype)
+        
+        # Invalid local moves are never taken, so their critic entries keep the init value and are left out of the 
+        # state values
+        if self.action_targets is not None:
+            self.invalid_critic_sums = (critic_init_value or 0) * (num_actions - self.valid_action_counts)
+        
+        # Running sums of the critic rows, for critic_means='running'
+        if critic_means not in ('reduce', 'running'):
+            raise ValueError('critic_means must be "reduce" or "running", got ' + str(critic_means))
+        self.critic_means = critic_means
+        self.critic_sums = None
+        if self.critic_means == 'running':
+            self.critic_sums = np.zeros(self.agent_shape[:2])
+            self.refresh_critic_sums()
         
         # Create the actions and feature vectors
-        self.actions_vector = np.array(range(0, max_index_1d + 1))
-        self.base_feature_vector = np.zeros(max_index_1d + 1)
+        self.actions_vector = np.array(range(0, num_actions))
+        self.base_feature_vector = np.zeros(num_actions, dtype=table_dtype)
+        
+        # Scratch buffers of the policy and actor update, reused every step, the update in the dtype of the actor
+        prob_dtype = (self.base_feature_vector / self.temperature).dtype
+        self.prob_buffer = np.zeros(num_actions, dtype=prob_dtype)
+        self.cdf_buffer = np.zeros(num_actions)
+        self.update_buffer = np.zeros(num_actions, dtype=table_dtype)
+        self.update_dtype = self.update_buffer.dtype.type
+        
+        # Rows (partition, state) of the actor/critic updated since the last checkpoint
+        self.dirty_rows = np.zeros(self.agent_shape[:2], dtype=bool)
         
         # Set up fields for agent steps -- all agent internal functions are 1d index
-        self.random_generator = np.random.RandomState(random_seed) 
+        self.random_seed = random_seed
+        self.rng = rng
+        self.random_generator = create_random_generator(random_seed, rng)
         self.last_state = None
         self.last_action = None
         self.state = None
         self.last_reward = None
         self.avg_reward = 0
-        self.step_softmax_prob = None
+        self.step_softmax_prob = np.zeros(num_actions, dtype=prob_dtype)
     
         # Set up tracking metric items
         self.state_visits = np.zeros(self.env_shape) # track in 2d to better map to env map
@@ -101,6 +315,46 @@ class SoftmaxAgent:
         self.transition_dict = None
         self.last_delta = 0
     
+    def create_table(self, init_value, dtype):
+        """
+        Creates an actor or critic table in the configured storage
+        
+        Args:
+            init_value (float): init value of the table, or None for zeros
+            dtype (numpy dtype): dtype of the table
+        Returns:
+            numpy array or LazyActionTable: the table, indexed as table[partition, state]
+        """
+        return create_action_table(self.agent_shape, init_value, dtype, self.table_storage)
+    
+    def refresh_critic_sums(self):
+        """
+        Recompute the running critic sums from the critic, for when it is changed outside of agent_step
+        """
+        if self.critic_means != 'running':
+            return
+        if self.table_storage == 'lazy':
+            self.critic_sums[...] = self.critic_array.init_value * self.agent_shape[2]
+            for (partition, state), row in self.critic_array.rows.items():
+                self.critic_sums[partition, state] = np.sum(row, dtype=np.float64)
+        else:
+            np.sum(self.critic_array, axis=2, dtype=np.float64, out=self.critic_sums)
+    
+    def get_state_value(self, state):
+        """
+        Returns:
+            float: the mean of the critic row of a state, over the valid moves for action_space='local'
+        """
+        if self.action_targets is not None:
+            if self.critic_means == 'running':
+                critic_sum = self.critic_sums[state[0], state[1]]
+            else:
+                critic_sum = np.sum(self.critic_array[state[0], state[1]])
+            return (critic_sum - self.invalid_critic_sums[state[1]]) / self.valid_action_counts[state[1]]
+        if self.critic_means == 'running':
+            return self.critic_sums[state[0], state[1]] / self.agent_shape[2]
+        return self.critic_array[state[0], state[1]].mean()
+    
     # Agent Operation
     # =============================================
     def agent_start(self):
@@ -115,35 +369,74 @@ class SoftmaxAgent:
     
     
     def agent_policy(self):
-        # Compute the softmax prob for actions in given state
-        softmax_prob_array = softmax_prob(self.actor_array[self.last_state[0]][self.last_state[1]], self.temperature)
+        chosen_action, softmax_prob_array = self.sample_action(self.last_state)
+        self.set_policy_action(chosen_action, softmax_prob_array)
         
-        # Overlay the softmax probs onto actions vector
-        chosen_action = self.random_generator.choice(self.actions_vector, p=softmax_prob_array)
+        # Return the 1d index of the state the action moves to
+        return self.get_action_target(self.last_state, chosen_action)
+    
+    def get_action_target(self, state, action):
+        """
+        Args:
+            state (tuple): (partition, 1d state index) the action is taken from
+            action (int): index of the action in the agent's action space
+        Returns:
+            int: the 1d index of the state the action moves to (the action itself for action_space='full')
+        """
+        if self.action_targets is None:
+            return action
+        return int(self.action_targets[state[1], action])
+    
+    def sample_action(self, state):
+        """
+        Draw an action for a state without making it the agent's current action
         
-        # save softmax_prob as it will be useful later when updating the Actor
-        self.step_softmax_prob = softmax_prob_array.copy()
-        self.last_action = chosen_action
+            * Only reads the actor row of the state, so it can run ahead of agent_step for a different state
+            * Draws the same action as RandomState.choice over the actions vector (see sample_action_index)
         
-        # Return the 1d index of action
-        return chosen_action
+        Args:
+            state (tuple): (partition, 1d state index)
+        Returns:
+            int, numpy array: the index of the action in the action space (see get_action_target), the softmax 
+                probs it was drawn from (a scratch buffer, valid until the next sample_action)
+        """
+        softmax_prob_array = self.compute_softmax_prob(state)
+        return self.draw_action(softmax_prob_array), softmax_prob_array
+    
+    def compute_softmax_prob(self, state):
+        """
+        Returns:
+            numpy array: the softmax probs of the actions in a state (a scratch buffer, valid until the next call)
+        """
+        if self.action_logit_masks is None:
+            return softmax_prob(self.actor_array[state[0], state[1]], self.temperature, out=self.prob_buffer)
+        np.add(self.actor_array[state[0], state[1]], self.action_logit_masks[state[1]], out=self.prob_buffer)
+        return softmax_prob(self.prob_buffer, self.temperature, out=self.prob_buffer)
+    
+    def draw_action(self, softmax_prob_array):
+        """
+        Returns:
+            int: an action drawn from softmax probs, as the index of the action in the actions vector
+        """
+        return sample_action_index(softmax_prob_array, self.random_generator, self.cdf_buffer)
+    
+    def set_policy_action(self, action, softmax_prob_array):
+        # save softmax_prob as it will be useful later when updating the Actor
+        np.copyto(self.step_softmax_prob, softmax_prob_array)
+        self.last_action = action
         
     
     def agent_step(self, reward, next_state):
         # Compute delta
-        delta = reward - self.avg_reward + np.mean(self.critic_array[next_state[0]][next_state[1]]) - \
-        np.mean(self.critic_array[self.last_state[0]][self.last_state[1]])
+        delta = self.compute_delta(reward, next_state)
         
         # Update avg reward
         self.avg_reward += self.avg_reward_step_size * delta
         
-        # Update critic weights
-        self.critic_array[self.last_state[0]][self.last_state[1]][self.last_action] += self.critic_step_size * delta
-        
-        # Update actor weights
-        feature_vector = self.base_feature_vector.copy() # copy the zeros vector
-        feature_vector[self.last_action] = 1 # set last action to one
-        self.actor_array[self.last_state[0]][self.last_state[1]] += self.actor_step_size * delta * (feature_vector - self.step_softmax_prob)
+        # Update critic and actor weights of the last state
+        self.update_critic(self.last_state, self.last_action, delta)
+        self.update_actor(self.last_state, self.last_action, self.step_softmax_prob, delta)
+        self.dirty_rows[self.last_state[0], self.last_state[1]] = True
         
         # Update last state, etc
         self.last_state = next_state
@@ -154,17 +447,51 @@ class SoftmaxAgent:
         self.state_visits[convert_1d_index_to_2d_index(self.last_state[1], self.env_shape)] += 1
         self.last_delta = delta
     
+    def compute_delta(self, reward, next_state):
+        """
+        Returns:
+            float: the TD error of moving from the last state to next_state with reward
+        """
+        return reward - self.avg_reward + self.get_state_value(next_state) - self.get_state_value(self.last_state)
+    
+    def update_critic(self, state, action, delta):
+        # Update the critic weight of the action taken in a state, moving the running sum by the change actually 
+        # stored
+        critic_row = self.critic_array[state[0], state[1]]
+        if self.critic_means == 'running':
+            last_critic_value = critic_row[action]
+            critic_row[action] += self.critic_step_size * delta
+            self.critic_sums[state[0], state[1]] += critic_row[action] - last_critic_value
+        else:
+            critic_row[action] += self.critic_step_size * delta
+    
+    def update_actor(self, state, action, softmax_prob_array, delta):
+        # Update the actor weights of a state with step_size*delta*(feature_vector - softmax_prob), where 
+        # feature_vector is one at the action taken, built in place in a buffer of the actor's dtype
+        step_scale = self.update_dtype(self.actor_step_size * delta)
+        np.subtract(0, softmax_prob_array, out=self.update_buffer, casting='same_kind')
+        self.update_buffer[action] = 1 - softmax_prob_array[action]
+        np.multiply(self.update_buffer, step_scale, out=self.update_buffer)
+        self.actor_array[state[0], state[1]] += self.update_buffer
+    
     # Tracking
     # =============================================
     
     def get_critic_array(self):
+        if self.table_storage == 'lazy':
+            return self.critic_array.toarray()
         return self.critic_array.copy()
     
     def get_actor_array(self):
+        if self.table_storage == 'lazy':
+            return self.actor_array.toarray()
         return self.actor_array.copy()
     
     def set_actor_array(self, array):
         self.actor_array = array
+    
+    def get_table_nbytes(self):
+        return self.actor_array.nbytes + self.critic_array.nbytes
         
     def get_actions_vector(self):
         return self.actions_vector
@@ -188,4 +515,423 @@ class SoftmaxAgent:
         return self.rolling_reward
     
     def get_state_visits(self):
-        return self.state_visits.copy()
\ No newline at end of file
+        return self.state_visits.copy()
+
+
+# Batched Policy
+def batch_softmax_prob(actor_av_arrays, temperature_values):
+    """
+    Row-wise version of softmax_prob for a stack of action-value arrays
+    
+    Args:
+        actor_av_arrays (numpy array): 2d array with one row of action values per agent
+        temperature_values (numpy array): temperature factor for each row
+    Returns:
+        numpy array: 2d array of softmax probabilities, one row per agent
+    """
+    # Divide each row by its own temperature
+    temperature_array = actor_av_arrays/temperature_values[:, None]
+    
+    # Subtract the max of each row and exponentiate
+    numerator_array = temperature_array - np.max(temperature_array, axis=1, keepdims=True)
+    numerator_array = np.exp(numerator_array)
+    
+    # Normalize each row by its sum
+    return numerator_array / np.sum(numerator_array, axis=1, keepdims=True)
+
+
+class BatchSoftmaxAgent:
+    def __init__(self, actor_step_sizes, critic_step_sizes, avg_reward_step_sizes, temperature_values, env_shape, 
+                 reward_rolling_avg_window, day_partitions, random_seeds=RANDOM_SEED, actor_init_value=None, 
+                 critic_init_value=None, table_storage='dense', table_dtype=np.float64, rng='legacy'):
+        """
+        N independent SoftmaxAgents held along a leading axis and advanced together in single array operations
+        
+            * Each agent n reproduces SoftmaxAgent built with the n-th hyperparameters exactly for the same seed
+            * With rng='pcg64', a single seed is spawned into one SeedSequence child per agent (agent n matches a 
+              SoftmaxAgent seeded with SeedSequence(seed).spawn(N)[n]), so agents draw independent streams; 
+              'legacy' repeats the seed for every agent like separate run_agent_experiment calls
+            * Uniforms are drawn UNIFORM_BLOCK_SIZE at a time per agent, which gives the same streams as one draw 
+              per step
+            * The actor and critic hold the agents' partitions one after another, as rows 
+              (agent*day_partitions + partition, state) of a table made like SoftmaxAgent's (see create_action_table), 
+              so dense tables take N * day_partitions * states**2 entries each and lazy tables only the visited rows
+        
+        Args:
+            actor_step_sizes (list): actor step size per agent
+            critic_step_sizes (list): critic step size per agent
+            avg_reward_step_sizes (list): avg reward step size per agent
+            temperature_values (list): softmax temperature per agent
+            env_shape (tuple): shape of the environment reward array
+            reward_rolling_avg_window (int): window for the rolling reward tracking metric
+            day_partitions (int): number of time of day partitions tracked as state
+        Kwargs:
+            random_seeds (int or list): seed of all agents (spawned per agent for rng='pcg64'), or one seed per agent
+            actor_init_value (float): init value of actor, or None for zeros
+            critic_init_value (float): init value of critic, or None for zeros
+            table_storage (str): 'dense' to preallocate the actors and critics, 'lazy' to allocate rows on first visit
+            table_dtype (numpy dtype): dtype of the actors and critics, e.g. np.float32 to halve memory
+            rng (str): 'legacy' or 'pcg64' random generators (see create_random_generator)
+        """
+        # Set step sizes, one entry per agent
+        self.actor_step_size = np.asarray(actor_step_sizes, dtype=float)
+        self.critic_step_size = np.asarray(critic_step_sizes, dtype=float)
+        self.avg_reward_step_size = np.asarray(avg_reward_step_sizes, dtype=float)
+        self.temperature = np.asarray(temperature_values, dtype=float)
+        self.table_dtype = np.dtype(table_dtype)
+        self.num_agents = len(self.actor_step_size)
+        self.agent_index = np.arange(self.num_agents)
+        
+        # Set up memory for the actor and critic with agents on the leading axis
+        self.env_shape = env_shape
+        max_index_2d = self.env_shape[0] - 1
+        max_index_1d = convert_2d_index_to_1d_index((max_index_2d, max_index_2d), dimensions=self.env_shape)
+        self.agent_shape = (day_partitions, max_index_1d + 1, max_index_1d + 1)
+        self.batch_shape = (self.num_agents,) + self.agent_shape
+        
+        # Set init values of actor and critic, with the partitions of every agent along the first axis
+        self.table_storage = table_storage
+        table_shape = (self.num_agents * day_partitions,) + self.agent_shape[1:]
+        self.actor_array = create_action_table(table_shape, actor_init_value, self.table_dtype, self.table_storage)
+        self.critic_array = create_action_table(table_shape, critic_init_value, self.table_dtype, self.table_storage)
+        
+        # Create the actions vector
+        self.actions_vector = np.array(range(0, max_index_1d + 1))
+        
+        # One generator per agent so each agent draws the same stream as a single SoftmaxAgent
+        if isinstance(random_seeds, np.random.SeedSequence) or np.ndim(random_seeds) == 0:
+            if rng == 'legacy':
+                random_seeds = [random_seeds] * self.num_agents
+            else:
+                if not isinstance(random_seeds, np.random.SeedSequence):
+                    random_seeds = np.random.SeedSequence(random_seeds)
+                random_seeds = random_seeds.spawn(self.num_agents)
+        self.random_seeds = random_seeds
+        self.random_generators = [create_random_generator(seed, rng) for seed in random_seeds]
+        self.uniform_buffer = np.zeros((self.num_agents, UNIFORM_BLOCK_SIZE))
+        self.uniform_position = UNIFORM_BLOCK_SIZE
+        self.last_state = None
+        self.last_action = None
+        self.last_reward = None
+        self.avg_reward = np.zeros(self.num_agents)
+        self.step_softmax_prob = None
+        
+        # Set up tracking metric items
+        self.state_visits = np.zeros((self.num_agents,) + tuple(self.env_shape))
+        self.total_reward = np.zeros(self.num_agents)
+        self.rolling_reward = np.zeros(self.num_agents)
+        self.rolling_window = reward_rolling_avg_window
+        self.last_delta = np.zeros(self.num_agents)
+    
+    # Agent Operation
+    # =============================================
+    def agent_start(self):
+        # Initialize every agent in the middle state
+        self.avg_reward = np.zeros(self.num_agents)
+        self.last_state = (np.zeros(self.num_agents, dtype=int), np.full(self.num_agents, self.agent_shape[1]//2))
+        self.last_action = self.last_state[1].copy()
+        self.last_reward = np.zeros(self.num_agents)
+        
+        # For tracking
+        self.state_visits[(self.agent_index,) + convert_1d_index_to_2d_index(self.last_state[1], self.env_shape)] += 1
+    
+    def get_table_partitions(self, partitions):
+        """
+        Returns:
+            numpy array: the table partition of each agent's time of day partition
+        """
+        return self.agent_index * self.agent_shape[0] + partitions
+    
+    def agent_policy(self):
+        # Compute the softmax probs for every agent's current state, in the dtype SoftmaxAgent computes them in
+        softmax_prob_array = batch_softmax_prob(
+            get_table_rows(self.actor_array, self.get_table_partitions(self.last_state[0]), self.last_state[1]), 
+            self.temperature.astype(self.table_dtype))
+        
+        # Sample one action per agent with the same cdf lookup RandomState.choice performs
+        cdf_array = np.cumsum(softmax_prob_array, axis=1, dtype=np.float64)
+        cdf_array /= cdf_array[:, -1:]
+        uniform_samples = self.draw_uniforms()
+        chosen_actions = np.sum(cdf_array <= uniform_samples[:, None], axis=1)
+        
+        # Save softmax probs for the actor update
+        self.step_softmax_prob = softmax_prob_array
+        self.last_action = chosen_actions
+        
+        # Return the 1d index of each agent's action
+        return chosen_actions
+    
+    def draw_uniforms(self):
+        """
+        Returns:
+            numpy array: the next uniform of each agent's generator, refilling the block of every agent when used up
+        """
+        if self.uniform_position == UNIFORM_BLOCK_SIZE:
+            for n, generator in enumerate(self.random_generators):
+                self.uniform_buffer[n] = generator.random(UNIFORM_BLOCK_SIZE)
+            self.uniform_position = 0
+        self.uniform_position += 1
+        return self.uniform_buffer[:, self.uniform_position - 1]
+    
+    def agent_step(self, reward, next_state):
+        """
+        Args:
+            reward (numpy array): reward received by each agent
+            next_state (tuple): time of day partition(s) and 1d state index array
+        """
+        next_partition = np.broadcast_to(next_state[0], (self.num_agents,))
+        last_rows = (self.get_table_partitions(self.last_state[0]), self.last_state[1])
+        
+        # Compute delta
+        delta = reward - self.avg_reward + \
+        np.mean(get_table_rows(self.critic_array, self.get_table_partitions(next_partition), next_state[1]), axis=1) - \
+        np.mean(get_table_rows(self.critic_array, *last_rows), axis=1)
+        
+        # Update avg reward
+        self.avg_reward += self.avg_reward_step_size * delta
+        
+        # Actor update of each agent, step_size*delta*(feature_vector - softmax_prob) in the actor's dtype
+        critic_change = self.critic_step_size * delta
+        actor_update = np.negative(self.step_softmax_prob, dtype=self.table_dtype)
+        actor_update[self.agent_index, self.last_action] = 1 - self.step_softmax_prob[self.agent_index, 
+                                                                                      self.last_action]
+        actor_update *= (self.actor_step_size * delta).astype(self.table_dtype)[:, None]
+        
+        # Update critic and actor weights, each agent in its own rows
+        if self.table_storage == 'lazy':
+            for n in range(self.num_agents):
+                row_index = (int(last_rows[0][n]), int(last_rows[1][n]))
+                self.critic_array[row_index][self.last_action[n]] += critic_change[n]
+                self.actor_array[row_index] += actor_update[n]
+        else:
+            self.critic_array[last_rows + (self.last_action,)] += critic_change
+            self.actor_array[last_rows] += actor_update
+        
+        # Update last state, etc
+        self.last_state = (next_partition, np.asarray(next_state[1]))
+        
+        # For tracking
+        self.total_reward += reward
+        self.rolling_reward = rolling_avg_calc(reward, self.rolling_reward, self.rolling_window)
+        self.state_visits[(self.agent_index,) + convert_1d_index_to_2d_index(self.last_state[1], self.env_shape)] += 1
+        self.last_delta = delta
+    
+    # Tracking
+    # =============================================
+    
+    def get_critic_array(self):
+        return self.get_batch_array(self.critic_array)
+    
+    def get_actor_array(self):
+        return self.get_batch_array(self.actor_array)
+    
+    def get_batch_array(self, table):
+        """
+        Returns:
+            numpy array: a dense copy of an actor or critic table, shaped (agents, partitions, states, actions)
+        """
+        if isinstance(table, LazyActionTable):
+            return table.toarray().reshape(self.batch_shape)
+        return table.reshape(self.batch_shape).copy()
+    
+    def get_table_nbytes(self):
+        return self.actor_array.nbytes + self.critic_array.nbytes
+    
+    def get_num_agents(self):
+        return self.num_agents
+    
+    def get_agent_avg_reward(self):
+        return self.avg_reward.copy()
+    
+    def get_agent_last_delta(self):
+        return self.last_delta.copy()
+    
+    def get_agent_last_state(self):
+        return self.last_state
+    
+    def get_agent_total_reward(self):
+        return self.total_reward.copy()
+    
+    def get_agent_rolling_reward(self):
+        return self.rolling_reward.copy()
+    
+    def get_state_visits(self):
+        return self.state_visits.copy()
+
+
+class VectorSoftmaxAgent(SoftmaxAgent):
+    def __init__(self, actor_step_size, critic_step_size, avg_reward_step_size, temperature_value, env_shape, 
+                 reward_rolling_avg_window, day_partitions, num_streams, random_seed=RANDOM_SEED, **kwargs):
+        """
+        One softmax actor-critic agent learning from M environment streams at once (see solar_env.VectorSolarEnv)
+        
+            * Keeps one state per stream and a single actor, critic and avg reward shared by all streams
+            * Each step samples M actions in one batched policy, and applies the M transitions' updates together: 
+              deltas use the tables from before the step, and updates to the same entry add up in stream order
+            * With several streams, dense tables are updated in single array operations (np.add.at when streams 
+              share a row); lazy tables and a single stream go through SoftmaxAgent.update_critic and update_actor
+            * The avg reward moves by the mean delta of the streams, so avg_reward_step_size means the same for 
+              any number of streams
+            * With one stream, reproduces SoftmaxAgent exactly for the same seed and settings
+        
+        Args:
+            actor_step_size (float): step size of the actor
+            critic_step_size (float): step size of the critic
+            avg_reward_step_size (float): step size of the avg reward
+            temperature_value (float): softmax temperature
+            env_shape (tuple): shape of the environment reward array
+            reward_rolling_avg_window (int): window for the rolling reward tracking metric
+            day_partitions (int): number of time of day partitions tracked as state
+            num_streams (int): number of environments the agent steps in
+        Kwargs:
+            random_seed (int or SeedSequence): seed of the agent's random generator
+            kwargs: the table, critic mean, action space and random generator settings of SoftmaxAgent
+        """
+        super().__init__(actor_step_size, critic_step_size, avg_reward_step_size, temperature_value, env_shape, 
+                         reward_rolling_avg_window, day_partitions, random_seed=random_seed, **kwargs)
+        self.num_streams = num_streams
+        self.stream_index = np.arange(self.num_streams)
+        self.step_softmax_prob = None
+        
+        # Set up tracking metric items per stream
+        self.state_visits = np.zeros((self.num_streams,) + tuple(self.env_shape))
+        self.total_reward = np.zeros(self.num_streams)
+        self.rolling_reward = np.zeros(self.num_streams)
+        self.last_delta = np.zeros(self.num_streams)
+    
+    # Agent Operation
+    # =============================================
+    def agent_start(self, start_partitions=0):
+        """
+        Kwargs:
+            start_partitions (int or numpy array): time of day partition each stream starts in, e.g. the 
+                time_of_day of a VectorSolarEnv with phase offsets
+        """
+        # Initialize every stream in the middle state
+        self.avg_reward = 0
+        self.last_state = (np.broadcast_to(start_partitions, (self.num_streams,)).astype(int), 
+                           np.full(self.num_streams, self.agent_shape[1]//2))
+        self.last_action = self.last_state[1].copy()
+        self.last_reward = np.zeros(self.num_streams)
+        
+        # For tracking
+        self.state_visits[(self.stream_index,) + convert_1d_index_to_2d_index(self.last_state[1], self.env_shape)] += 1
+    
+    def agent_policy(self):
+        # Compute the softmax probs for every stream's current state
+        actor_rows = get_table_rows(self.actor_array, *self.last_state)
+        if self.action_logit_masks is not None:
+            actor_rows = np.add(actor_rows, self.action_logit_masks[self.last_state[1]], dtype=self.prob_buffer.dtype)
+        softmax_prob_array = batch_softmax_prob(actor_rows, np.full(self.num_streams, self.temperature, 
+                                                                    dtype=self.prob_buffer.dtype))
+        
+        # Sample one action per stream with the cdf lookup RandomState.choice performs, taking the draws in one call
+        cdf_array = np.cumsum(softmax_prob_array, axis=1, dtype=np.float64)
+        cdf_array /= cdf_array[:, -1:]
+        uniform_samples = self.random_generator.random(self.num_streams)
+        chosen_actions = np.sum(cdf_array <= uniform_samples[:, None], axis=1)
+        
+        # Save softmax probs for the actor update
+        self.step_softmax_prob = softmax_prob_array
+        self.last_action = chosen_actions
+        
+        # Return the 1d index of the state each stream's action moves to
+        if self.action_targets is None:
+            return chosen_actions
+        return self.action_targets[self.last_state[1], chosen_actions]
+    
+    def agent_step(self, reward, next_state):
+        """
+        Args:
+            reward (numpy array): reward received in each stream
+            next_state (tuple): time of day partition array and 1d state index array
+        """
+        next_partition = np.broadcast_to(next_state[0], (self.num_streams,))
+        
+        # Compute delta of every transition
+        delta = reward - self.avg_reward + self.get_state_values(next_partition, next_state[1]) - \
+        self.get_state_values(*self.last_state)
+        
+        # Update avg reward with the mean of the transitions
+        self.avg_reward += self.avg_reward_step_size * np.mean(delta)
+        
+        # Update critic and actor weights of each stream's last state
+        if self.table_storage == 'dense' and self.num_streams > 1:
+            self.update_dense_tables(delta)
+        else:
+            for i in range(self.num_streams):
+                state = (int(self.last_state[0][i]), int(self.last_state[1][i]))
+                self.update_critic(state, self.last_action[i], delta[i])
+                self.update_actor(state, self.last_action[i], self.step_softmax_prob[i], delta[i])
+        self.dirty_rows[self.last_state] = True
+        
+        # Update last state, etc
+        self.last_state = (next_partition, np.asarray(next_state[1]))
+        
+        # For tracking
+        self.total_reward += reward
+        self.rolling_reward = rolling_avg_calc(reward, self.rolling_reward, self.rolling_window)
+        self.state_visits[(self.stream_index,) + convert_1d_index_to_2d_index(self.last_state[1], self.env_shape)] += 1
+        self.last_delta = delta
+    
+    def update_dense_tables(self, delta):
+        """
+        Apply every stream's critic and actor update to dense tables at once, with the same operations as 
+        update_critic and update_actor
+        
+        Args:
+            delta (numpy array): TD error of each stream's transition
+        """
+        partitions, states = self.last_state
+        critic_index = (partitions, states, self.last_action)
+        
+        # Critic, moving the running sums by the change actually stored in each updated entry
+        if self.critic_means == 'running':
+            last_critic_values = self.critic_array[critic_index]
+        np.add.at(self.critic_array, critic_index, self.critic_step_size * delta)
+        if self.critic_means == 'running':
+            entries, first_streams = np.unique((partitions * self.agent_shape[1] + states) * self.agent_shape[2] + 
+                                               self.last_action, return_index=True)
+            np.add.at(self.critic_sums, (partitions[first_streams], states[first_streams]), 
+                      self.critic_array[critic_index][first_streams] - last_critic_values[first_streams])
+        
+        # Actor, step_size*delta*(feature_vector - softmax_prob) in the actor's dtype
+        update_array = np.negative(self.step_softmax_prob, dtype=self.actor_array.dtype)
+        update_array[self.stream_index, self.last_action] = 1 - self.step_softmax_prob[self.stream_index, 
+                                                                                       self.last_action]
+        update_array *= (self.actor_step_size * delta).astype(self.actor_array.dtype)[:, None]
+        # Fancy-index assignment keeps only one update per row, so streams sharing a row go through np.add.at
+        if len(set((partitions * self.agent_shape[1] + states).tolist())) < self.num_streams:
+            np.add.at(self.actor_array, (partitions, states), update_array)
+        else:
+            self.actor_array[partitions, states] += update_array
+    
+    def get_state_values(self, partitions, states):
+        """
+        Returns:
+            numpy array: the mean of the critic row of each (partitions[i], states[i]) state (see get_state_value)
+        """
+        if self.action_targets is not None:
+            if self.critic_means == 'running':
+                critic_sums = self.critic_sums[partitions, states]
+            else:
+                critic_sums = np.sum(get_table_rows(self.critic_array, partitions, states), axis=1)
+            return (critic_sums - self.invalid_critic_sums[states]) / self.valid_action_counts[states]
+        if self.critic_means == 'running':
+            return self.critic_sums[partitions, states] / self.agent_shape[2]
+        return np.mean(get_table_rows(self.critic_array, partitions, states), axis=1)
+    
+    # Tracking
+    # =============================================
+    
+    def get_num_streams(self):
+        return self.num_streams
+    
+    def get_agent_last_delta(self):
+        return self.last_delta.copy()
+    
+    def get_agent_total_reward(self):
+        return self.total_reward.copy()
+    
+    def get_agent_rolling_reward(self):
+        return self.rolling_reward.copy()
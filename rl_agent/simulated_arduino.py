@@ -0,0 +1,532 @@
+import os
+import pty
+import tty
+import time
+import queue
+import asyncio
+import threading
+import collections
+
+import numpy as np
+import pandas as pd
+import serial
+
+import solar_env
+import arduino_interface
+from arduino_interface import MOTOR_CONTROL, STATE_REQUEST, RESET_CODE, PROTOCOL_REQUEST, SEQUENCED_MESSAGE, \
+    BINARY_MODE_REQUEST, SEQUENCED_PROTOCOL_VERSION, NOMINAL, ERROR, RESET_STATE, END_CHAR, DELIMITER, DEFAULT_BAUD_RATE, \
+    HIGH_BAUD_RATE
+from telemetry_frames import NO_SEQUENCE_ID, FrameParser, pack_state_frame, parse_frames
+
+# Servo timing of the firmware (safe_write_motor_position / motor_control)
+SERVO_DEGREE_STEP = 5
+SERVO_STEP_DELAY = 0.05
+SERVO_SWITCH_DELAY = 0.25
+
+# Voltage reported by the simulated panel
+SIMULATED_PANEL_VOLTAGE = 5.0
+
+# Bits on the serial link per byte (start bit, 8 data bits, stop bit)
+BITS_PER_BYTE = 10
+
+
+class SimulatedArduino:
+    def __init__(self, value_array=None, degree_discretization=5, time_scale=0.0, link_latency=0.0,
+                 protocol_version=SEQUENCED_PROTOCOL_VERSION, baud_rate=None):
+        """
+        In-process stand-in for the Arduino firmware, speaking the protocol in firmware/README.md
+
+            * Motor moves take as long as the firmware's stepped servo writes, scaled by time_scale
+            * Power is read from a reward grid such as one built by solar_env.convert_solar_df_to_value_array
+            * Messages are processed one at a time, while responses spend link_latency on the link without
+              blocking the device, so pipelined requests overlap the link latency like on the real serial port
+            * With baud_rate, each response also spends its transmission time on the link, so ASCII lines and
+              binary frames (BINARY_MODE_REQUEST) can be compared at the rates of the real port
+
+        Kwargs:
+            value_array (numpy array): power (W) at each discretized motor position, or None for a dark panel
+            degree_discretization (int): degrees per index of value_array
+            time_scale (float): multiplier on firmware delays (0 for instant responses, 1 for real time)
+            link_latency (float): seconds each response spends on the serial link
+            protocol_version (int): LOCKSTEP_PROTOCOL_VERSION to behave like firmware without the extended protocol
+            baud_rate (int): bits per second of the simulated link, or None for no transmission time
+        """
+        self.value_array = value_array
+        self.degree_discretization = degree_discretization
+        self.time_scale = time_scale
+        self.link_latency = link_latency
+        self.protocol_version = protocol_version
+        self.baud_rate = baud_rate
+        self.sequence_id = NO_SEQUENCE_ID
+        self.unresponsive_requests = 0
+        self.requests_handled = 0
+        self.reset()
+
+    # Firmware behavior
+    # =============================================
+    def reset(self):
+        """
+        Equivalent of setup(): servos back to 90 degrees and a nominal state
+        """
+        self.motor_1_position = 90
+        self.motor_2_position = 90
+        self.active_state = NOMINAL
+        self.binary_frames = False
+        self.last_broadcast = time.time()
+
+    def get_servo_move_time(self, motor_1_degree, motor_2_degree):
+        """
+        Returns:
+            float: seconds the firmware spends moving both servos to the positions
+        """
+        move_steps = (abs(self.motor_1_position - motor_1_degree) // SERVO_DEGREE_STEP +
+                      abs(self.motor_2_position - motor_2_degree) // SERVO_DEGREE_STEP)
+        return (move_steps * SERVO_STEP_DELAY + SERVO_SWITCH_DELAY) * self.time_scale
+
+    def measure_power(self):
+        """
+        Returns:
+            float, float, float: current (A), voltage (V), power (W) at the current motor positions
+        """
+        if self.value_array is None:
+            return 0.0, SIMULATED_PANEL_VOLTAGE, 0.0
+        index_1 = min(self.motor_1_position // self.degree_discretization, self.value_array.shape[0] - 1)
+        index_2 = min(self.motor_2_position // self.degree_discretization, self.value_array.shape[1] - 1)
+        power = float(self.value_array[index_1, index_2])
+        return power / SIMULATED_PANEL_VOLTAGE, SIMULATED_PANEL_VOLTAGE, power
+
+    def get_state_fields(self):
+        """
+        Returns:
+            list: the fields broadcast_state sends, in order
+        """
+        now = time.time()
+        elapsed = now - self.last_broadcast
+        self.last_broadcast = now
+        current, voltage, power = self.measure_power()
+        return [self.active_state, elapsed, self.motor_1_position, self.motor_2_position, current, voltage, power]
+
+    def format_state(self, state_fields):
+        """
+        Returns:
+            str or bytes: the ASCII state line, or the state frame in binary mode
+        """
+        if self.binary_frames:
+            return pack_state_frame(*state_fields, sequence_id=self.sequence_id)
+        return '{},{:.3f},{},{},{:.3f},{:.3f},{:.3f}'.format(*state_fields)
+
+    def format_error(self):
+        """
+        Returns:
+            str or bytes: the ERROR response, a state frame with the ERROR state in binary mode
+        """
+        if self.binary_frames:
+            current, voltage, power = self.measure_power()
+            return pack_state_frame(ERROR, 0.0, self.motor_1_position, self.motor_2_position, current, voltage, power,
+                                    sequence_id=self.sequence_id)
+        return str(ERROR)
+
+    def parse_message(self, message):
+        """
+        Args:
+            message (str): a received line
+        Returns:
+            list: the integer codes of the message, or None if it has no end character
+        """
+        if END_CHAR not in message:
+            return None
+        try:
+            return [int(code) for code in message.strip().replace(END_CHAR, '').split(DELIMITER)]
+        except ValueError:
+            return None
+
+    def handle_codes(self, codes):
+        """
+        Apply a request to the simulated device
+
+        Args:
+            codes (list): integer codes of the request
+        Returns:
+            float, str: the processing delay in seconds, the response without END_CHAR (or None for no response,
+                bytes for a state frame)
+        """
+        if codes is None or len(codes) == 0:
+            self.active_state = ERROR
+            return 0.0, None
+        if codes[0] == MOTOR_CONTROL and len(codes) >= 3:
+            motor_1_degree = max(0, min(180, codes[1]))
+            motor_2_degree = max(0, min(180, codes[2]))
+            delay = self.get_servo_move_time(motor_1_degree, motor_2_degree)
+            self.motor_1_position = motor_1_degree
+            self.motor_2_position = motor_2_degree
+            return delay, self.format_state(self.get_state_fields())
+        elif codes[0] == STATE_REQUEST:
+            return 0.0, self.format_state(self.get_state_fields())
+        elif codes[0] == RESET_CODE:
+            delay = self.get_servo_move_time(90, 90)
+            self.reset()
+            state_fields = self.get_state_fields()
+            # Firmware without the extended protocol answers a reset with an ordinary state
+            if self.protocol_version >= SEQUENCED_PROTOCOL_VERSION:
+                state_fields[0] = RESET_STATE
+            return delay, self.format_state(state_fields)
+        elif codes[0] == PROTOCOL_REQUEST and self.protocol_version >= SEQUENCED_PROTOCOL_VERSION:
+            return 0.0, str(PROTOCOL_REQUEST) + DELIMITER + str(self.protocol_version)
+        elif codes[0] == BINARY_MODE_REQUEST and len(codes) >= 2:
+            self.binary_frames = codes[1] != 0
+            return 0.0, str(BINARY_MODE_REQUEST) + DELIMITER + str(int(self.binary_frames))
+        self.active_state = ERROR
+        return 0.0, None
+
+    def handle_sequenced_codes(self, codes):
+        """
+        Apply a sequenced request (SEQUENCED_MESSAGE, sequence id, request codes)
+
+        Args:
+            codes (list): integer codes of the sequenced message
+        Returns:
+            float, str: the processing delay in seconds, the response prefixed with the sequence id
+                (bytes for a state frame, which carries the id itself)
+        """
+        if len(codes) < 3:
+            self.active_state = ERROR
+            return 0.0, None
+        self.sequence_id = codes[1]
+        try:
+            delay, response = self.handle_codes(codes[2:])
+            if response is None:
+                response = self.format_error()
+        finally:
+            self.sequence_id = NO_SEQUENCE_ID
+        if isinstance(response, bytes):
+            return delay, response
+        return delay, DELIMITER.join([str(SEQUENCED_MESSAGE), str(codes[1]), response])
+
+    def handle_message(self, message):
+        """
+        Args:
+            message (str): a received line
+        Returns:
+            float, bytes: the processing delay in seconds, the response line or frame (or None for no response)
+        """
+        self.requests_handled += 1
+        if self.unresponsive_requests > 0:
+            self.unresponsive_requests -= 1
+            return 0.0, None
+        codes = self.parse_message(message)
+        if codes and codes[0] == SEQUENCED_MESSAGE and self.protocol_version >= SEQUENCED_PROTOCOL_VERSION:
+            delay, response = self.handle_sequenced_codes(codes)
+        else:
+            delay, response = self.handle_codes(codes)
+        if response is None or isinstance(response, bytes):
+            return delay, response
+        return delay, (response + END_CHAR + '\r\n').encode()
+
+    def get_link_delay(self, response):
+        """
+        Returns:
+            float: seconds a response spends on the link (latency plus transmission time at baud_rate)
+        """
+        if self.baud_rate is None:
+            return self.link_latency
+        return self.link_latency + len(response) * BITS_PER_BYTE / self.baud_rate
+
+    # Transports
+    # =============================================
+    async def open_connection(self):
+        """
+        Connect to the device through in-memory asyncio streams
+
+        Returns:
+            StreamReader, LoopbackWriter: streams for the host side, matching asyncio.open_connection
+        """
+        host_reader = asyncio.StreamReader()
+        host_writer = LoopbackWriter()
+        host_writer.device_task = asyncio.ensure_future(self.serve_loopback(host_writer, host_reader))
+        return host_reader, host_writer
+
+    async def serve_loopback(self, host_writer, host_reader):
+        """
+        Process lines written by the host one at a time, like the firmware loop()
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            line = await host_writer.device_input.readline()
+            if not line:
+                loop.call_later(self.link_latency, host_reader.feed_eof)
+                return
+            delay, response = self.handle_message(line.decode())
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if response is not None:
+                loop.call_later(self.get_link_delay(response), host_reader.feed_data, response)
+
+    def start_pty(self):
+        """
+        Serve the device on a pseudo-terminal in a background thread, for clients that open a serial port
+
+        Returns:
+            str: path of the terminal to open as the serial port (e.g. with arduino_interface.initialize_serial)
+        """
+        self.pty_master, pty_slave = pty.openpty()
+        tty.setraw(pty_slave)
+        self.pty_slave_path = os.ttyname(pty_slave)
+        self.pty_slave = pty_slave
+        self.pty_responses = queue.Queue()
+        self.pty_thread = threading.Thread(target=self.serve_pty, daemon=True)
+        self.pty_thread.start()
+        threading.Thread(target=self.send_pty_responses, daemon=True).start()
+        return self.pty_slave_path
+
+    def serve_pty(self):
+        buffer = b''
+        while True:
+            try:
+                data = os.read(self.pty_master, 1024)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                delay, response = self.handle_message(line.decode(errors='replace'))
+                if delay > 0:
+                    time.sleep(delay)
+                if response is not None:
+                    self.pty_responses.put((time.time() + self.get_link_delay(response), response))
+
+    def send_pty_responses(self):
+        """
+        Write responses to the terminal once they have spent link_latency on the link
+        """
+        while True:
+            due_time, response = self.pty_responses.get()
+            if response is None:
+                return
+            time.sleep(max(0.0, due_time - time.time()))
+            try:
+                os.write(self.pty_master, response)
+            except OSError:
+                return
+
+    def stop_pty(self):
+        self.pty_responses.put((0.0, None))
+        os.close(self.pty_master)
+        os.close(self.pty_slave)
+
+
+class LoopbackWriter:
+    def __init__(self):
+        """
+        Host side writer of an in-memory connection, with the StreamWriter methods the drivers use
+        """
+        self.device_input = asyncio.StreamReader()
+        self.device_task = None
+        self.closed = False
+
+    def write(self, data):
+        self.device_input.feed_data(data)
+
+    async def drain(self):
+        await asyncio.sleep(0)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.device_input.feed_eof()
+
+    def is_closing(self):
+        return self.closed
+
+    async def wait_closed(self):
+        if self.device_task is not None:
+            await self.device_task
+
+
+class SimulatedSerial:
+    def __init__(self, device, timeout=None):
+        """
+        In-memory stand-in for a serial.Serial port connected to a SimulatedArduino, for code that reads and writes 
+        a port (arduino_interface, telemetry_recorder.TelemetryRecorder) without a pseudo-terminal
+
+            * Written lines are handled by the device as they arrive, one at a time like the firmware loop(), and
+              each response becomes readable after its processing delay and link delay
+
+        Args:
+            device (SimulatedArduino): the device on the other end of the port
+        Kwargs:
+            timeout (float): seconds read and readline wait for data, None to wait until it arrives
+        """
+        self.device = device
+        self.timeout = timeout
+        self.is_open = True
+        self.input_line = b''
+        self.received = bytearray()
+        self.responses = collections.deque()
+        self.device_ready = time.time()
+        self.condition = threading.Condition()
+
+    def write(self, data):
+        with self.condition:
+            self.input_line += bytes(data)
+            while b'\n' in self.input_line:
+                line, self.input_line = self.input_line.split(b'\n', 1)
+                delay, response = self.device.handle_message(line.decode(errors='replace'))
+                self.device_ready = max(self.device_ready, time.time()) + delay
+                if response is not None:
+                    self.responses.append((self.device_ready + self.device.get_link_delay(response), response))
+            self.condition.notify_all()
+        return len(data)
+
+    def move_due_responses(self):
+        """
+        Move responses that have arrived to the receive buffer, returning the due time of the next one (or None)
+        """
+        now = time.time()
+        while self.responses and self.responses[0][0] <= now:
+            self.received += self.responses.popleft()[1]
+        return self.responses[0][0] if self.responses else None
+
+    def read_until_condition(self, is_complete):
+        """
+        Returns:
+            bool: True once is_complete() holds for the receive buffer, False after the timeout
+        """
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while True:
+            next_due = self.move_due_responses()
+            if is_complete():
+                return True
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                return False
+            wait_times = [due - now for due in [next_due, deadline] if due is not None]
+            self.condition.wait(min(wait_times) if wait_times else None)
+
+    def read(self, size=1):
+        with self.condition:
+            self.read_until_condition(lambda: len(self.received) >= size)
+            data = bytes(self.received[:size])
+            del self.received[:size]
+        return data
+
+    def readline(self):
+        with self.condition:
+            self.read_until_condition(lambda: b'\n' in self.received)
+            end = self.received.find(b'\n') + 1 if b'\n' in self.received else len(self.received)
+            data = bytes(self.received[:end])
+            del self.received[:end]
+        return data
+
+    @property
+    def in_waiting(self):
+        with self.condition:
+            self.move_due_responses()
+            return len(self.received)
+
+    @property
+    def out_waiting(self):
+        return 0
+
+    def reset_input_buffer(self):
+        with self.condition:
+            self.move_due_responses()
+            self.received.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+def create_simulated_arduino_from_data_path(data_path, degree_discretization=5, time_scale=0.0, link_latency=0.0,
+                                            protocol_version=SEQUENCED_PROTOCOL_VERSION, baud_rate=None):
+    """
+    Create a simulated device whose panel reads power from logged simulation data
+
+    Args:
+        data_path (str): Path to a csv of logged data for an environment
+    Kwargs:
+        degree_discretization (int): number of degrees to discretize motor positions by
+        time_scale (float): multiplier on firmware delays
+        link_latency (float): seconds each response spends on the serial link
+        protocol_version (int): highest protocol version the device supports
+        baud_rate (int): bits per second of the simulated link, or None for no transmission time
+    Returns:
+        SimulatedArduino: the device
+    """
+    value_array = solar_env.convert_solar_df_to_value_array(solar_env.load_and_format_solar_df(data_path),
+                                                            degree_discretization)
+    return SimulatedArduino(value_array, degree_discretization=degree_discretization, time_scale=time_scale,
+                            link_latency=link_latency, protocol_version=protocol_version, baud_rate=baud_rate)
+
+
+# Benchmarks
+# =============================================
+def benchmark_telemetry_throughput(value_array=None, num_requests=500, baud_rates=(DEFAULT_BAUD_RATE, HIGH_BAUD_RATE),
+                                   parse_responses=10000):
+    """
+    Measure state requests per second and host parsing time for ASCII lines and binary frames on a simulated device
+
+        * Requests are lock-step STATE_REQUESTs over start_pty, read with arduino_interface (read_serial_line +
+          map_message_to_dict, or read_state_frame), with each response held on the link for its transmission time
+        * Parsing time is taken over parse_responses recorded responses, ASCII lines converted to numbers as they
+          would be for use, binary frames parsed in one parse_frames call (as a recorder reading in bulk would)
+
+    Kwargs:
+        value_array (numpy array): power at each discretized motor position, or None for a dark panel
+        num_requests (int): state requests per measurement
+        baud_rates (tuple): baud rates of the simulated link to measure at
+        parse_responses (int): recorded responses to measure parsing time over
+    Returns:
+        DataFrame: format, baud rate, bytes per response, requests per second and parse time (us) per response
+    """
+    results_dict_list = []
+    for binary_frames in [False, True]:
+        for baud_rate in baud_rates:
+            device = SimulatedArduino(value_array, baud_rate=baud_rate)
+            serial_device = serial.Serial(port=device.start_pty(), baudrate=baud_rate, timeout=2)
+            try:
+                if binary_frames and not arduino_interface.set_binary_mode(serial_device, reset_output=False):
+                    raise RuntimeError('Simulated device did not enter binary mode')
+                frame_parser = FrameParser()
+                responses = []
+                run_start = time.perf_counter()
+                for i in range(num_requests):
+                    arduino_interface.write_serial_line(serial_device, [STATE_REQUEST], print_message=False,
+                                                        reset_output=False)
+                    if binary_frames:
+                        responses.append(arduino_interface.read_state_frame(serial_device, frame_parser))
+                    else:
+                        responses.append(arduino_interface.map_message_to_dict(
+                            time.time(), arduino_interface.read_serial_line(serial_device, print_message=False)))
+                run_time = time.perf_counter() - run_start
+            finally:
+                serial_device.close()
+                device.stop_pty()
+            response_bytes = len(device.format_state(device.get_state_fields()))
+            response_bytes += 0 if binary_frames else len(END_CHAR + '\r\n')
+            results_dict_list.append({'format': 'binary' if binary_frames else 'ascii', 'baud_rate': baud_rate,
+                                      'response_bytes': response_bytes, 'requests_per_s': num_requests / run_time})
+
+        # Host parsing time of recorded responses
+        device = SimulatedArduino(value_array)
+        device.binary_frames = binary_frames
+        recorded = b''.join([device.handle_message(str(STATE_REQUEST) + END_CHAR)[1] for i in range(parse_responses)])
+        parse_start = time.perf_counter()
+        if binary_frames:
+            frames = parse_frames(recorded)[0]
+            power = frames['I_ivp_1'] * frames['V_ivp_1']
+        else:
+            lines = recorded.splitlines()
+            messages = [line.decode().strip().replace(END_CHAR, '').split(DELIMITER) for line in lines]
+            power = np.array([float(message[4]) * float(message[5]) for message in messages])
+        parse_time = (time.perf_counter() - parse_start) / parse_responses
+        for results_dict in results_dict_list[-len(baud_rates):]:
+            results_dict['parse_us'] = parse_time * 1e6
+    return pd.DataFrame(results_dict_list)
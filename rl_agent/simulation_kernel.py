@@ -0,0 +1,240 @@
+import numpy as np
+
+# Numba is optional -- without it the fused NumPy kernel is used
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    numba = None
+    NUMBA_AVAILABLE = False
+
+# Below this exponent np.exp rounds to exactly 0
+EXP_UNDERFLOW_EXPONENT = -746.0
+
+
+# Fused NumPy kernel
+# =============================================
+def numpy_kernel_steps(actor_array, critic_array, reward_array_original, uniform_samples, state_visits,
+                       dirty_rows, actor_step_size, critic_step_size, avg_reward_step_size, temperature,
+                       movement_penalty, roll_frequency, time_of_day_max, rolling_window, last_partition, last_state,
+                       total_steps, avg_reward, total_reward, rolling_reward, prob_buffer):
+    """
+    Runs the agent-environment loop of run_experiment_step with all calls inlined and scratch buffers reused
+
+        * Performs the same floating point operations as SoftmaxAgent/SolarEnv, with the policy and actor update in 
+          the dtype of the tables like the agent's scratch buffers, so results are bit-identical for float64 and 
+          float32 tables
+
+    Args:
+        See run_kernel_steps, the agent/env state is passed in as arrays and scalars
+    Returns:
+        tuple: updated (last_partition, last_state, total_steps, avg_reward, total_reward, rolling_reward, last_delta)
+    """
+    env_rows, env_columns = reward_array_original.shape
+    num_actions = actor_array.shape[2]
+    cdf_buffer = np.empty(num_actions)
+    feature_buffer = np.empty(num_actions, dtype=actor_array.dtype)
+    actor_scalar_type = actor_array.dtype.type
+    time_of_day = total_steps // roll_frequency % time_of_day_max
+    delta = 0.0
+
+    for uniform_sample in uniform_samples:
+        # Policy -- softmax_prob followed by the cdf lookup of RandomState.choice
+        actor_row = actor_array[last_partition, last_state]
+        np.divide(actor_row, temperature, out=prob_buffer)
+        np.subtract(prob_buffer, np.max(prob_buffer), out=prob_buffer)
+        np.exp(prob_buffer, out=prob_buffer)
+        np.divide(prob_buffer, np.sum(prob_buffer), out=prob_buffer)
+        np.cumsum(prob_buffer, dtype=np.float64, out=cdf_buffer)
+        cdf_buffer /= cdf_buffer[-1]
+        action = int(cdf_buffer.searchsorted(uniform_sample, side='right'))
+
+        # Environment step with index conversions done by divmod
+        action_row, action_column = divmod(action, env_columns)
+        last_row, last_column = divmod(last_state, env_columns)
+        reward = reward_array_original[(action_row - time_of_day) % env_rows, (action_column - time_of_day) % env_columns]
+        reward = reward - movement_penalty * (abs(last_row - action_row) + abs(last_column - action_column))
+        total_steps += 1
+        time_of_day = total_steps // roll_frequency % time_of_day_max
+
+        # TD update
+        delta = reward - avg_reward + np.mean(critic_array[time_of_day, action]) - \
+        np.mean(critic_array[last_partition, last_state])
+        avg_reward += avg_reward_step_size * delta
+        critic_array[last_partition, last_state, action] += critic_step_size * delta
+        np.subtract(0.0, prob_buffer, out=feature_buffer)
+        feature_buffer[action] = 1 - prob_buffer[action]
+        feature_buffer *= actor_scalar_type(actor_step_size * delta)
+        actor_row += feature_buffer
+        dirty_rows[last_partition, last_state] = True
+
+        # Tracking
+        last_partition, last_state = time_of_day, action
+        total_reward += reward
+        rolling_reward = (1/rolling_window)*reward + (1-(1/rolling_window))*rolling_reward
+        state_visits[action_row, action_column] += 1
+
+    return last_partition, last_state, total_steps, avg_reward, total_reward, rolling_reward, delta
+
+
+# Numba kernel
+# =============================================
+def _numba_kernel_steps(actor_array, critic_array, reward_array_original, uniform_samples, state_visits,
+                        dirty_rows, actor_step_size, critic_step_size, avg_reward_step_size, temperature,
+                        movement_penalty, roll_frequency, time_of_day_max, rolling_window, last_partition, last_state,
+                        total_steps, avg_reward, total_reward, rolling_reward, prob_buffer):
+    """
+    Compiled equivalent of numpy_kernel_steps
+
+        * Sums, means and exp come from numba rather than numpy, so results match run_experiment_step up to floating 
+          point rounding instead of bit for bit
+    """
+    env_rows, env_columns = reward_array_original.shape
+    num_actions = actor_array.shape[2]
+    cdf_buffer = np.empty(num_actions)
+    time_of_day = total_steps // roll_frequency % time_of_day_max
+    delta = 0.0
+
+    for step in range(uniform_samples.shape[0]):
+        # Policy
+        actor_row = actor_array[last_partition, last_state]
+        max_value = -np.inf
+        for i in range(num_actions):
+            prob_buffer[i] = actor_row[i] / temperature
+            if prob_buffer[i] > max_value:
+                max_value = prob_buffer[i]
+        for i in range(num_actions):
+            exponent = prob_buffer[i] - max_value
+            # exp is most of the kernel's cost, so skip it for unvisited actions and entries that underflow to 0
+            if exponent == 0.0:
+                prob_buffer[i] = 1.0
+            elif exponent < EXP_UNDERFLOW_EXPONENT:
+                prob_buffer[i] = 0.0
+            else:
+                prob_buffer[i] = np.exp(exponent)
+        denominator = np.sum(prob_buffer)
+        running_sum = 0.0
+        for i in range(num_actions):
+            prob_buffer[i] = prob_buffer[i] / denominator
+            running_sum += prob_buffer[i]
+            cdf_buffer[i] = running_sum
+        # Binary search for the first cdf entry above the sample (searchsorted side='right')
+        uniform_sample = uniform_samples[step]
+        cdf_total = cdf_buffer[num_actions - 1]
+        low = 0
+        high = num_actions
+        while low < high:
+            middle = (low + high) // 2
+            if cdf_buffer[middle] / cdf_total <= uniform_sample:
+                low = middle + 1
+            else:
+                high = middle
+        action = low
+
+        # Environment step
+        action_row = action // env_columns
+        action_column = action % env_columns
+        last_row = last_state // env_columns
+        last_column = last_state % env_columns
+        reward = reward_array_original[(action_row - time_of_day) % env_rows, (action_column - time_of_day) % env_columns]
+        reward = reward - movement_penalty * (abs(last_row - action_row) + abs(last_column - action_column))
+        total_steps += 1
+        time_of_day = total_steps // roll_frequency % time_of_day_max
+
+        # TD update
+        next_mean = np.mean(critic_array[time_of_day, action])
+        last_mean = np.mean(critic_array[last_partition, last_state])
+        delta = reward - avg_reward + next_mean - last_mean
+        avg_reward += avg_reward_step_size * delta
+        critic_array[last_partition, last_state, action] += critic_step_size * delta
+        actor_scale = actor_step_size * delta
+        for i in range(num_actions):
+            feature_value = 1.0 if i == action else 0.0
+            actor_row[i] += actor_scale * (feature_value - prob_buffer[i])
+        dirty_rows[last_partition, last_state] = True
+
+        # Tracking
+        last_partition = time_of_day
+        last_state = action
+        total_reward += reward
+        rolling_reward = (1/rolling_window)*reward + (1-(1/rolling_window))*rolling_reward
+        state_visits[action_row, action_column] += 1
+
+    return last_partition, last_state, total_steps, avg_reward, total_reward, rolling_reward, delta
+
+
+if NUMBA_AVAILABLE:
+    _numba_kernel_steps = numba.njit(cache=True)(_numba_kernel_steps)
+
+
+# Driver
+# =============================================
+def max_time_of_day_reached(env, num_steps):
+    """
+    Finds the largest time of day an env reaches over the next steps, to bounds check partitions before the kernel
+
+    Args:
+        env (SolarEnv): the environment
+        num_steps (int): the number of steps that will be run
+    Returns:
+        int: the max time of day value
+    """
+    first_roll = env.total_steps // env.roll_frequency
+    last_roll = (env.total_steps + num_steps) // env.roll_frequency
+    if last_roll - first_roll + 1 >= env.time_of_day_max:
+        return env.time_of_day_max - 1
+    return max(roll % env.time_of_day_max for roll in range(first_roll, last_roll + 1))
+
+
+def run_kernel_steps(env, agent, num_steps, use_numba=NUMBA_AVAILABLE):
+    """
+    Advances an agent and environment by a number of steps in one kernel call, leaving both in the same state
+    run_experiment_step would
+
+        * The agent's uniform draws are taken in bulk from its generator (RandomState or Generator), which yields the
+          same stream
+
+    Args:
+        env (SolarEnv): the environment being used in the experiment
+        agent (SoftmaxAgent): a started agent with dense actor/critic tables
+        num_steps (int): the number of steps to run
+    Kwargs:
+        use_numba (bool): True for the compiled kernel, False for the fused NumPy kernel
+    Returns:
+        None
+    """
+    if agent.table_storage != 'dense':
+        raise ValueError('The fast engine requires dense actor/critic tables')
+    if agent.critic_means != 'reduce':
+        raise ValueError('The fast engine requires critic_means="reduce"')
+    if agent.action_space != 'full':
+        raise ValueError('The fast engine requires action_space="full"')
+    if use_numba and not NUMBA_AVAILABLE:
+        raise ImportError('numba is required for the compiled kernel')
+    if max_time_of_day_reached(env, num_steps) >= agent.agent_shape[0]:
+        raise IndexError('Environment time of day exceeds the agent day_partitions')
+    if num_steps <= 0:
+        return
+
+    # Probabilities in the dtype of the tables, like the agent's prob_buffer
+    prob_buffer = np.empty(agent.agent_shape[2], dtype=agent.actor_array.dtype)
+    uniform_samples = agent.random_generator.random(num_steps)
+    kernel_args = (agent.actor_array, agent.critic_array, np.ascontiguousarray(env.reward_array_original, dtype=float),
+                   uniform_samples, agent.state_visits, agent.dirty_rows, float(agent.actor_step_size),
+                   float(agent.critic_step_size), float(agent.avg_reward_step_size), float(agent.temperature),
+                   float(env.movement_penalty), int(env.roll_frequency), int(env.time_of_day_max),
+                   float(agent.rolling_window), int(agent.last_state[0]), int(agent.last_state[1]),
+                   int(env.total_steps), float(agent.avg_reward), float(agent.total_reward),
+                   float(agent.rolling_reward), prob_buffer)
+    if use_numba:
+        kernel_result = _numba_kernel_steps(*kernel_args)
+    else:
+        kernel_result = numpy_kernel_steps(*kernel_args)
+    last_partition, last_state, env.total_steps, agent.avg_reward, agent.total_reward, agent.rolling_reward, \
+    agent.last_delta = kernel_result
+
+    # Sync the remaining agent/env fields
+    env.increment_time_of_day()
+    agent.last_state = (last_partition, last_state)
+    agent.last_action = last_state
+    np.copyto(agent.step_softmax_prob, prob_buffer)
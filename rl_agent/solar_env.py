@@ -1,7 +1,14 @@
+import os
+import json
+import hashlib
 import pandas as pd
 import numpy as np
 from common_functions import *
 
+# Compiled environment cache settings
+ENV_CACHE_VERSION = 1
+ENV_CACHE_DIR_NAME = '_env_cache'
+
 # Function to help prep data for class
 def load_and_format_solar_df(data_path):
     """
@@ -21,7 +28,7 @@ def load_and_format_solar_df(data_path):
     data_df['power'] = data_df['I_ivp_1'] * data_df['V_ivp_1']
     return data_df
 
-def convert_solar_df_to_value_array(solar_data_df, degree_discretization=5):
+def convert_solar_df_to_value_array(solar_data_df, degree_discretization=5, reduction='last'):
     """
     Convert the solar data df into a reward array to pass to SolarEnv
     
@@ -29,52 +36,235 @@ def convert_solar_df_to_value_array(solar_data_df, degree_discretization=5):
         solar_data_df (DataFrame): df returned by load_and_format_solar_df
     Kwargs:
         degree_discretization (int): number of degrees to discretize motor positions by (e.g., 180 // value)
+        reduction (str): how to combine rows that fall into the same cell -- 'last' (row order), 'mean' or 'max'
     Returns:
         numpy array: array of environment reward values for SolarEnv
     """
-    # Find bounds of motor positions to create max index, zeros array
-    max_index = max(solar_data_df['motor_1_position'].max(), solar_data_df['motor_2_position'].max())//degree_discretization
+    # Find the cell of every data point as a flat index into the array
+    motor_1_index = (solar_data_df['motor_1_position'].to_numpy() // degree_discretization).astype(int)
+    motor_2_index = (solar_data_df['motor_2_position'].to_numpy() // degree_discretization).astype(int)
+    position_reward = solar_data_df['power'].to_numpy(dtype=float)
+    max_index = max(motor_1_index.max(), motor_2_index.max())
     array_shape = (max_index+1, max_index+1)
-    reward_array = np.zeros(array_shape)
+    flat_index = motor_1_index * array_shape[1] + motor_2_index
     
-    # For each data point, populate the array at its index
-    for index, row in solar_data_df.iterrows():
-        motor_1_index = int(row['motor_1_position'].item()//degree_discretization)
-        motor_2_index = int(row['motor_2_position'].item()//degree_discretization)
-        position_reward = row['power'].item()
-        reward_array[motor_1_index][motor_2_index] = position_reward
+    # Populate the array in one scatter per reduction
+    if reduction == 'last':
+        # Keep the last row for each cell, found as the first occurrence in reversed order
+        _, reversed_first = np.unique(flat_index[::-1], return_index=True)
+        last_rows = len(flat_index) - 1 - reversed_first
+        reward_array = np.zeros(array_shape[0] * array_shape[1])
+        reward_array[flat_index[last_rows]] = position_reward[last_rows]
+    elif reduction == 'mean':
+        cell_sums = np.bincount(flat_index, weights=position_reward, minlength=array_shape[0] * array_shape[1])
+        cell_counts = np.bincount(flat_index, minlength=array_shape[0] * array_shape[1])
+        reward_array = np.divide(cell_sums, cell_counts, out=np.zeros_like(cell_sums), where=cell_counts > 0)
+    elif reduction == 'max':
+        reward_array = np.full(array_shape[0] * array_shape[1], -np.inf)
+        np.maximum.at(reward_array, flat_index, position_reward)
+        reward_array[np.isneginf(reward_array)] = 0
+    else:
+        raise ValueError('reduction must be "last", "mean" or "max", got ' + str(reduction))
     
-    return reward_array
+    return reward_array.reshape(array_shape)
+
+# Compiled environment cache
+def hash_file(path):
+    """
+    Args:
+        path (str): path to a file
+    Returns:
+        str: sha256 hex digest of the file contents
+    """
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_env_cache_paths(data_path, degree_discretization=5, reduction='last', cache_dir=None):
+    """
+    Args:
+        data_path (str): Path to a csv of logged data for an environment
+    Kwargs:
+        degree_discretization (int): number of degrees motor positions are discretized by
+        reduction (str): reduction passed to convert_solar_df_to_value_array
+        cache_dir (str): directory holding compiled environments, or None for _env_cache next to the data
+    Returns:
+        str, str: path of the .npy reward grid, path of its .json metadata header
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(data_path)), ENV_CACHE_DIR_NAME)
+    base_name = os.path.splitext(os.path.basename(data_path))[0] + '_d' + str(degree_discretization) + '_' + reduction
+    return os.path.join(cache_dir, base_name + '.npy'), os.path.join(cache_dir, base_name + '.json')
+
+
+def compile_env_cache(data_path, degree_discretization=5, roll_frequency=500, reduction='last', cache_dir=None):
+    """
+    Build the reward grid for logged data and write it as a compiled environment (.npy grid + .json header)
+    
+    Args:
+        data_path (str): Path to a csv of logged data for an environment
+    Kwargs:
+        degree_discretization (int): number of degrees to discretize motor positions by
+        roll_frequency (int): default roll frequency recorded for envs created from the cache
+        reduction (str): reduction passed to convert_solar_df_to_value_array
+        cache_dir (str): directory holding compiled environments, or None for _env_cache next to the data
+    Returns:
+        dict: the metadata header written
+    """
+    array_path, metadata_path = get_env_cache_paths(data_path, degree_discretization, reduction, cache_dir)
+    os.makedirs(os.path.dirname(array_path), exist_ok=True)
+    
+    # Hash before parsing so a csv modified mid-build is detected on the next load
+    source_hash = hash_file(data_path)
+    reward_array = convert_solar_df_to_value_array(load_and_format_solar_df(data_path), degree_discretization, 
+                                                   reduction=reduction)
+    metadata = {
+        'version': ENV_CACHE_VERSION,
+        'source_path': os.path.abspath(data_path),
+        'source_sha256': source_hash,
+        'degree_discretization': degree_discretization,
+        'reduction': reduction,
+        'roll_frequency': roll_frequency,
+        'shape': list(reward_array.shape),
+        'dtype': reward_array.dtype.str
+    }
+    
+    # Write grid then header through temp files, so readers never see a header for a partial grid
+    with open(array_path + '.tmp', 'wb') as array_file:
+        np.save(array_file, reward_array)
+    os.replace(array_path + '.tmp', array_path)
+    with open(metadata_path + '.tmp', 'w') as metadata_file:
+        json.dump(metadata, metadata_file, indent=2)
+    os.replace(metadata_path + '.tmp', metadata_path)
+    return metadata
+
+
+def load_env_cache(data_path, degree_discretization=5, roll_frequency=500, reduction='last', cache_dir=None, 
+                   mmap_mode='r'):
+    """
+    Load the compiled environment for logged data, compiling it first if it is missing or its source csv changed
+    
+        * The grid is memory-mapped read-only by default, so processes loading it share the same pages
+    
+    Args:
+        data_path (str): Path to a csv of logged data for an environment
+    Kwargs:
+        degree_discretization (int): number of degrees to discretize motor positions by
+        roll_frequency (int): roll frequency recorded if the cache has to be compiled
+        reduction (str): reduction passed to convert_solar_df_to_value_array
+        cache_dir (str): directory holding compiled environments, or None for _env_cache next to the data
+        mmap_mode (str): mmap_mode passed to np.load, or None to read into memory
+    Returns:
+        numpy array, dict: the reward grid, its metadata header
+    """
+    array_path, metadata_path = get_env_cache_paths(data_path, degree_discretization, reduction, cache_dir)
+    metadata = None
+    if os.path.exists(metadata_path) and os.path.exists(array_path):
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+        if metadata.get('version') != ENV_CACHE_VERSION or metadata.get('source_sha256') != hash_file(data_path):
+            metadata = None
+    if metadata is None:
+        metadata = compile_env_cache(data_path, degree_discretization, roll_frequency, reduction, cache_dir)
+    return np.load(array_path, mmap_mode=mmap_mode), metadata
+
+
+def create_env_from_cache(data_path, degree_discretization=5, roll_frequency=None, movement_penalty=0.0001, 
+                          reduction='last', cache_dir=None):
+    """
+    Create a SolarEnv over a memory-mapped compiled environment
+    
+    Args:
+        data_path (str): Path to a csv of logged data for an environment
+    Kwargs:
+        degree_discretization (int): number of degrees to discretize motor positions by
+        roll_frequency (int): roll frequency of the env, or None to use the one in the cache header
+        movement_penalty (float): penalty for each index of movement by an agent
+        reduction (str): reduction passed to convert_solar_df_to_value_array
+        cache_dir (str): directory holding compiled environments, or None for _env_cache next to the data
+    Returns:
+        SolarEnv: the environment
+    """
+    reward_array, metadata = load_env_cache(data_path, degree_discretization, 
+                                            roll_frequency if roll_frequency is not None else 500, reduction, cache_dir)
+    if roll_frequency is None:
+        roll_frequency = metadata['roll_frequency']
+    return SolarEnv(reward_array, movement_penalty=movement_penalty, roll_frequency=roll_frequency)
 
 # Solar Environment Class
 class SolarEnv:
-    def __init__(self, value_array, movement_penalty=0.0001, roll_frequency=500):
+    def __init__(self, value_array, movement_penalty=0.0001, roll_frequency=500, time_of_day_max=24):
         """
         Args:
             value_array (numpy): array of square dimensions of values of environment
         Kwargs:
             movement_pentalty (float): penalty for each index of movement by an agent
             roll_frequency (int): frequency of steps with which environment changes (or None for static env)            
+            time_of_day_max (int): number of times of day the environment cycles through
         """
         
         # Initialize with passed in value array, penalty per index of movement
         self.reward_array_original = value_array
-        self.reward_array = self.reward_array_original.copy()
+        self.env_shape = self.reward_array_original.shape
         self.movement_penalty = movement_penalty
         self.total_steps = 0
         self.roll_frequency = roll_frequency
         self.time_of_day = 0
-        self.time_of_day_max = 24
+        self.time_of_day_max = time_of_day_max
+        
+        # Rolled reward array is only materialized on request, keyed by the time of day it was rolled for
+        self.rolled_reward_array = None
+        self.rolled_time_of_day = None
+
+    @property
+    def reward_array(self):
+        """
+        The environment values shifted for the current time of day (materialized on first access per time of day)
+        """
+        if self.rolled_time_of_day != self.time_of_day:
+            self.roll_values()
+        return self.rolled_reward_array
+
+    @reward_array.setter
+    def reward_array(self, value_array):
+        """
+        Replace the environment values with an array as they should read at the current time of day, keeping them 
+        for later times of day by storing the array unrolled as the original
+        """
+        value_array = np.array(value_array)
+        self.reward_array_original = np.roll(np.roll(value_array, -self.time_of_day, axis=0), -self.time_of_day, 
+                                             axis=1)
+        self.env_shape = self.reward_array_original.shape
+        self.rolled_reward_array = value_array
+        self.rolled_time_of_day = self.time_of_day
 
     def roll_values(self):
         """
         Changes the environment values by shifting over and up one
         """
-        self.reward_array = np.roll(np.roll(self.reward_array_original, self.time_of_day, axis=0), self.time_of_day, axis=1)
+        self.rolled_reward_array = np.roll(np.roll(np.asarray(self.reward_array_original), self.time_of_day, axis=0), self.time_of_day, axis=1)
+        self.rolled_time_of_day = self.time_of_day
         
     def increment_time_of_day(self):
         self.time_of_day = self.total_steps // self.roll_frequency % self.time_of_day_max
     
+    def lookup_reward(self, index_tuple):
+        """
+        Reads the reward at an index of the rolled environment directly from the original array
+        
+            * np.roll by t moves the value at i to i + t, so the rolled value at i is the original at (i - t) mod n
+        
+        Args:
+            index_tuple (tuple): Index pair (ints or index arrays) in env-based index
+        Returns:
+            reward at the index for the current time of day
+        """
+        return self.reward_array_original[(index_tuple[0] - self.time_of_day) % self.env_shape[0],
+                                          (index_tuple[1] - self.time_of_day) % self.env_shape[1]]
+    
     def env_step(self, action_tuple, last_state_tuple):
         """
         Completes a step of the environment
@@ -87,14 +277,13 @@ class SolarEnv:
         """
         
         # Reward is power received
-        reward = self.reward_array[action_tuple]
+        reward = self.lookup_reward(action_tuple)
         # Add a cost from moving motors to new position
         cost = self.movement_penalty * (abs(last_state_tuple[0] - action_tuple[0]) +
                                    abs(last_state_tuple[1] - action_tuple[1]))
-        # Increment step count, do roll of values if specified for env
+        # Increment step count, time of day shift is applied lazily on reward lookup
         self.total_steps += 1
         self.increment_time_of_day()
-        self.roll_values()
 
         return reward - cost, (self.time_of_day, action_tuple)
 
@@ -103,4 +292,113 @@ class SolarEnv:
         return self.reward_array.copy()
 
     def get_env_shape(self):
-        return self.reward_array.shape
\ No newline at end of file
+        return self.env_shape
+
+# Vectorized Solar Environment Class
+class VectorSolarEnv:
+    def __init__(self, value_arrays, movement_penalty=0.0001, roll_frequency=500, phase_offsets=None, 
+                 time_of_day_max=24):
+        """
+        M SolarEnvs stepped together, with their value arrays stacked into one (M, H, W) array
+        
+            * Env m behaves like SolarEnv(value_arrays[m]) that has already taken phase_offsets[m] steps, so 
+              environments can be at different times of day
+            * env_step takes index arrays with one action per environment and returns arrays of M rewards and states
+        
+        Args:
+            value_arrays (list): value arrays of the same shape, one per environment (or an (M, H, W) array)
+        Kwargs:
+            movement_penalty (float): penalty for each index of movement by an agent
+            roll_frequency (int): frequency of steps with which environments change
+            phase_offsets (list): steps each environment starts into the day, or None to start all at 0
+            time_of_day_max (int): number of times of day the environments cycle through
+        """
+        self.reward_arrays_original = np.stack([np.asarray(value_array) for value_array in value_arrays])
+        self.num_envs = self.reward_arrays_original.shape[0]
+        self.env_shape = self.reward_arrays_original.shape[1:]
+        self.env_index = np.arange(self.num_envs)
+        self.movement_penalty = movement_penalty
+        self.roll_frequency = roll_frequency
+        self.time_of_day_max = time_of_day_max
+        if phase_offsets is None:
+            phase_offsets = np.zeros(self.num_envs, dtype=int)
+        self.total_steps = np.array(phase_offsets, dtype=int)
+        if self.total_steps.shape != (self.num_envs,):
+            raise ValueError('phase_offsets needs one offset per environment')
+        self.increment_time_of_day()
+    
+    def increment_time_of_day(self):
+        self.time_of_day = self.total_steps // self.roll_frequency % self.time_of_day_max
+    
+    def lookup_reward(self, index_tuple):
+        """
+        Reads the reward of each environment at its index for its current time of day (see SolarEnv.lookup_reward)
+        
+        Args:
+            index_tuple (tuple): Index pair of arrays with one index per environment
+        Returns:
+            numpy array: reward of each environment
+        """
+        return self.reward_arrays_original[self.env_index, (index_tuple[0] - self.time_of_day) % self.env_shape[0],
+                                           (index_tuple[1] - self.time_of_day) % self.env_shape[1]]
+    
+    def env_step(self, action_tuple, last_state_tuple):
+        """
+        Completes a step of every environment
+        
+        Args:
+            action_tuple (tuple): Index pair of arrays to move to in env-based index, one index per environment
+            last_state_tuple (tuple): Index pair of arrays of the last states, to calculate movement penalty
+        Returns:
+            reward array, next_state_tuple of (time of day array, action_tuple)
+        """
+        
+        # Reward is power received
+        reward = self.lookup_reward(action_tuple)
+        # Add a cost from moving motors to new position
+        cost = self.movement_penalty * (np.abs(last_state_tuple[0] - action_tuple[0]) +
+                                        np.abs(last_state_tuple[1] - action_tuple[1]))
+        # Increment step counts, time of day shift is applied on reward lookup
+        self.total_steps += 1
+        self.increment_time_of_day()
+        
+        return reward - cost, (self.time_of_day.copy(), action_tuple)
+    
+    def get_reward_arrays(self):
+        """
+        Returns:
+            numpy array: (M, H, W) environment values shifted for each environment's time of day
+        """
+        return np.stack([np.roll(np.roll(self.reward_arrays_original[m], self.time_of_day[m], axis=0), 
+                                 self.time_of_day[m], axis=1) for m in range(self.num_envs)])
+    
+    def get_env_shape(self):
+        return self.env_shape
+    
+    def get_num_envs(self):
+        return self.num_envs
+
+
+def create_vector_env_from_data_paths(data_paths, degree_discretization=5, movement_penalty=0.0001, roll_frequency=500,
+                                      phase_offsets=None):
+    """
+    Create a VectorSolarEnv with one environment per logged data set
+    
+    Args:
+        data_paths (list): Paths to csvs of logged data, e.g. the sets in simulation_data/data/initial_environments 
+            (a path may repeat with different phase offsets)
+    Kwargs:
+        degree_discretization (int): number of degrees to discretize motor positions by
+        movement_penalty (float): penalty for each index of movement by an agent
+        roll_frequency (int): frequency of steps with which environments change
+        phase_offsets (list): steps each environment starts into the day, or None to start all at 0
+    Returns:
+        VectorSolarEnv: the environments
+    """
+    value_arrays = {}
+    for data_path in data_paths:
+        if data_path not in value_arrays:
+            value_arrays[data_path] = convert_solar_df_to_value_array(load_and_format_solar_df(data_path), 
+                                                                      degree_discretization)
+    return VectorSolarEnv([value_arrays[data_path] for data_path in data_paths], movement_penalty=movement_penalty, 
+                          roll_frequency=roll_frequency, phase_offsets=phase_offsets)
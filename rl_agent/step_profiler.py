@@ -0,0 +1,234 @@
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Methods timed as phases, named after the step phases they cover:
+#   compute_softmax_prob is the policy, draw_action the sampling, increment_time_of_day (and roll_values when the
+#   rolled array is read) the env roll, and agent_step (compute_delta, update_critic, update_actor) the TD update
+AGENT_PHASES = ['agent_policy', 'sample_action', 'compute_softmax_prob', 'draw_action', 'set_policy_action',
+                'get_action_target', 'agent_step', 'compute_delta', 'update_critic', 'update_actor']
+ENV_PHASES = ['env_step', 'lookup_reward', 'increment_time_of_day', 'roll_values']
+
+# Root of every phase path, covering the loop itself (progress bar, logging checks) as its own time
+ROOT_PHASE = 'run_agent_experiment'
+
+# Timing histograms have a bucket per power of two nanoseconds
+HISTOGRAM_BUCKETS = 64
+
+
+class PhaseStats:
+    def __init__(self):
+        """
+        Timings of one phase path, with a log2 histogram of the durations of its calls
+        """
+        self.calls = 0
+        self.total_ns = 0
+        self.self_ns = 0
+        self.max_ns = 0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+        self.alloc_peak_bytes = 0
+        self.max_alloc_peak_bytes = 0
+        self.net_blocks = 0
+
+    def record(self, elapsed_ns, self_ns, alloc_peak_bytes, net_blocks):
+        self.calls += 1
+        self.total_ns += elapsed_ns
+        self.self_ns += self_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.histogram[elapsed_ns.bit_length()] += 1
+        self.alloc_peak_bytes += alloc_peak_bytes
+        if alloc_peak_bytes > self.max_alloc_peak_bytes:
+            self.max_alloc_peak_bytes = alloc_peak_bytes
+        self.net_blocks += net_blocks
+
+    def get_percentile_ns(self, percentile):
+        """
+        Returns:
+            int: the upper edge of the histogram bucket holding the percentile (within a factor of 2 of the value)
+        """
+        counts = np.cumsum(self.histogram)
+        return 2 ** int(np.searchsorted(counts, counts[-1] * percentile / 100))
+
+
+class StepProfiler:
+    def __init__(self, output_dir=None, track_allocations=False, print_summary=True):
+        """
+        Opt-in timing of the phases of experiment steps, for run_agent_experiment(profiler=...)
+
+            * Instrumenting an agent or environment wraps the methods in AGENT_PHASES/ENV_PHASES on that instance
+              only, so nothing is timed (or slowed) unless a profiler is passed, and the wrappers are removed by stop
+            * Phases are recorded by their path of nested calls (e.g. run_experiment_step;agent_step;update_actor),
+              with calls, total and self time and a log2 histogram of durations
+            * track_allocations traces allocations with tracemalloc (slowing the run down several times), recording
+              the peak bytes allocated above the start of each phase and the net change in allocated blocks
+            * dump prints a summary table and writes it (summary.csv) with the self time of each path in the
+              collapsed stack format of flamegraph.pl and speedscope (stacks.folded, weights in microseconds)
+
+        Kwargs:
+            output_dir (str): directory to write the summary and collapsed stacks to, or None to only print
+            track_allocations (bool): True to record allocations with tracemalloc
+            print_summary (bool): True to print the summary table on dump
+        """
+        self.output_dir = output_dir
+        self.track_allocations = track_allocations
+        self.print_summary = print_summary
+        self.phase_stats = {}
+        # Frames of the phases being timed: [path, start_ns, child_ns, start_bytes, peak_bytes, start_blocks]
+        self.stack = [[ROOT_PHASE, 0, 0, 0, 0, 0]]
+        self.instrumented = []
+        self.wall_ns = 0
+        self.started_tracemalloc = False
+
+    def start(self):
+        if self.track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        self.stack[0][1] = time.perf_counter_ns()
+
+    def stop(self):
+        """
+        Stop timing and remove the wrappers from the instrumented objects
+        """
+        self.wall_ns += time.perf_counter_ns() - self.stack[0][1]
+        for instance, method_names in self.instrumented:
+            for method_name in method_names:
+                del instance.__dict__[method_name]
+        self.instrumented = []
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    # Instrumentation
+    # =============================================
+    def enter(self, name):
+        if self.track_allocations:
+            start_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            self.stack[-1][4] = max(self.stack[-1][4], peak_bytes)
+            tracemalloc.reset_peak()
+            self.stack.append([self.stack[-1][0] + ';' + name, 0, 0, start_bytes, start_bytes,
+                               sys.getallocatedblocks()])
+        else:
+            self.stack.append([self.stack[-1][0] + ';' + name, 0, 0, 0, 0, 0])
+        self.stack[-1][1] = time.perf_counter_ns()
+
+    def exit(self):
+        end_ns = time.perf_counter_ns()
+        path, start_ns, child_ns, start_bytes, peak_bytes, start_blocks = self.stack.pop()
+        elapsed_ns = end_ns - start_ns
+        self.stack[-1][2] += elapsed_ns
+        alloc_peak_bytes = 0
+        net_blocks = 0
+        if self.track_allocations:
+            peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+            self.stack[-1][4] = max(self.stack[-1][4], peak_bytes)
+            alloc_peak_bytes = peak_bytes - start_bytes
+            net_blocks = sys.getallocatedblocks() - start_blocks
+        if path not in self.phase_stats:
+            self.phase_stats[path] = PhaseStats()
+        self.phase_stats[path].record(elapsed_ns, elapsed_ns - child_ns, alloc_peak_bytes, net_blocks)
+
+    def wrap(self, name, function):
+        """
+        Returns:
+            function: function timed as the phase name whenever it is called
+        """
+        def profiled_function(*args, **kwargs):
+            self.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.exit()
+        return profiled_function
+
+    def instrument(self, instance, method_names):
+        """
+        Time methods of one object as phases named after the methods, until stop
+        """
+        # Record each wrapper as it is set, so stop removes them even if a later method is missing
+        wrapped_names = []
+        self.instrumented.append((instance, wrapped_names))
+        for method_name in method_names:
+            setattr(instance, method_name, self.wrap(method_name, getattr(instance, method_name)))
+            wrapped_names.append(method_name)
+
+    # Results
+    # =============================================
+    def get_summary_df(self):
+        """
+        Returns:
+            DataFrame: per phase path, the calls, total and self time (ms), share of the wall time, mean and max
+                duration (us) and p50/p95/p99 duration bucket edges (us), with mean alloc peak (bytes) and net
+                blocks per call when tracking allocations
+        """
+        wall_ns = max(self.wall_ns, 1)
+        results_dict_list = []
+        for path, stats in self.phase_stats.items():
+            results_dict = {
+                'phase': path,
+                'calls': stats.calls,
+                'total_ms': stats.total_ns / 1e6,
+                'self_ms': stats.self_ns / 1e6,
+                'wall_share': stats.total_ns / wall_ns,
+                'mean_us': stats.total_ns / stats.calls / 1000,
+                'p50_us': stats.get_percentile_ns(50) / 1000,
+                'p95_us': stats.get_percentile_ns(95) / 1000,
+                'p99_us': stats.get_percentile_ns(99) / 1000,
+                'max_us': stats.max_ns / 1000
+            }
+            if self.track_allocations:
+                results_dict['alloc_peak_bytes'] = stats.alloc_peak_bytes / stats.calls
+                results_dict['max_alloc_peak_bytes'] = stats.max_alloc_peak_bytes
+                results_dict['net_blocks'] = stats.net_blocks / stats.calls
+            results_dict_list.append(results_dict)
+        return pd.DataFrame(results_dict_list).sort_values('phase').reset_index(drop=True)
+
+    def get_collapsed_stacks(self):
+        """
+        Returns:
+            list: 'path self_us' lines, with the loop's own time (the wall time less its phases) on ROOT_PHASE
+        """
+        root_ns = self.wall_ns - sum([stats.total_ns for path, stats in self.phase_stats.items()
+                                      if path.count(';') == 1])
+        lines = [ROOT_PHASE + ' ' + str(max(root_ns, 0) // 1000)]
+        for path in sorted(self.phase_stats):
+            lines.append(path + ' ' + str(self.phase_stats[path].self_ns // 1000))
+        return lines
+
+    def get_histogram(self, path):
+        """
+        Returns:
+            numpy array, numpy array: upper bucket edges (ns), the number of calls of the phase path in each bucket
+        """
+        histogram = np.array(self.phase_stats[path].histogram)
+        last_bucket = np.flatnonzero(histogram)[-1]
+        return 2 ** np.arange(last_bucket + 1), histogram[:last_bucket + 1]
+
+    def dump(self):
+        """
+        Print the summary table and write it and the collapsed stacks to output_dir (if set)
+
+        Returns:
+            DataFrame: the summary (see get_summary_df)
+        """
+        summary_df = self.get_summary_df()
+        if self.print_summary:
+            print('Wall time: ' + str(round(self.wall_ns / 1e6, 3)) + ' ms')
+            print(summary_df.to_string(index=False, float_format=lambda value: '%.3f' % value))
+        if self.output_dir is not None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            summary_df.to_csv(os.path.join(self.output_dir, 'summary.csv'), index=False)
+            with open(os.path.join(self.output_dir, 'stacks.folded'), 'w') as stacks_file:
+                stacks_file.write('\n'.join(self.get_collapsed_stacks()) + '\n')
+        return summary_df
+
+    # Access Functions
+    def get_wall_ns(self):
+        return self.wall_ns
+
+    def get_phase_stats(self):
+        return self.phase_stats
@@ -0,0 +1,439 @@
+import os
+import math
+from multiprocessing import shared_memory
+
+import pandas as pd
+import numpy as np
+
+import tqdm
+from tqdm import tqdm
+
+# Module imports
+import solar_env
+from solar_env import SolarEnv
+
+import experiment_functions as ef
+import experiment_runner
+from rl_agent import SoftmaxAgent
+import checkpoint
+
+# Declare random seed
+RANDOM_SEED = 1
+
+# Order of hyperparameters in a combination tuple
+HYPERPARAMETER_NAMES = ('temperature', 'actor_step_size', 'critic_step_size', 'avg_reward_step_size')
+
+# Default values swept for each hyperparameter
+DEFAULT_SWEEP_VALUES = [1*10**-x for x in range(0,5)]
+
+# Per-worker state, set once by the pool initializer
+_worker_state = {}
+
+
+def create_env_from_data_path(path, env_roll_frequency, degree_discretization=5, use_cache=False):
+    """
+    Load logged data and build a SolarEnv from it
+
+    Args:
+        path (str): path to env data
+        env_roll_frequency (int): number of steps to shift env reward array at
+    Kwargs:
+        degree_discretization (int): number of degrees to discretize motor positions by
+        use_cache (bool): True to load through the compiled environment cache (see solar_env.load_env_cache)
+    Returns:
+        SolarEnv: the environment
+    """
+    if use_cache:
+        return solar_env.create_env_from_cache(path, degree_discretization, roll_frequency=env_roll_frequency)
+    data_df = solar_env.load_and_format_solar_df(path)
+    env_reward_array = solar_env.convert_solar_df_to_value_array(data_df, degree_discretization)
+    return SolarEnv(env_reward_array, roll_frequency=env_roll_frequency)
+
+
+def create_hyperparam_combinations(temperature_values, actor_step_size_values, critic_step_size_values,
+                                   avg_reward_step_size_values):
+    """
+    Create every combination of the hyperparameter values as tuples ordered as HYPERPARAMETER_NAMES
+
+    Returns:
+        list: list of (temperature, actor_step_size, critic_step_size, avg_reward_step_size) tuples
+    """
+    combinations = []
+    # Sweep temperature
+    for temperature in temperature_values:
+        # Sweep actor step size
+        for actor_step_size in actor_step_size_values:
+            # Sweep critic step size
+            for critic_step_size in critic_step_size_values:
+                # Sweep avg reward step size
+                for avg_reward_step_size in avg_reward_step_size_values:
+                    combinations.append((temperature, actor_step_size, critic_step_size, avg_reward_step_size))
+    return combinations
+
+
+def get_combination_checkpoint_dir(checkpoint_dir, combination):
+    """
+    Returns:
+        str: the checkpoint directory of a combination within the checkpoint directory of a study
+    """
+    return os.path.join(checkpoint_dir, '_'.join([name + '=' + '{:g}'.format(value)
+                                                  for name, value in zip(HYPERPARAMETER_NAMES, combination)]))
+
+
+def get_finished_metric(checkpoint_dir, combination, steps, metric):
+    """
+    Returns:
+        float: the metric of a combination whose checkpoint finished the given steps, or None if it has not
+    """
+    meta = checkpoint.load_checkpoint_meta(get_combination_checkpoint_dir(checkpoint_dir, combination))
+    if meta is None or not meta['finished'] or meta['step'] != steps:
+        return None
+    return meta['total_reward'] if metric == 'total_reward' else meta['rolling_reward']
+
+
+# Shared memory
+# =============================================
+def create_shared_array(array):
+    """
+    Copy an array into a new shared memory block
+
+    Args:
+        array (numpy array): the array to share
+    Returns:
+        SharedMemory, tuple: the shared memory block (owned by the caller), the (name, shape, dtype) spec to attach it
+    """
+    shared_block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shared_block.buf)
+    shared_array[...] = array
+    return shared_block, (shared_block.name, array.shape, array.dtype.str)
+
+
+def attach_shared_array(array_spec):
+    """
+    Attach to a shared array created by create_shared_array as a read-only array
+
+    Args:
+        array_spec (tuple): the (name, shape, dtype) spec of the shared array
+    Returns:
+        SharedMemory, numpy array: the attached block (keep a reference while in use), the array view
+    """
+    name, shape, dtype = array_spec
+    shared_block = shared_memory.SharedMemory(name=name)
+    shared_array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shared_block.buf)
+    shared_array.flags.writeable = False
+    return shared_block, shared_array
+
+
+# Workers
+# =============================================
+def _init_sweep_worker(reward_array_spec, env_settings, experiment_settings):
+    """
+    Pool initializer: attach to the shared reward array and keep the settings common to all tasks
+    """
+    _worker_state['shared_block'], _worker_state['reward_array'] = attach_shared_array(reward_array_spec)
+    _worker_state['env_settings'] = env_settings
+    _worker_state['experiment_settings'] = experiment_settings
+
+
+def _run_sweep_task(task):
+    """
+    Run one experiment in a pool worker, building a fresh SolarEnv over the shared reward array
+
+    Args:
+        task (dict): hyperparameters keyed by HYPERPARAMETER_NAMES
+    Returns:
+        dict: the metric the combination achieved
+    """
+    combination = tuple([task[name] for name in HYPERPARAMETER_NAMES])
+    temperature, actor_step_size, critic_step_size, avg_reward_step_size = combination
+    settings = _worker_state['experiment_settings']
+    env = SolarEnv(_worker_state['reward_array'], **_worker_state['env_settings'])
+    checkpoint_dir = None
+    if settings['checkpoint_dir'] is not None:
+        checkpoint_dir = get_combination_checkpoint_dir(settings['checkpoint_dir'], combination)
+    seed = get_combination_seed(settings['seed'], combination, rng=settings['rng'])
+    metric_value = ef.run_agent_experiment(env, settings['steps'], seed, settings['day_partitions'],
+                                           actor_step_size, critic_step_size, avg_reward_step_size, temperature,
+                                           rolling_steps_measurement=settings['rolling_steps_measurement'],
+                                           logging_interval=None, hide_progress_bar=True, metric=settings['metric'],
+                                           engine=settings['engine'], checkpoint_dir=checkpoint_dir,
+                                           checkpoint_interval=settings['checkpoint_interval'], rng=settings['rng'])
+    return {'metric': metric_value}
+
+
+# Study
+# =============================================
+def get_combination_seed(seed, combination, rng='legacy'):
+    """
+    Seeds the agent of one hyperparameter combination of a study
+    
+        * 'legacy' gives every combination the study seed, so they all draw the same stream
+        * 'pcg64' gives each combination the SeedSequence child of the seed keyed by its hyperparameter values 
+          (the spawn_key SeedSequence.spawn would assign), so each combination draws its own independent stream 
+          whatever the number of cores, task order or study it runs in
+    
+    Args:
+        seed (int): the seed of the study
+        combination (tuple): the hyperparameter values
+    Kwargs:
+        rng (str): 'legacy' or 'pcg64' (see create_random_generator)
+    Returns:
+        int or SeedSequence: the random_seed of the combination's agent
+    """
+    if rng == 'legacy':
+        return seed
+    spawn_key = tuple([int(value) for value in np.asarray(combination, dtype=np.float64).view(np.uint64)])
+    return np.random.SeedSequence(seed, spawn_key=spawn_key)
+
+
+def run_hyperparam_study(env_data_path, env_roll_frequency, steps, seed, day_partitions, cores,
+                         temperature_values=DEFAULT_SWEEP_VALUES, actor_step_size_values=DEFAULT_SWEEP_VALUES,
+                         critic_step_size_values=DEFAULT_SWEEP_VALUES, avg_reward_step_size_values=DEFAULT_SWEEP_VALUES,
+                         metric='rolling_reward', chunksize=1, engine='python', use_cache=False, hide_progress_bar=False,
+                         checkpoint_dir=None, checkpoint_interval=100000, results_path=None, rng='legacy'):
+    """
+    Conduct a hyperparameter study on one persistent pool (see experiment_runner.run_experiments)
+
+        * The reward array is loaded once and placed in shared memory, workers build their SolarEnv over it
+        * Only hyperparameter tuples are sent to workers, settings are passed once through the pool initializer
+        * With checkpoint_dir, each combination checkpoints to its own subdirectory, combinations that finished in a
+          previous study are skipped and interrupted ones resume
+        * With results_path, each result is appended to a csv as soon as it finishes, and combinations already in
+          the csv are skipped
+        * Each combination's agent is seeded by get_combination_seed, so results do not depend on cores or chunksize
+
+    Args:
+        env_data_path (str): path to env data
+        env_roll_frequency (int): number of steps to shift env reward array at
+        steps (int): the number of steps to run each set of hyperparameters for in an experiment
+        seed (int): the random seed number to use for agent policy
+        day_partitions (int): the number of distinct time of day points for agent to track as state
+        cores (int): number of cores to use for multiprocessing
+    Kwargs:
+        temperature_values (list): A list of values to study for temperature
+        actor_step_size_values (list): A list of values to study for actor step size
+        critic_step_size_values (list): A list of values to study for critic step size
+        avg_reward_step_size_values (list): A list of values to study for avg reward step size
+        metric (str): objective for experiments, 'total_reward' or 'rolling_reward'
+        chunksize (int): number of combinations sent to a worker at a time
+        engine (str): experiment engine passed to run_agent_experiment
+        use_cache (bool): True to load the env data through the compiled environment cache
+        hide_progress_bar (bool): Set to True to hide the tqdm bar
+        checkpoint_dir (str): directory to checkpoint experiments to, or None to not checkpoint
+        checkpoint_interval (int): frequency of steps to checkpoint each experiment at
+        results_path (str): csv to stream results to and resume from, or None to not write results
+        rng (str): 'legacy' RandomState streams shared by all combinations, or 'pcg64' independent streams
+            (see get_combination_seed)
+    Returns:
+        DataFrame: A dataframe of hyperparameters and the reward they achieved in an experiment
+    """
+    combinations = create_hyperparam_combinations(temperature_values, actor_step_size_values,
+                                                  critic_step_size_values, avg_reward_step_size_values)
+    env = create_env_from_data_path(env_data_path, env_roll_frequency, use_cache=use_cache)
+    env_settings = {'movement_penalty': env.movement_penalty, 'roll_frequency': env.roll_frequency}
+    experiment_settings = {
+        'steps': steps,
+        'seed': seed,
+        'day_partitions': day_partitions,
+        'rolling_steps_measurement': env_roll_frequency*10, # rolling power across 10 shifts
+        'metric': metric,
+        'engine': engine,
+        'checkpoint_dir': checkpoint_dir,
+        'checkpoint_interval': checkpoint_interval,
+        'rng': rng
+    }
+
+    # Skip combinations whose checkpoint a previous study finished
+    metric_values = {}
+    if checkpoint_dir is not None:
+        for combination in combinations:
+            finished_metric = get_finished_metric(checkpoint_dir, combination, steps, metric)
+            if finished_metric is not None:
+                metric_values[combination] = finished_metric
+    pending_tasks = [dict(zip(HYPERPARAMETER_NAMES, combination)) for combination in combinations
+                     if combination not in metric_values]
+
+    # Share the reward array once, then run every combination on a single pool
+    shared_block, reward_array_spec = create_shared_array(env.reward_array_original)
+    try:
+        results_df = experiment_runner.run_experiments(_run_sweep_task, pending_tasks, cores, results_path=results_path,
+                                                       key_names=list(HYPERPARAMETER_NAMES),
+                                                       initializer=_init_sweep_worker,
+                                                       initargs=(reward_array_spec, env_settings, experiment_settings),
+                                                       chunksize=chunksize, hide_progress_bar=hide_progress_bar)
+    finally:
+        shared_block.close()
+        shared_block.unlink()
+    for row in results_df.to_dict('records'):
+        metric_values[tuple([row[name] for name in HYPERPARAMETER_NAMES])] = row['metric']
+
+    # Return a DataFrame of all the results
+    results_dict_list = []
+    for combination in combinations:
+        results_dict = dict(zip(HYPERPARAMETER_NAMES, combination))
+        results_dict['metric'] = metric_values[combination]
+        results_dict_list.append(results_dict)
+    return pd.DataFrame(results_dict_list)
+
+
+# Early stopping
+# =============================================
+def check_halving_settings(min_steps, max_steps, eta):
+    """
+    Raise a ValueError unless 1 <= min_steps <= max_steps and eta > 1, without which the rung budgets never reach
+    max_steps
+    """
+    if min_steps < 1:
+        raise ValueError('min_steps must be at least 1, got ' + str(min_steps))
+    if min_steps > max_steps:
+        raise ValueError('min_steps must be at most max_steps, got ' + str(min_steps) + ' > ' + str(max_steps))
+    if eta <= 1:
+        raise ValueError('eta must be greater than 1, got ' + str(eta))
+
+
+def create_halving_budgets(min_steps, max_steps, eta=3):
+    """
+    Returns:
+        list: cumulative step budgets of the rungs, min_steps * eta**i up to and ending at max_steps
+    """
+    check_halving_settings(min_steps, max_steps, eta)
+    budgets = []
+    budget = min_steps
+    while budget < max_steps:
+        budgets.append(int(budget))
+        budget *= eta
+    return budgets + [max_steps]
+
+
+def run_halving_bracket(env:SolarEnv, combinations, min_steps, max_steps, seed, day_partitions, eta=3,
+                        rolling_steps_measurement=10, metric='rolling_reward', table_storage='lazy', bracket=0,
+                        hide_progress_bar=False, rng='legacy'):
+    """
+    Successive halving: run every combination for a short budget, continue the best 1/eta for eta times longer
+
+        * Promoted combinations continue their agent and environment through run_agent_experiment(agent=...),
+          so a combination that reaches max_steps has the same result as one full run
+        * Eliminated agents are released, and lazy tables keep the many short runs of the first rung small
+
+    Args:
+        env (SolarEnv): environment whose reward array and settings every combination uses
+        combinations (list): hyperparameter tuples ordered as HYPERPARAMETER_NAMES
+        min_steps (int): the steps every combination runs in the first rung
+        max_steps (int): the steps of the last rung
+        seed (int): the random seed number to use for agent policy
+        day_partitions (int): the number of distinct time of day points for agent to track as state
+    Kwargs:
+        eta (int): elimination rate, 1/eta of the combinations are promoted at each rung
+        rolling_steps_measurement (int): rolling avg steps of the rolling reward metric
+        metric (str): objective for ranking, 'total_reward' or 'rolling_reward' (higher is better)
+        table_storage (str): 'dense' or 'lazy' actor/critic storage for the agents
+        bracket (int): bracket number recorded in the results
+        hide_progress_bar (bool): Set to True to hide the tqdm bar
+        rng (str): 'legacy' or 'pcg64' agent streams (see get_combination_seed)
+    Returns:
+        DataFrame: hyperparameters, bracket, steps and metric of every combination at every rung it ran
+    """
+    runs = {combination: {'env': SolarEnv(env.reward_array_original, movement_penalty=env.movement_penalty,
+                                           roll_frequency=env.roll_frequency),
+                          'agent': None, 'steps': 0} for combination in combinations}
+    results_dict_list = []
+    for rung, budget in enumerate(create_halving_budgets(min_steps, max_steps, eta)):
+        rung_metrics = {}
+        for combination in tqdm(list(runs), desc='rung ' + str(rung), disable=hide_progress_bar):
+            temperature, actor_step_size, critic_step_size, avg_reward_step_size = combination
+            run = runs[combination]
+            if run['agent'] is None:
+                run['agent'] = SoftmaxAgent(actor_step_size=actor_step_size, critic_step_size=critic_step_size,
+                                            avg_reward_step_size=avg_reward_step_size, temperature_value=temperature,
+                                            env_shape=run['env'].get_env_shape(),
+                                            reward_rolling_avg_window=rolling_steps_measurement,
+                                            day_partitions=day_partitions,
+                                            random_seed=get_combination_seed(seed, combination, rng=rng),
+                                            table_storage=table_storage, rng=rng)
+                run['agent'].agent_start()
+            rung_metrics[combination] = ef.run_agent_experiment(run['env'], budget - run['steps'], seed, day_partitions,
+                                                                actor_step_size, critic_step_size,
+                                                                avg_reward_step_size, temperature,
+                                                                logging_interval=None, hide_progress_bar=True,
+                                                                metric=metric, agent=run['agent'])
+            run['steps'] = budget
+            results_dict = dict(zip(HYPERPARAMETER_NAMES, combination))
+            results_dict.update({'bracket': bracket, 'rung': rung, 'steps': budget,
+                                 'metric': rung_metrics[combination]})
+            results_dict_list.append(results_dict)
+
+        # Promote the best combinations, release the rest
+        promoted_count = max(1, len(runs) // eta)
+        promoted = sorted(rung_metrics, key=lambda combination: rung_metrics[combination], reverse=True)[:promoted_count]
+        runs = {combination: runs[combination] for combination in promoted}
+    return pd.DataFrame(results_dict_list)
+
+
+def run_successive_halving(env_data_path, env_roll_frequency, min_steps, max_steps, seed, day_partitions,
+                           temperature_values=DEFAULT_SWEEP_VALUES, actor_step_size_values=DEFAULT_SWEEP_VALUES,
+                           critic_step_size_values=DEFAULT_SWEEP_VALUES,
+                           avg_reward_step_size_values=DEFAULT_SWEEP_VALUES, eta=3, metric='rolling_reward',
+                           use_cache=False, hide_progress_bar=False, rng='legacy'):
+    """
+    Search the grid of run_hyperparam_study with successive halving instead of running every combination to max_steps
+
+    Args:
+        env_data_path (str): path to env data
+        env_roll_frequency (int): number of steps to shift env reward array at
+        min_steps (int): the steps every combination runs before the first elimination
+        max_steps (int): the steps the best combinations run in total
+        seed (int): the random seed number to use for agent policy
+        day_partitions (int): the number of distinct time of day points for agent to track as state
+    Kwargs:
+        temperature_values (list): A list of values to study for temperature
+        actor_step_size_values (list): A list of values to study for actor step size
+        critic_step_size_values (list): A list of values to study for critic step size
+        avg_reward_step_size_values (list): A list of values to study for avg reward step size
+        eta (int): elimination rate, 1/eta of the combinations are promoted at each rung
+        metric (str): objective for experiments, 'total_reward' or 'rolling_reward'
+        use_cache (bool): True to load the env data through the compiled environment cache
+        hide_progress_bar (bool): Set to True to hide the tqdm bar
+        rng (str): 'legacy' or 'pcg64' agent streams (see get_combination_seed)
+    Returns:
+        DataFrame: hyperparameters, bracket, rung, steps and metric of every rung run (see run_halving_bracket)
+    """
+    check_halving_settings(min_steps, max_steps, eta)
+    combinations = create_hyperparam_combinations(temperature_values, actor_step_size_values,
+                                                  critic_step_size_values, avg_reward_step_size_values)
+    env = create_env_from_data_path(env_data_path, env_roll_frequency, use_cache=use_cache)
+    return run_halving_bracket(env, combinations, min_steps, max_steps, seed, day_partitions, eta=eta,
+                               rolling_steps_measurement=env_roll_frequency*10, metric=metric,
+                               hide_progress_bar=hide_progress_bar, rng=rng)
+
+
+def run_hyperband(env_data_path, env_roll_frequency, min_steps, max_steps, seed, day_partitions,
+                  temperature_values=DEFAULT_SWEEP_VALUES, actor_step_size_values=DEFAULT_SWEEP_VALUES,
+                  critic_step_size_values=DEFAULT_SWEEP_VALUES, avg_reward_step_size_values=DEFAULT_SWEEP_VALUES,
+                  eta=3, metric='rolling_reward', use_cache=False, hide_progress_bar=False, rng='legacy'):
+    """
+    Hyperband: successive halving brackets from aggressive (many combinations, min_steps) to none (few, max_steps)
+
+        * Bracket s samples ceil((s_max + 1) / (s + 1) * eta**s) combinations of the grid (seeded by seed) and
+          starts them at max_steps / eta**s
+
+    Args and Kwargs:
+        see run_successive_halving
+    Returns:
+        DataFrame: hyperparameters, bracket, rung, steps and metric of every rung run (see run_halving_bracket)
+    """
+    check_halving_settings(min_steps, max_steps, eta)
+    combinations = create_hyperparam_combinations(temperature_values, actor_step_size_values,
+                                                  critic_step_size_values, avg_reward_step_size_values)
+    env = create_env_from_data_path(env_data_path, env_roll_frequency, use_cache=use_cache)
+    sample_generator = np.random.RandomState(seed)
+    max_bracket = int(math.floor(math.log(max_steps / min_steps, eta) + 1e-9))
+    bracket_df_list = []
+    for bracket in range(max_bracket, -1, -1):
+        bracket_size = min(len(combinations), int(math.ceil((max_bracket + 1) / (bracket + 1) * eta**bracket)))
+        sampled = [combinations[i] for i in sample_generator.choice(len(combinations), bracket_size, replace=False)]
+        bracket_df_list.append(run_halving_bracket(env, sampled, max(1, int(max_steps / eta**bracket)), max_steps,
+                                                   seed, day_partitions, eta=eta,
+                                                   rolling_steps_measurement=env_roll_frequency*10, metric=metric,
+                                                   bracket=bracket, hide_progress_bar=hide_progress_bar, rng=rng))
+    return pd.concat(bracket_df_list, ignore_index=True)
+
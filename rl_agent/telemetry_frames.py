@@ -0,0 +1,207 @@
+import struct
+from itertools import accumulate
+from collections import namedtuple
+
+import numpy as np
+
+# First bytes of every state frame (0xA5 0x5A), never part of an ASCII message
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_SYNC_WORD = 0x5AA5
+
+# Sequence id of a frame answering a lock-step message
+NO_SEQUENCE_ID = 0xFFFF
+
+# Layout of a state frame, little-endian and unpadded like the firmware's StateFrame struct
+FRAME_STRUCT = struct.Struct('<HHHIBBfffH')
+FRAME_DTYPE = np.dtype([('sync', '<u2'), ('sequence_id', '<u2'), ('state', '<u2'), ('duration_ms', '<u4'),
+                        ('motor_1_position', 'u1'), ('motor_2_position', 'u1'), ('I_ivp_1', '<f4'),
+                        ('V_ivp_1', '<f4'), ('P_ivp_1', '<f4'), ('checksum', '<u2')])
+FRAME_SIZE = FRAME_STRUCT.size
+
+# A single frame unpacked with FRAME_STRUCT, with the fields of FRAME_DTYPE
+StateFrame = namedtuple('StateFrame', FRAME_DTYPE.names)
+
+# The checksum covers the bytes between the sync word and the checksum
+CHECKSUM_START = 2
+CHECKSUM_END = FRAME_SIZE - 2
+CHECKSUM_WEIGHTS = np.arange(CHECKSUM_END - CHECKSUM_START, 0, -1, dtype=np.uint32)
+
+
+# Checksums
+# =============================================
+def fletcher16(data):
+    """
+    Fletcher-16 of the bytes, equal to the firmware's running sums modulo 255 taken once at the end (sum_2 is the
+    sum of the running sums sum_1), so both sums run in C
+
+    Returns:
+        int: the checksum
+    """
+    return (sum(accumulate(data)) % 255 << 8) | sum(data) % 255
+
+
+def compute_frame_checksums(frame_bytes):
+    """
+    Fletcher-16 of every frame at once, using sum_2 = sum of (n - i) * byte_i
+
+    Args:
+        frame_bytes (numpy array): uint8 array of shape (frames, FRAME_SIZE)
+    Returns:
+        numpy array: the uint16 checksum of each frame
+    """
+    payload = frame_bytes[:, CHECKSUM_START:CHECKSUM_END].astype(np.uint32)
+    sum_1 = payload.sum(axis=1) % 255
+    sum_2 = (payload * CHECKSUM_WEIGHTS).sum(axis=1) % 255
+    return ((sum_2 << 8) | sum_1).astype(np.uint16)
+
+
+def get_valid_frame_mask(frame_bytes):
+    """
+    Args:
+        frame_bytes (numpy array): uint8 array of shape (frames, FRAME_SIZE)
+    Returns:
+        numpy array: True for each frame with the sync word and a matching checksum
+    """
+    records = frame_bytes.view(FRAME_DTYPE)[:, 0]
+    return (records['sync'] == FRAME_SYNC_WORD) & (records['checksum'] == compute_frame_checksums(frame_bytes))
+
+
+# Frames
+# =============================================
+def pack_state_frame(state, duration_s, motor_1_position, motor_2_position, current, voltage, power,
+                     sequence_id=NO_SEQUENCE_ID):
+    """
+    Returns:
+        bytes: the state frame broadcast_state sends in binary mode
+    """
+    frame = bytearray(FRAME_STRUCT.pack(FRAME_SYNC_WORD, sequence_id, state, int(round(duration_s * 1000)),
+                                        motor_1_position, motor_2_position, current, voltage, power, 0))
+    struct.pack_into('<H', frame, CHECKSUM_END, fletcher16(frame[CHECKSUM_START:CHECKSUM_END]))
+    return bytes(frame)
+
+
+def unpack_state_frame(buffer, offset=0):
+    """
+    Unpack one state frame with FRAME_STRUCT, for reading frames one at a time
+
+        * Cheaper than parse_frames for a single frame, which pays for numpy array setup on every call
+
+    Args:
+        buffer (bytes): received bytes holding a frame at offset
+    Kwargs:
+        offset (int): position of the frame in the buffer
+    Returns:
+        StateFrame: the frame, or None if the bytes are not a frame with a matching checksum
+    """
+    frame = StateFrame._make(FRAME_STRUCT.unpack_from(buffer, offset))
+    if frame.sync != FRAME_SYNC_WORD or \
+            frame.checksum != fletcher16(memoryview(buffer)[offset + CHECKSUM_START:offset + CHECKSUM_END]):
+        return None
+    return frame
+
+
+def parse_frames(buffer):
+    """
+    Parse the state frames in received bytes
+
+        * When the buffer starts with whole valid frames (the usual case) they are returned as a view of the buffer
+          (np.frombuffer), without copying or decoding
+        * Otherwise the buffer is scanned for FRAME_SYNC, and bytes outside frames with a valid checksum (ASCII
+          responses, line noise) are skipped
+        * A partial frame at the end is not consumed, so it can be parsed with the bytes that follow
+
+    Args:
+        buffer (bytes): received bytes
+    Returns:
+        numpy array, int, int: the frames (FRAME_DTYPE records), the bytes consumed, the bytes skipped
+    """
+    num_frames = len(buffer) // FRAME_SIZE
+    frame_bytes = np.frombuffer(buffer, dtype=np.uint8, count=num_frames * FRAME_SIZE).reshape(num_frames, FRAME_SIZE)
+    if get_valid_frame_mask(frame_bytes).all():
+        return frame_bytes.view(FRAME_DTYPE)[:, 0], num_frames * FRAME_SIZE, 0
+
+    # Resynchronize on every sync word that starts a complete, valid frame
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    sync_offsets = np.flatnonzero((data[:-1] == FRAME_SYNC[0]) & (data[1:] == FRAME_SYNC[1]))
+    complete_offsets = sync_offsets[sync_offsets + FRAME_SIZE <= len(data)]
+    candidate_bytes = np.lib.stride_tricks.sliding_window_view(data, FRAME_SIZE)[complete_offsets] \
+        if len(complete_offsets) else np.empty((0, FRAME_SIZE), dtype=np.uint8)
+    frame_offsets = []
+    frame_end = 0
+    for offset in complete_offsets[get_valid_frame_mask(candidate_bytes)]:
+        if offset >= frame_end:
+            frame_offsets.append(offset)
+            frame_end = offset + FRAME_SIZE
+
+    # Keep a trailing partial frame (or a trailing first sync byte) for the next bytes
+    partial_offsets = sync_offsets[(sync_offsets >= frame_end) & (sync_offsets + FRAME_SIZE > len(data))]
+    if len(partial_offsets):
+        consumed = int(partial_offsets[0])
+    elif len(data) and data[-1] == FRAME_SYNC[0]:
+        consumed = max(frame_end, len(data) - 1)
+    else:
+        consumed = len(data)
+    frame_bytes = np.lib.stride_tricks.sliding_window_view(data, FRAME_SIZE)[frame_offsets] \
+        if frame_offsets else np.empty((0, FRAME_SIZE), dtype=np.uint8)
+    return frame_bytes.view(FRAME_DTYPE)[:, 0], consumed, consumed - len(frame_offsets) * FRAME_SIZE
+
+
+class FrameParser:
+    def __init__(self):
+        """
+        Incremental parse_frames over a stream of received bytes, carrying partial frames between reads
+        """
+        self.pending = b''
+        self.frames_parsed = 0
+        self.skipped_bytes = 0
+
+    def feed(self, data):
+        """
+        Args:
+            data (bytes): the next received bytes
+        Returns:
+            numpy array: the frames completed by the bytes (FRAME_DTYPE records)
+        """
+        buffer = self.pending + data if self.pending else bytes(data)
+        frames, consumed, skipped = parse_frames(buffer)
+        self.pending = buffer[consumed:]
+        self.frames_parsed += len(frames)
+        self.skipped_bytes += skipped
+        return frames
+
+    def feed_frame(self, data):
+        """
+        Like feed for reads of at most one frame (FRAME_SIZE minus the pending bytes), unpacking a whole valid
+        frame directly (see unpack_state_frame) and resynchronizing through feed otherwise
+
+        Args:
+            data (bytes): the next received bytes
+        Returns:
+            StateFrame: the frame completed by the bytes, or None
+        """
+        if not self.pending and len(data) == FRAME_SIZE:
+            frame = unpack_state_frame(data)
+            if frame is not None:
+                self.frames_parsed += 1
+                return frame
+        frames = self.feed(data)
+        if len(frames) == 0:
+            return None
+        return StateFrame._make(frames[0].tolist())
+
+
+def map_frame_to_dict(timestamp, frame):
+    """
+    Returns:
+        dict: a StateFrame with the keys of arduino_interface.map_message_to_dict, as numbers instead of strings
+    """
+    return {
+        'timestamp': timestamp,
+        'state': frame.state,
+        'arduino_duration': frame.duration_ms / 1000,
+        'motor_1_position': frame.motor_1_position,
+        'motor_2_position': frame.motor_2_position,
+        'I_ivp_1': frame.I_ivp_1,
+        'V_ivp_1': frame.V_ivp_1,
+        'P_ivp_1': frame.P_ivp_1
+    }
@@ -0,0 +1,341 @@
+import os
+import time
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pyarrow = None
+    PYARROW_AVAILABLE = False
+
+# Module imports
+from arduino_interface import STATE_REQUEST, SEQUENCED_MESSAGE, END_CHAR, DELIMITER, write_serial_line
+from telemetry_frames import FrameParser
+from common_functions import repair_result_file
+
+# A recorded response, with the columns of arduino_interface.map_message_to_dict
+RECORD_DTYPE = np.dtype([('timestamp', '<f8'), ('state', '<i4'), ('arduino_duration', '<f8'),
+                         ('motor_1_position', '<i4'), ('motor_2_position', '<i4'), ('I_ivp_1', '<f4'),
+                         ('V_ivp_1', '<f4'), ('P_ivp_1', '<f4')])
+
+# Fields of an ASCII state response
+STATE_FIELD_COUNT = 7
+
+
+def get_part_path(directory, part_index):
+    return os.path.join(directory, 'part_' + str(part_index).zfill(6) + '.parquet')
+
+
+# Parsing
+# =============================================
+def convert_frames_to_records(frames, timestamp):
+    """
+    Args:
+        frames (numpy array): telemetry_frames.FRAME_DTYPE records
+        timestamp (float): time the frames were read
+    Returns:
+        numpy array: the frames as RECORD_DTYPE records
+    """
+    records = np.empty(len(frames), dtype=RECORD_DTYPE)
+    records['timestamp'] = timestamp
+    records['arduino_duration'] = frames['duration_ms'] / 1000
+    for field in ['state', 'motor_1_position', 'motor_2_position', 'I_ivp_1', 'V_ivp_1', 'P_ivp_1']:
+        records[field] = frames[field]
+    return records
+
+
+def convert_lines_to_records(lines, timestamp):
+    """
+    Args:
+        lines (list): received ASCII lines (bytes), sequenced responses keep their prefix
+        timestamp (float): time the lines were read
+    Returns:
+        numpy array: the state responses among the lines as RECORD_DTYPE records (other responses are skipped)
+    """
+    rows = []
+    for line in lines:
+        if END_CHAR.encode() not in line:
+            continue
+        fields = line.decode(errors='replace').strip().replace(END_CHAR, '').split(DELIMITER)
+        if fields[0] == str(SEQUENCED_MESSAGE):
+            fields = fields[2:]
+        if len(fields) < STATE_FIELD_COUNT:
+            continue
+        try:
+            rows.append((timestamp, int(fields[0]), float(fields[1]), int(fields[2]), int(fields[3]),
+                         float(fields[4]), float(fields[5]), float(fields[6])))
+        except ValueError:
+            continue
+    return np.array(rows, dtype=RECORD_DTYPE)
+
+
+# Storage
+# =============================================
+class RecordRingBuffer:
+    def __init__(self, capacity, dtype=RECORD_DTYPE):
+        """
+        Preallocated structured ring buffer, overwriting the oldest records once full
+
+            * Records are addressed by their absolute index (0 for the first record ever appended), so readers can
+              ask for everything after the last record they saw
+
+        Args:
+            capacity (int): number of records held
+        Kwargs:
+            dtype (numpy dtype): dtype of a record
+        """
+        self.capacity = capacity
+        self.records = np.zeros(capacity, dtype=dtype)
+        self.total_records = 0
+        self.lock = threading.Lock()
+
+    def append(self, records):
+        with self.lock:
+            if len(records) > self.capacity:
+                self.total_records += len(records) - self.capacity
+                records = records[-self.capacity:]
+            start = self.total_records % self.capacity
+            first_count = min(len(records), self.capacity - start)
+            self.records[start:start + first_count] = records[:first_count]
+            self.records[:len(records) - first_count] = records[first_count:]
+            self.total_records += len(records)
+
+    def get_since(self, start_index):
+        """
+        Args:
+            start_index (int): absolute index of the first record wanted
+        Returns:
+            numpy array, int, int: a copy of the records from start_index that are still held, the absolute index
+                after the last of them, the number of wanted records already overwritten
+        """
+        with self.lock:
+            end_index = self.total_records
+            first_index = max(start_index, end_index - self.capacity)
+            records = self.records[np.arange(first_index, end_index) % self.capacity]
+        return records, end_index, first_index - start_index
+
+    def get_latest(self, count):
+        """
+        Returns:
+            numpy array: a copy of the last count records (fewer if fewer are held), oldest first
+        """
+        with self.lock:
+            end_index = self.total_records
+            first_index = max(0, end_index - min(count, self.capacity))
+            return self.records[np.arange(first_index, end_index) % self.capacity]
+
+
+def write_csv_records(output_path, records):
+    """
+    Append records to a csv, with a header row if the file is new, and fsync it
+    """
+    write_header = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+    if not write_header:
+        repair_result_file(output_path)
+    with open(output_path, 'a', newline='') as output_file:
+        pd.DataFrame(records).to_csv(output_file, header=write_header, index=False)
+        output_file.flush()
+        os.fsync(output_file.fileno())
+
+
+def load_records(output_path, output_format='csv'):
+    """
+    Args:
+        output_path (str): a csv, or a directory of parquet parts, written by TelemetryRecorder
+    Kwargs:
+        output_format (str): 'csv' or 'parquet'
+    Returns:
+        DataFrame: the recorded responses
+    """
+    if output_format == 'parquet':
+        return pd.read_parquet(output_path)
+    repair_result_file(output_path)
+    return pd.read_csv(output_path)
+
+
+# Recorder
+# =============================================
+class TelemetryRecorder:
+    def __init__(self, serial_device, output_path, binary_frames=False, capacity=65536, flush_interval=1.0,
+                 live_size=100, output_format='csv', read_timeout=0.05, request_interval=None):
+        """
+        Reads Arduino responses on a background thread into a RecordRingBuffer and flushes them to disk in batches
+
+            * Memory is fixed by capacity however long the recording runs; records not flushed before they are
+              overwritten are counted in dropped_records
+            * A flush every flush_interval seconds appends the new records to a csv (with the columns of
+              arduino_interface.map_message_to_dict) or writes them as the next part of a parquet directory, so a
+              crash loses at most one interval
+            * get_live_view returns the latest records for monitoring while recording
+            * Records read together share the timestamp of the read
+            * Works with any object with the serial.Serial read/write API, e.g. simulated_arduino.SimulatedSerial
+
+        Args:
+            serial_device (serial.Serial): the Serial device
+            output_path (str): csv to append to, or directory for parquet parts (created if needed)
+        Kwargs:
+            binary_frames (bool): True if the Arduino sends binary frames (arduino_interface.set_binary_mode)
+            capacity (int): records held in the ring buffer
+            flush_interval (float): seconds between flushes
+            live_size (int): default number of records in the live view
+            output_format (str): 'csv' or 'parquet' (requires pyarrow)
+            read_timeout (float): seconds a read waits for data, set on the device while recording
+            request_interval (float): seconds between STATE_REQUESTs sent by the recorder, or None to only
+                record the responses to requests sent elsewhere
+        """
+        if output_format == 'parquet' and not PYARROW_AVAILABLE:
+            raise ImportError('pyarrow is required for output_format="parquet"')
+        if output_format not in ('csv', 'parquet'):
+            raise ValueError('output_format must be "csv" or "parquet", got ' + str(output_format))
+        self.serial_device = serial_device
+        self.output_path = output_path
+        self.output_format = output_format
+        self.binary_frames = binary_frames
+        self.flush_interval = flush_interval
+        self.live_size = live_size
+        self.read_timeout = read_timeout
+        self.request_interval = request_interval
+        self.ring_buffer = RecordRingBuffer(capacity)
+        self.frame_parser = FrameParser()
+        self.pending_line = b''
+        self.bytes_received = 0
+        self.flushed_records = 0
+        self.dropped_records = 0
+        self.part_count = 0
+        if self.output_format == 'parquet':
+            os.makedirs(self.output_path, exist_ok=True)
+            self.part_count = len([name for name in os.listdir(self.output_path) if name.endswith('.parquet')])
+        self.data_condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.record_thread = None
+        self.record_error = None
+        self.device_timeout = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        if self.record_thread is not None:
+            return
+        self.device_timeout = self.serial_device.timeout
+        self.serial_device.timeout = self.read_timeout
+        self.stop_event.clear()
+        self.record_thread = threading.Thread(target=self.record_loop, daemon=True)
+        self.record_thread.start()
+
+    def stop(self):
+        """
+        Stop reading, flush the remaining records and restore the device's read timeout
+        """
+        if self.record_thread is None:
+            return
+        self.stop_event.set()
+        self.record_thread.join()
+        self.record_thread = None
+        self.serial_device.timeout = self.device_timeout
+        self.flush()
+        if self.record_error is not None:
+            raise self.record_error
+
+    # Reading
+    # =============================================
+    def parse(self, data, timestamp):
+        """
+        Returns:
+            numpy array: the RECORD_DTYPE records completed by received bytes
+        """
+        if self.binary_frames:
+            return convert_frames_to_records(self.frame_parser.feed(data), timestamp)
+        lines = (self.pending_line + data).split(b'\n')
+        self.pending_line = lines.pop()
+        return convert_lines_to_records(lines, timestamp)
+
+    def record_loop(self):
+        last_flush = time.time()
+        last_request = None
+        try:
+            while not self.stop_event.is_set():
+                if self.request_interval is not None and (last_request is None or
+                                                          time.time() - last_request >= self.request_interval):
+                    write_serial_line(self.serial_device, [STATE_REQUEST], print_message=False, reset_output=False)
+                    last_request = time.time()
+                data = self.serial_device.read(max(self.serial_device.in_waiting, 1))
+                if data:
+                    records = self.parse(data, time.time())
+                    self.ring_buffer.append(records)
+                    with self.data_condition:
+                        self.bytes_received += len(data)
+                        self.data_condition.notify_all()
+                if time.time() - last_flush >= self.flush_interval:
+                    self.flush()
+                    last_flush = time.time()
+        except Exception as error:
+            self.record_error = error
+
+    def wait_for_records(self, record_count, timeout):
+        """
+        Returns:
+            bool: True once record_count records have been recorded in total, False after timeout seconds
+        """
+        with self.data_condition:
+            return self.data_condition.wait_for(lambda: self.ring_buffer.total_records >= record_count, timeout)
+
+    def wait_for_bytes(self, byte_count, timeout):
+        """
+        Returns:
+            bool: True once byte_count bytes have been received in total, False after timeout seconds
+        """
+        with self.data_condition:
+            return self.data_condition.wait_for(lambda: self.bytes_received >= byte_count, timeout)
+
+    # Output
+    # =============================================
+    def flush(self):
+        """
+        Write the records received since the last flush
+        """
+        with self.flush_lock:
+            records, end_index, dropped_count = self.ring_buffer.get_since(self.flushed_records)
+            self.dropped_records += dropped_count
+            if len(records) > 0:
+                if self.output_format == 'parquet':
+                    pd.DataFrame(records).to_parquet(get_part_path(self.output_path, self.part_count), index=False)
+                    self.part_count += 1
+                else:
+                    write_csv_records(self.output_path, records)
+            self.flushed_records = end_index
+
+    def load_records(self):
+        """
+        Returns:
+            DataFrame: every record flushed to the output so far
+        """
+        return load_records(self.output_path, self.output_format)
+
+    def get_live_view(self, count=None):
+        """
+        Kwargs:
+            count (int): number of latest records, or None for live_size
+        Returns:
+            DataFrame: the latest records, oldest first
+        """
+        return pd.DataFrame(self.ring_buffer.get_latest(self.live_size if count is None else count))
+
+    # Access Functions
+    def get_record_count(self):
+        return self.ring_buffer.total_records
+
+    def get_bytes_received(self):
+        return self.bytes_received
+
+    def get_dropped_records(self):
+        return self.dropped_records
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The rl_agent modules import each other as top-level modules
+RL_AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RL_AGENT_DIR not in sys.path:
+    sys.path.insert(0, RL_AGENT_DIR)
+
+DATA_DIR = os.path.join(RL_AGENT_DIR, 'simulation_data', 'data', 'initial_environments')
+INDOOR_DATA_PATH = os.path.join(DATA_DIR, 'indoor_light_scan.csv')
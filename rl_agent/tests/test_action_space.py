@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from rl_agent import SoftmaxAgent, create_neighborhood_targets
+
+ENV_SHAPE = (5, 5)
+
+
+def create_agent(**settings):
+    agent = SoftmaxAgent(actor_step_size=0.1, critic_step_size=0.5, avg_reward_step_size=0.01, temperature_value=1,
+                         env_shape=ENV_SHAPE, reward_rolling_avg_window=10, day_partitions=1, action_space='local',
+                         neighborhood_radius=1, **settings)
+    agent.agent_start()
+    return agent
+
+
+def test_neighborhood_targets_are_distinct_valid_moves():
+    targets, valid_mask = create_neighborhood_targets(ENV_SHAPE, 1)
+    assert valid_mask.sum(axis=1).tolist()[:6] == [4, 6, 6, 6, 4, 6]
+    assert valid_mask[12].all()
+    for state in range(ENV_SHAPE[0] * ENV_SHAPE[1]):
+        valid_targets = targets[state][valid_mask[state]]
+        assert len(np.unique(valid_targets)) == len(valid_targets)
+        assert (targets[state][~valid_mask[state]] == state).all()
+
+
+@pytest.mark.parametrize('table_dtype', [np.float64, np.float32])
+def test_policy_never_moves_off_the_grid(table_dtype):
+    agent = create_agent(table_dtype=table_dtype)
+    _, valid_mask = create_neighborhood_targets(ENV_SHAPE, 1)
+    corner_probs = agent.compute_softmax_prob((0, 0))
+    assert (corner_probs[~valid_mask[0]] == 0).all()
+    np.testing.assert_allclose(corner_probs[valid_mask[0]], 0.25)
+    draws = [agent.sample_action((0, 0))[0] for i in range(200)]
+    assert valid_mask[0][draws].all()
+
+
+@pytest.mark.parametrize('critic_means', ['reduce', 'running'])
+def test_state_values_leave_out_invalid_moves(critic_means):
+    agent = create_agent(critic_means=critic_means, critic_init_value=2.0)
+    assert agent.get_state_value((0, 0)) == pytest.approx(2.0)
+    # Take the move staying in the corner, which leaves the invalid moves' actor and critic entries unchanged
+    agent.last_state = (0, 0)
+    agent.last_action = 4
+    agent.agent_policy()
+    agent.last_action = 4
+    agent.agent_step(1.0, (0, 0))
+    assert agent.get_state_value((0, 0)) == pytest.approx(2.0 + 0.5 * 1.0 / 4)
+    _, valid_mask = create_neighborhood_targets(ENV_SHAPE, 1)
+    assert (agent.actor_array[0, 0][~valid_mask[0]] == 0).all()
+    assert (agent.critic_array[0, 0][~valid_mask[0]] == 2.0).all()
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+
+import arduino_interface
+from simulated_arduino import SimulatedArduino, SimulatedSerial
+from telemetry_frames import (FRAME_SIZE, FrameParser, StateFrame, fletcher16, map_frame_to_dict, pack_state_frame,
+                              parse_frames, unpack_state_frame)
+
+
+class TruncatedFrameArduino(SimulatedArduino):
+    def __init__(self, truncated_responses=1):
+        super().__init__()
+        self.truncated_responses = truncated_responses
+
+    def format_state(self, state_fields):
+        # A frame cut short on the link, so the host's frame read times out
+        response = super().format_state(state_fields)
+        if self.binary_frames and self.truncated_responses > 0:
+            self.truncated_responses -= 1
+            return response[:FRAME_SIZE // 2]
+        return response
+
+
+def test_fletcher16_matches_running_sums():
+    generator = np.random.RandomState(1)
+    for size in range(0, 64):
+        data = generator.randint(0, 256, size).astype(np.uint8).tobytes()
+        sum_1 = 0
+        sum_2 = 0
+        for byte in data:
+            sum_1 = (sum_1 + byte) % 255
+            sum_2 = (sum_2 + sum_1) % 255
+        assert fletcher16(data) == (sum_2 << 8) | sum_1
+
+
+def test_unpack_state_frame_matches_parse_frames():
+    frame_bytes = pack_state_frame(1111, 0.25, 85, 95, 0.5, 4.0, 2.0, sequence_id=7)
+    frame = unpack_state_frame(frame_bytes)
+    assert frame == StateFrame._make(parse_frames(frame_bytes)[0][0].tolist())
+    assert map_frame_to_dict(0.0, frame)['arduino_duration'] == 0.25
+    corrupted = bytearray(frame_bytes)
+    corrupted[6] ^= 1
+    assert unpack_state_frame(bytes(corrupted)) is None
+
+
+def test_feed_frame_resynchronizes_after_noise():
+    frames = [pack_state_frame(1111, 0.1 * i, 90, 90 + i, 0.5, 4.0, 2.0) for i in range(3)]
+    stream = b'1111>\r\n' + frames[0] + os.urandom(5).replace(b'\xa5', b'\x00') + frames[1] + frames[2]
+    frame_parser = FrameParser()
+    received = []
+    position = 0
+    while position < len(stream):
+        size = FRAME_SIZE - len(frame_parser.pending)
+        frame = frame_parser.feed_frame(stream[position:position + size])
+        position += size
+        if frame is not None:
+            received.append(frame)
+    assert [frame.motor_2_position for frame in received] == [90, 91, 92]
+
+
+def test_loop_resets_after_a_frame_timeout():
+    device = TruncatedFrameArduino()
+    serial_device = SimulatedSerial(device, timeout=0.05)
+    data_df = arduino_interface.loop(serial_device, runtime=1.6, random_seed=1, binary_frames=True)
+    # The truncated frame leaves no row, and the reset's acknowledgement and the later frames follow
+    assert device.truncated_responses == 0
+    assert not data_df.isna().any().any()
+    assert str(data_df['state'].iloc[0]) == str(arduino_interface.RESET_STATE)
+    assert len(data_df) == 3
@@ -0,0 +1,138 @@
+import time
+import asyncio
+
+import pytest
+
+from async_arduino_interface import AsyncArduinoDriver, ArduinoUnresponsiveError
+from simulated_arduino import SimulatedArduino
+from arduino_interface import LOCKSTEP_PROTOCOL_VERSION, SEQUENCED_PROTOCOL_VERSION, NOMINAL, RESET_STATE
+
+
+def get_motor_positions(response):
+    return int(response[2]), int(response[3])
+
+
+async def run_with_driver(device, steps, **driver_kwargs):
+    reader, writer = await device.open_connection()
+    async with AsyncArduinoDriver(reader, writer, **driver_kwargs) as driver:
+        return await steps(driver)
+
+
+def test_dropped_request_resets_and_retries():
+    device = SimulatedArduino()
+    device.unresponsive_requests = 1
+
+    async def steps(driver):
+        response = await driver.move_motors(30, 30)
+        return response, await driver.move_motors(45, 50), driver
+
+    response, next_response, driver = asyncio.run(run_with_driver(device, steps, response_timeout=0.05,
+                                                                  stale_response_timeout=0.05))
+    assert get_motor_positions(response) == (30, 30)
+    assert get_motor_positions(next_response) == (45, 50)
+    assert driver.reset_count == 1
+    # Dropped move, reset, retried move, next move
+    assert device.requests_handled == 4
+
+
+def test_late_response_does_not_answer_next_request():
+    # Moving from 90 to 0 takes about 0.2 s at this time scale, longer than the response timeout
+    device = SimulatedArduino(time_scale=0.1)
+
+    async def steps(driver):
+        with pytest.raises(ArduinoUnresponsiveError):
+            await driver.move_motors(0, 0, timeout=0.1)
+        return await driver.move_motors(45, 50), driver
+
+    response, driver = asyncio.run(run_with_driver(device, steps, max_resets=0))
+    assert get_motor_positions(response) == (45, 50)
+    assert driver.stale_responses == 1
+
+
+def test_reset_skips_late_response():
+    device = SimulatedArduino(time_scale=0.1)
+
+    async def steps(driver):
+        with pytest.raises(ArduinoUnresponsiveError):
+            await driver.move_motors(0, 0, timeout=0.1)
+        # The stale wait ends before the late response, which then arrives ahead of the reset's
+        reset_response = await driver.reset()
+        return reset_response, await driver.move_motors(45, 50), driver
+
+    reset_response, response, driver = asyncio.run(run_with_driver(device, steps, max_resets=0,
+                                                                   stale_response_timeout=0.01))
+    assert reset_response[0] == str(RESET_STATE) and get_motor_positions(reset_response) == (90, 90)
+    assert get_motor_positions(response) == (45, 50)
+    assert driver.stale_responses == 1
+
+
+def test_reset_skips_late_response_at_home_position():
+    device = SimulatedArduino(time_scale=0.1)
+
+    async def steps(driver):
+        await driver.move_motors(0, 0)
+        # The late response is a state at the positions a reset moves to
+        with pytest.raises(ArduinoUnresponsiveError):
+            await driver.move_motors(90, 90, timeout=0.1)
+        reset_response = await driver.reset()
+        return reset_response, await driver.move_motors(45, 50), driver
+
+    reset_response, response, driver = asyncio.run(run_with_driver(device, steps, max_resets=0,
+                                                                   stale_response_timeout=0.01))
+    assert reset_response[0] == str(RESET_STATE)
+    assert get_motor_positions(response) == (45, 50)
+    assert driver.stale_responses == 1
+
+
+def test_lockstep_negotiation_leaves_no_stale_wait():
+    device = SimulatedArduino(protocol_version=LOCKSTEP_PROTOCOL_VERSION)
+
+    async def steps(driver):
+        await driver.negotiate_protocol()
+        move_start = time.perf_counter()
+        response = await driver.move_motors(45, 50)
+        move_time = time.perf_counter() - move_start
+        return response, move_time, await driver.reset(), driver
+
+    response, move_time, reset_response, driver = asyncio.run(run_with_driver(
+        device, steps, negotiation_timeout=0.05, stale_response_timeout=1))
+    assert driver.protocol_version == LOCKSTEP_PROTOCOL_VERSION
+    assert get_motor_positions(response) == (45, 50)
+    assert move_time < 0.5
+    # Firmware without the extended protocol answers a reset with an ordinary state
+    assert not driver.reset_state_reported
+    assert reset_response[0] == str(NOMINAL)
+    assert driver.reset_count == 2 and driver.stale_responses == 0
+
+
+def test_unanswered_reset_raises_and_recovers():
+    device = SimulatedArduino()
+    device.unresponsive_requests = 2
+
+    async def steps(driver):
+        with pytest.raises(ArduinoUnresponsiveError):
+            await driver.request_state()
+        device.unresponsive_requests = 0
+        return await driver.request_state(), driver
+
+    response, driver = asyncio.run(run_with_driver(device, steps, response_timeout=0.05, reset_timeout=0.05,
+                                                   stale_response_timeout=0.05))
+    assert response is not None
+    assert driver.reset_count == 1
+    # Dropped request, dropped reset, answered request
+    assert device.requests_handled == 3
+
+
+@pytest.mark.parametrize('protocol_version', [LOCKSTEP_PROTOCOL_VERSION, SEQUENCED_PROTOCOL_VERSION])
+def test_negotiated_requests_match_responses(protocol_version):
+    device = SimulatedArduino(link_latency=0.01, protocol_version=protocol_version)
+    positions = [(5 * i, 180 - 5 * i) for i in range(8)]
+
+    async def steps(driver):
+        await driver.negotiate_protocol()
+        responses = await driver.request_many([[1000, *position] for position in positions])
+        return responses, driver
+
+    responses, driver = asyncio.run(run_with_driver(device, steps, negotiation_timeout=0.1))
+    assert driver.protocol_version == protocol_version
+    assert [get_motor_positions(response) for response in responses] == positions
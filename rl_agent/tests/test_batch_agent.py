@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+import experiment_functions as ef
+import rl_agent
+import solar_env
+from rl_agent import BatchSoftmaxAgent, SoftmaxAgent
+from solar_env import SolarEnv
+
+from conftest import INDOOR_DATA_PATH
+
+STEPS = 1500
+HYPERPARAMETERS = {'actor_step_sizes': [0.1, 0.01, 0.1], 'critic_step_sizes': [0.1, 0.1, 0.01],
+                   'avg_reward_step_sizes': [0.01, 0.01, 0.01], 'temperatures': [0.5, 1.0, 0.5]}
+
+
+@pytest.fixture(scope='module')
+def value_array():
+    # A 13x13 grid keeps the dense tables small
+    return solar_env.convert_solar_df_to_value_array(solar_env.load_and_format_solar_df(INDOOR_DATA_PATH), 15)
+
+
+def run_single_agents(value_array, seeds, rng, **table_settings):
+    total_rewards = []
+    for n, seed in enumerate(seeds):
+        total_rewards.append(ef.run_agent_experiment(
+            SolarEnv(value_array, roll_frequency=100), STEPS, seed, 24, HYPERPARAMETERS['actor_step_sizes'][n],
+            HYPERPARAMETERS['critic_step_sizes'][n], HYPERPARAMETERS['avg_reward_step_sizes'][n],
+            HYPERPARAMETERS['temperatures'][n], logging_interval=None, hide_progress_bar=True, rng=rng, 
+            **table_settings))
+    return np.array(total_rewards)
+
+
+@pytest.mark.parametrize('table_settings', [{},
+                                            {'table_storage': 'lazy'},
+                                            {'table_storage': 'dense', 'table_dtype': np.float32},
+                                            {'table_storage': 'lazy', 'table_dtype': np.float32}])
+@pytest.mark.parametrize('rng', ['legacy', 'pcg64'])
+def test_batch_matches_single_agents(value_array, rng, table_settings):
+    # More steps than one block of uniforms, so the refill is covered
+    assert STEPS > rl_agent.UNIFORM_BLOCK_SIZE
+    batch_rewards = ef.run_batch_agent_experiment(SolarEnv(value_array, roll_frequency=100), STEPS, 1, 24,
+                                                  hide_progress_bar=True, rng=rng, **HYPERPARAMETERS, **table_settings)
+    if rng == 'legacy':
+        seeds = [1, 1, 1]
+    else:
+        seeds = np.random.SeedSequence(1).spawn(3)
+    np.testing.assert_allclose(batch_rewards, run_single_agents(value_array, seeds, rng, **table_settings), 
+                               rtol=1e-12)
+
+
+def test_lazy_tables_allocate_visited_rows():
+    agent = BatchSoftmaxAgent([0.1] * 2, [0.1] * 2, [0.01] * 2, [0.5] * 2, (5, 5), 10, 3, table_storage='lazy', 
+                              table_dtype=np.float32, critic_init_value=1)
+    agent.agent_start()
+    agent.agent_policy()
+    agent.agent_step(np.array([1.0, 2.0]), (2, np.array([0, 24])))
+    # Per agent, the actor row of the policy and the critic rows of the last and next state
+    assert agent.get_table_nbytes() == 2 * 3 * 25 * 4
+    critic_array = agent.get_critic_array()
+    assert critic_array.shape == (2, 3, 25, 25) and critic_array.dtype == np.float32
+    for n in range(2):
+        assert critic_array[n, 0, 12, agent.last_action[n]] == pytest.approx(1 + 0.1 * agent.get_agent_last_delta()[n])
+    assert np.count_nonzero(critic_array != 1) == 2
+
+
+def test_pcg64_agents_draw_independent_streams():
+    agent = BatchSoftmaxAgent([0.1] * 3, [0.1] * 3, [0.01] * 3, [0.5] * 3, (5, 5), 10, 2, random_seeds=1, rng='pcg64')
+    uniforms = np.stack([agent.draw_uniforms() for i in range(5)], axis=1)
+    assert len({tuple(row) for row in uniforms}) == 3
+    legacy_agent = BatchSoftmaxAgent([0.1] * 3, [0.1] * 3, [0.01] * 3, [0.5] * 3, (5, 5), 10, 2, random_seeds=1)
+    legacy_uniforms = legacy_agent.draw_uniforms()
+    assert np.all(legacy_uniforms == legacy_uniforms[0])
@@ -0,0 +1,129 @@
+import threading
+
+import numpy as np
+import pytest
+
+import checkpoint
+import experiment_functions as ef
+from rl_agent import SoftmaxAgent
+from solar_env import SolarEnv
+
+AGENT_SETTINGS = {'actor_step_size': 0.1, 'critic_step_size': 0.1, 'avg_reward_step_size': 0.01,
+                  'temperature_value': 0.5, 'reward_rolling_avg_window': 100, 'day_partitions': 2, 'random_seed': 1}
+VALUE_ARRAY = np.linspace(0, 1, 25).reshape(5, 5)
+
+
+def create_agent(**settings):
+    agent = SoftmaxAgent(env_shape=VALUE_ARRAY.shape, **dict(AGENT_SETTINGS, **settings))
+    agent.agent_start()
+    return agent
+
+
+def update_rows(agent, rows, value):
+    for partition, state in rows:
+        agent.actor_array[partition, state] = value
+        agent.critic_array[partition, state] = -value
+        agent.dirty_rows[partition, state] = True
+
+
+def test_checkpoints_coalesce_while_writer_is_busy(tmp_path):
+    agent = create_agent()
+    env = SolarEnv(VALUE_ARRAY)
+    writer = checkpoint.CheckpointWriter(str(tmp_path), agent)
+    write_checkpoint = writer.write_checkpoint
+    write_started = threading.Event()
+    release_writer = threading.Event()
+    written_steps = []
+
+    def blocking_write_checkpoint(records, arrays, meta, distinct_rows):
+        write_started.set()
+        release_writer.wait()
+        written_steps.append(meta['step'])
+        write_checkpoint(records, arrays, meta, distinct_rows)
+
+    writer.write_checkpoint = blocking_write_checkpoint
+    update_rows(agent, [(0, 1)], 1)
+    writer.checkpoint(1, env, agent)
+    assert write_started.wait(5)
+    # The writer is busy, so these are merged into one pending checkpoint without blocking
+    for step, (rows, value) in enumerate([([(0, 2), (1, 3)], 2), ([(1, 3)], 3), ([(0, 4)], 4)], start=2):
+        update_rows(agent, rows, value)
+        writer.checkpoint(step, env, agent)
+    assert len(writer.pending_snapshot[0]) == 3
+    release_writer.set()
+    writer.close()
+    assert written_steps == [1, 4]
+
+    restored_agent = create_agent()
+    meta = checkpoint.restore_checkpoint(str(tmp_path), SolarEnv(VALUE_ARRAY), restored_agent)
+    assert meta['step'] == 4
+    np.testing.assert_array_equal(restored_agent.actor_array, agent.actor_array)
+    np.testing.assert_array_equal(restored_agent.critic_array, agent.critic_array)
+
+
+@pytest.mark.parametrize('settings', [{'temperature_value': 1.0}, {'random_seed': 2}, {'rng': 'pcg64'},
+                                      {'table_dtype': np.float32}, {'day_partitions': 3},
+                                      {'action_space': 'local', 'neighborhood_radius': 1}])
+def test_restore_refuses_mismatched_agent(tmp_path, settings):
+    agent = create_agent()
+    writer = checkpoint.CheckpointWriter(str(tmp_path), agent)
+    update_rows(agent, [(0, 1)], 1)
+    writer.checkpoint(1, SolarEnv(VALUE_ARRAY), agent)
+    writer.close()
+
+    mismatched_agent = create_agent(**settings)
+    with pytest.raises(ValueError, match='different settings'):
+        checkpoint.restore_checkpoint(str(tmp_path), SolarEnv(VALUE_ARRAY), mismatched_agent)
+    assert not mismatched_agent.actor_array.any()
+
+
+def test_restore_accepts_matching_seed_sequence(tmp_path):
+    seed = np.random.SeedSequence(1, spawn_key=(3, 4))
+    agent = create_agent(random_seed=seed, rng='pcg64')
+    writer = checkpoint.CheckpointWriter(str(tmp_path), agent)
+    writer.checkpoint(0, SolarEnv(VALUE_ARRAY), agent)
+    writer.close()
+    restored_agent = create_agent(random_seed=np.random.SeedSequence(1, spawn_key=(3, 4)), rng='pcg64')
+    assert checkpoint.restore_checkpoint(str(tmp_path), SolarEnv(VALUE_ARRAY), restored_agent)['step'] == 0
+    with pytest.raises(ValueError):
+        checkpoint.restore_checkpoint(str(tmp_path), SolarEnv(VALUE_ARRAY),
+                                      create_agent(random_seed=np.random.SeedSequence(1, spawn_key=(3, 5)),
+                                                   rng='pcg64'))
+
+
+@pytest.mark.parametrize('env_settings', [{'roll_frequency': 100}, {'movement_penalty': 0.1}, {'time_of_day_max': 12},
+                                          {'value_array': VALUE_ARRAY[::-1]}])
+def test_restore_refuses_mismatched_env(tmp_path, env_settings):
+    agent = create_agent()
+    writer = checkpoint.CheckpointWriter(str(tmp_path), agent)
+    update_rows(agent, [(0, 1)], 1)
+    writer.checkpoint(1, SolarEnv(VALUE_ARRAY), agent)
+    writer.close()
+
+    restored_agent = create_agent()
+    mismatched_env = SolarEnv(**dict({'value_array': VALUE_ARRAY}, **env_settings))
+    with pytest.raises(ValueError, match='environment with different settings'):
+        checkpoint.restore_checkpoint(str(tmp_path), mismatched_env, restored_agent)
+    assert not restored_agent.actor_array.any()
+
+
+@pytest.mark.parametrize('stream_tracking', [False, True])
+def test_resumed_experiment_keeps_earlier_tracking(tmp_path, stream_tracking):
+    experiment_settings = {'seed': 1, 'day_partitions': 24, 'actor_step_size': 0.1, 'critic_step_size': 0.1,
+                           'avg_reward_step_size': 0.01, 'temperature': 0.5, 'logging_interval': 100,
+                           'hide_progress_bar': True}
+    total_reward, full_tracking = ef.run_agent_experiment(SolarEnv(VALUE_ARRAY, roll_frequency=50), 1000,
+                                                          **experiment_settings)
+    tracking_dir = str(tmp_path / 'tracking') if stream_tracking else None
+    # The first run stops at step 600 and the second resumes from its checkpoint
+    for steps in [600, 1000]:
+        resumed_reward, resumed_tracking = ef.run_agent_experiment(
+            SolarEnv(VALUE_ARRAY, roll_frequency=50), steps, checkpoint_dir=str(tmp_path / 'checkpoint'),
+            checkpoint_interval=300, tracking_dir=tracking_dir, **experiment_settings)
+    if stream_tracking:
+        resumed_tracking = resumed_tracking.get_tracking_df()
+    assert resumed_reward == total_reward
+    assert list(resumed_tracking['step']) == list(range(0, 1001, 100))
+    for column in ['delta', 'rolling_power', 'total_energy']:
+        np.testing.assert_array_equal(resumed_tracking[column], full_tracking[column])
+    np.testing.assert_array_equal(np.stack(resumed_tracking['state_visits']), np.stack(full_tracking['state_visits']))
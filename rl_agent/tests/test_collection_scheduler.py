@@ -0,0 +1,42 @@
+import asyncio
+
+import numpy as np
+
+from async_arduino_interface import AsyncArduinoDriver
+from collection_scheduler import COLLECTION_COLUMNS, create_refinement_plan, create_serpentine_plan, run_collection
+from simulated_arduino import SimulatedArduino
+
+
+def test_serpentine_plan_covers_the_grid_in_single_steps():
+    plan = create_serpentine_plan(5)
+    assert len(plan) == 37 * 37
+    assert set(plan) == {(motor_1, motor_2) for motor_1 in range(0, 181, 5) for motor_2 in range(0, 181, 5)}
+    moves = np.abs(np.diff(np.array(plan), axis=0)).sum(axis=1)
+    assert np.all(moves == 5)
+
+
+def test_refinement_plan_skips_measured_grid_positions():
+    value_array = np.zeros((37, 37))
+    value_array[10, 20] = 1.0
+    plan = create_refinement_plan(value_array, 5, refine_radius=1, refine_degree_step=1)
+    # A 3x3 block of 5 degree cells has 15x15 positions at 1 degree, of which 3x3 are on the coarse grid
+    assert len(plan) == 15 * 15 - 3 * 3
+    assert len(set(plan)) == len(plan)
+    assert all([motor_1 % 5 or motor_2 % 5 for motor_1, motor_2 in plan])
+    assert all([45 <= motor_1 < 60 and 95 <= motor_2 < 110 for motor_1, motor_2 in plan])
+
+
+def test_run_collection_on_a_simulated_panel():
+    value_array = np.arange(49, dtype=float).reshape(7, 7)
+
+    async def collect():
+        reader, writer = await SimulatedArduino(value_array, degree_discretization=30).open_connection()
+        async with AsyncArduinoDriver(reader, writer) as driver:
+            return await run_collection(driver, degree_discretization=30, hide_progress_bar=True)
+
+    data_df = asyncio.run(collect())
+    assert list(data_df.columns) == COLLECTION_COLUMNS
+    assert len(data_df) == 49
+    assert data_df['t_relative'].iloc[0] == 0
+    assert set(zip(data_df['motor_1_position'].astype(int), data_df['motor_2_position'].astype(int))) == \
+        set(create_serpentine_plan(30))
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import checkpoint
+import experiment_functions as ef
+import solar_env
+from rl_agent import SoftmaxAgent
+from solar_env import SolarEnv
+
+from conftest import INDOOR_DATA_PATH
+
+STEPS = 3000
+AGENT_SETTINGS = {'actor_step_size': 0.1, 'critic_step_size': 0.1, 'avg_reward_step_size': 0.01,
+                  'temperature_value': 0.5, 'reward_rolling_avg_window': 100, 'day_partitions': 24, 'random_seed': 1}
+
+
+@pytest.fixture(scope='module')
+def value_array():
+    # A 13x13 grid keeps the dense tables small
+    return solar_env.convert_solar_df_to_value_array(solar_env.load_and_format_solar_df(INDOOR_DATA_PATH), 15)
+
+
+def create_agent(value_array, critic_means, table_storage='dense'):
+    agent = SoftmaxAgent(env_shape=value_array.shape, critic_means=critic_means, table_storage=table_storage,
+                         **AGENT_SETTINGS)
+    agent.agent_start()
+    return agent
+
+
+def run_agent(value_array, agent, steps, **experiment_kwargs):
+    env = SolarEnv(value_array, roll_frequency=100)
+    ef.run_agent_experiment(env, steps, None, None, None, None, None, None, logging_interval=None,
+                            hide_progress_bar=True, agent=agent, **experiment_kwargs)
+    return env
+
+
+def get_critic_row_sums(agent):
+    critic_array = agent.critic_array.toarray() if agent.table_storage == 'lazy' else agent.critic_array
+    return critic_array.sum(axis=-1)
+
+
+@pytest.mark.parametrize('table_storage', ['dense', 'lazy'])
+def test_running_sums_match_reduce(value_array, table_storage):
+    running_agent = create_agent(value_array, 'running', table_storage)
+    reduce_agent = create_agent(value_array, 'reduce', table_storage)
+    run_agent(value_array, running_agent, STEPS)
+    run_agent(value_array, reduce_agent, STEPS)
+    np.testing.assert_allclose(running_agent.critic_sums, get_critic_row_sums(running_agent), rtol=1e-9, atol=1e-12)
+    # The running sums only differ from the reduced means by rounding
+    np.testing.assert_allclose(running_agent.get_agent_total_reward(), reduce_agent.get_agent_total_reward(),
+                               rtol=1e-6)
+    np.testing.assert_allclose(running_agent.get_agent_avg_reward(), reduce_agent.get_agent_avg_reward(), rtol=1e-6)
+
+
+def test_running_sums_after_restore_checkpoint(value_array, tmp_path):
+    checkpoint_dir = str(tmp_path / 'checkpoint')
+    run_agent(value_array, create_agent(value_array, 'running'), STEPS // 2, checkpoint_dir=checkpoint_dir,
+              checkpoint_interval=500)
+    restored_agent = create_agent(value_array, 'running')
+    checkpoint.restore_checkpoint(checkpoint_dir, SolarEnv(value_array, roll_frequency=100), restored_agent)
+    np.testing.assert_allclose(restored_agent.critic_sums, get_critic_row_sums(restored_agent), rtol=1e-9,
+                               atol=1e-12)
+
+    # Resuming gives the same sums as an uninterrupted run
+    resumed_agent = create_agent(value_array, 'running')
+    run_agent(value_array, resumed_agent, STEPS, checkpoint_dir=checkpoint_dir, checkpoint_interval=500)
+    uninterrupted_agent = create_agent(value_array, 'running')
+    run_agent(value_array, uninterrupted_agent, STEPS)
+    np.testing.assert_allclose(resumed_agent.critic_sums, uninterrupted_agent.critic_sums, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(resumed_agent.critic_sums, get_critic_row_sums(resumed_agent), rtol=1e-9, atol=1e-12)
+
+
+def test_refresh_critic_sums(value_array):
+    agent = create_agent(value_array, 'running')
+    run_agent(value_array, agent, STEPS // 3)
+    agent.critic_array[3, 7] += np.linspace(0, 1, agent.agent_shape[2])
+    agent.refresh_critic_sums()
+    np.testing.assert_allclose(agent.critic_sums, get_critic_row_sums(agent), rtol=1e-9, atol=1e-12)
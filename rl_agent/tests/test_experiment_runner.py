@@ -0,0 +1,38 @@
+import pandas as pd
+
+import experiment_runner
+import sweep_runner
+
+from conftest import INDOOR_DATA_PATH
+
+
+def square_task(task):
+    return {'square': task['value'] ** 2}
+
+
+def test_get_task_key_matches_values_read_back():
+    assert experiment_runner.get_task_key({'a': 1, 'b': 'lazy'}, ['a', 'b']) == \
+        experiment_runner.get_task_key({'a': 1.0, 'b': 'lazy'}, ['a', 'b']) == \
+        experiment_runner.get_task_key({'a': '1', 'b': 'lazy'}, ['a', 'b'])
+
+
+def test_run_experiments_resumes_int_tasks(tmp_path):
+    results_path = str(tmp_path / 'results.csv')
+    tasks = [{'value': 1}, {'value': 0.5}, {'value': 3}]
+    first_df = experiment_runner.run_experiments(square_task, tasks[:2], 1, results_path=results_path,
+                                                 hide_progress_bar=True)
+    resumed_df = experiment_runner.run_experiments(square_task, tasks, 1, results_path=results_path,
+                                                   hide_progress_bar=True)
+    assert list(resumed_df['square']) == [1, 0.25, 9]
+    assert list(first_df['square']) == [1, 0.25]
+    assert len(pd.read_csv(results_path)) == 3
+
+
+def test_hyperparam_study_resumes_default_int_values(tmp_path):
+    results_path = str(tmp_path / 'study.csv')
+    study_kwargs = {'temperature_values': [1, 0.1], 'actor_step_size_values': [0.1], 'critic_step_size_values': [0.1],
+                    'avg_reward_step_size_values': [0.01], 'results_path': results_path, 'hide_progress_bar': True}
+    first_df = sweep_runner.run_hyperparam_study(INDOOR_DATA_PATH, 500, 200, 1, 24, 1, **study_kwargs)
+    resumed_df = sweep_runner.run_hyperparam_study(INDOOR_DATA_PATH, 500, 200, 1, 24, 1, **study_kwargs)
+    pd.testing.assert_frame_equal(first_df, resumed_df)
+    assert len(pd.read_csv(results_path)) == 2
@@ -0,0 +1,62 @@
+import pytest
+
+from hardware_env import HardwareSolarEnv, convert_hour_to_partition, run_hardware_agent_experiment, \
+    run_hardware_experiment_steps
+from rl_agent import SoftmaxAgent
+from simulated_arduino import SimulatedArduino
+
+# A small grid keeps the agent's dense tables small
+ENV_SHAPE = (5, 5)
+DRIVER_KWARGS = {'response_timeout': 0.5, 'reset_timeout': 0.5, 'negotiation_timeout': 0.05, 'max_resets': 0}
+AGENT_SETTINGS = {'seed': 1, 'actor_step_size': 0.1, 'critic_step_size': 0.1, 'avg_reward_step_size': 0.01,
+                  'temperature': 0.5, 'hide_progress_bar': True}
+
+
+class SlowShortResponseArduino(SimulatedArduino):
+    def get_servo_move_time(self, motor_1_degree, motor_2_degree):
+        # Queued moves finish well after the first
+        return 0.1
+
+    def format_state(self, state_fields):
+        # A response without the measurement fields, so computing the reward fails
+        return str(state_fields[0])
+
+
+def create_env(device, day_partitions, hour):
+    return HardwareSolarEnv(device.open_connection, env_shape=ENV_SHAPE, time_of_day_function=lambda: hour,
+                            day_partitions=day_partitions, **DRIVER_KWARGS)
+
+
+def test_hours_map_to_partitions():
+    assert [convert_hour_to_partition(hour, 6) for hour in [0, 3, 4, 12, 23]] == [0, 0, 1, 3, 5]
+    assert [convert_hour_to_partition(hour, 24) for hour in range(24)] == list(range(24))
+
+
+def test_late_hours_fit_fewer_partitions():
+    env = create_env(SimulatedArduino(), 6, 23)
+    try:
+        agent = run_hardware_agent_experiment(env, 10, day_partitions=6, **AGENT_SETTINGS)
+        assert agent.get_agent_last_state()[0] == 5
+        with pytest.raises(ValueError):
+            run_hardware_agent_experiment(env, 10, day_partitions=24, **AGENT_SETTINGS)
+    finally:
+        env.close()
+
+
+def test_failed_step_drains_the_queued_action():
+    env = create_env(SlowShortResponseArduino(), 24, 0)
+    submitted_steps = []
+    submit_action = env.submit_action
+    def record_submit(action_tuple, last_state_tuple):
+        submitted_steps.append(submit_action(action_tuple, last_state_tuple))
+        return submitted_steps[-1]
+    env.submit_action = record_submit
+    agent = SoftmaxAgent(0.1, 0.1, 0.01, 0.5, ENV_SHAPE, 10, 24, random_seed=1)
+    agent.agent_start()
+    try:
+        with pytest.raises(IndexError):
+            run_hardware_experiment_steps(env, agent, 10, hide_progress_bar=True)
+        assert len(submitted_steps) == 2
+        assert all([step.done() for step in submitted_steps])
+    finally:
+        env.close()
@@ -0,0 +1,49 @@
+import serial
+
+from panel_controller import run_panel_experiment
+from simulated_arduino import SimulatedArduino
+
+DRIVER_KWARGS = {'response_timeout': 0.05, 'reset_timeout': 0.05, 'negotiation_timeout': 0.05,
+                 'stale_response_timeout': 0.05}
+PANEL_SETTINGS = {'seed': 1, 'day_partitions': 24, 'actor_step_size': 0.1, 'critic_step_size': 0.1,
+                  'avg_reward_step_size': 0.01, 'temperature': 0.5, 'driver_kwargs': DRIVER_KWARGS}
+
+
+class ShortResponseArduino(SimulatedArduino):
+    def format_state(self, state_fields):
+        # A response without the measurement fields, as left by a misrouted message
+        return str(state_fields[0])
+
+
+async def fail_to_open():
+    raise serial.SerialException('could not open port')
+
+
+def test_panels_run_concurrently_with_a_silent_panel():
+    devices = [SimulatedArduino(link_latency=0.001) for i in range(4)]
+    devices[2].unresponsive_requests = 10**9
+    agents, controller = run_panel_experiment([device.open_connection for device in devices], 20, **PANEL_SETTINGS)
+    metrics_df = controller.get_metrics_df()
+    assert list(metrics_df['failed']) == [False, False, True, False]
+    assert list(metrics_df['steps']) == [20, 20, 0, 20]
+    assert controller.get_summary()['total_steps'] == 60
+    assert all([driver is None for driver in controller.drivers])
+
+
+def test_panel_errors_do_not_stop_other_panels():
+    devices = [SimulatedArduino(), ShortResponseArduino(), SimulatedArduino()]
+    open_streams_list = [devices[0].open_connection, devices[1].open_connection, fail_to_open,
+                         devices[2].open_connection]
+    agents, controller = run_panel_experiment(open_streams_list, 10, **PANEL_SETTINGS)
+    assert isinstance(controller.panel_errors[1], IndexError)
+    assert isinstance(controller.panel_errors[2], serial.SerialException)
+    assert list(controller.get_metrics_df()['steps']) == [10, 0, 0, 10]
+
+
+def test_late_hours_fit_fewer_partitions():
+    devices = [SimulatedArduino() for i in range(2)]
+    panel_settings = dict(PANEL_SETTINGS, day_partitions=6)
+    agents, controller = run_panel_experiment([device.open_connection for device in devices], 10,
+                                              time_of_day_function=lambda: 23, **panel_settings)
+    assert controller.panel_errors == [None, None]
+    assert [agent.get_agent_last_state()[0] for agent in agents] == [5, 5]
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import experiment_functions as ef
+import simulation_kernel
+import solar_env
+from rl_agent import SoftmaxAgent
+from solar_env import SolarEnv
+
+from conftest import INDOOR_DATA_PATH
+
+STEPS = 2000
+AGENT_SETTINGS = {'actor_step_size': 0.1, 'critic_step_size': 0.1, 'avg_reward_step_size': 0.01,
+                  'temperature_value': 0.5, 'reward_rolling_avg_window': 100, 'day_partitions': 24, 'random_seed': 1}
+
+# The numba kernel sums and exponentiates differently from the agent, so results agree up to floating point rounding 
+# of the table dtype
+TOLERANCES = {np.float64: {'rtol': 1e-9, 'atol': 1e-12}, np.float32: {'rtol': 1e-4, 'atol': 1e-6}}
+
+KERNEL_ENGINES = [False, pytest.param(True, marks=pytest.mark.skipif(not simulation_kernel.NUMBA_AVAILABLE,
+                                                                    reason='numba is not installed'))]
+
+
+@pytest.fixture(scope='module')
+def value_array():
+    # A 13x13 grid has more actions than one block of numpy's pairwise summation
+    return solar_env.convert_solar_df_to_value_array(solar_env.load_and_format_solar_df(INDOOR_DATA_PATH), 15)
+
+
+def create_run(value_array, table_dtype):
+    env = SolarEnv(value_array, roll_frequency=100)
+    agent = SoftmaxAgent(env_shape=value_array.shape, table_dtype=table_dtype, **AGENT_SETTINGS)
+    agent.agent_start()
+    return env, agent
+
+
+@pytest.mark.parametrize('table_dtype', [np.float64, np.float32])
+@pytest.mark.parametrize('use_numba', KERNEL_ENGINES)
+def test_kernel_matches_experiment_step(value_array, use_numba, table_dtype):
+    python_env, python_agent = create_run(value_array, table_dtype)
+    for i in range(1, STEPS + 1):
+        ef.run_experiment_step(python_env, python_agent, step=i)
+    kernel_env, kernel_agent = create_run(value_array, table_dtype)
+    # Two kernel calls, so the agent and env state synced between them is covered
+    simulation_kernel.run_kernel_steps(kernel_env, kernel_agent, STEPS // 2, use_numba=use_numba)
+    simulation_kernel.run_kernel_steps(kernel_env, kernel_agent, STEPS - STEPS // 2, use_numba=use_numba)
+
+    # The NumPy kernel performs the same operations as the agent
+    tolerances = TOLERANCES[table_dtype] if use_numba else {'rtol': 0, 'atol': 0}
+    assert kernel_agent.actor_array.dtype == python_agent.actor_array.dtype
+    assert kernel_env.total_steps == python_env.total_steps
+    assert kernel_env.time_of_day == python_env.time_of_day
+    assert kernel_agent.get_agent_last_state() == python_agent.get_agent_last_state()
+    np.testing.assert_array_equal(kernel_agent.state_visits, python_agent.state_visits)
+    np.testing.assert_array_equal(kernel_agent.dirty_rows, python_agent.dirty_rows)
+    np.testing.assert_allclose(kernel_agent.actor_array, python_agent.actor_array, **tolerances)
+    np.testing.assert_allclose(kernel_agent.critic_array, python_agent.critic_array, **tolerances)
+    np.testing.assert_allclose(kernel_agent.step_softmax_prob, python_agent.step_softmax_prob, **tolerances)
+    for name in ['avg_reward', 'total_reward', 'rolling_reward', 'last_delta']:
+        np.testing.assert_allclose(getattr(kernel_agent, name), getattr(python_agent, name), **tolerances)
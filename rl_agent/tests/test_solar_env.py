@@ -0,0 +1,44 @@
+import numpy as np
+
+from solar_env import SolarEnv
+
+VALUE_ARRAY = np.arange(25, dtype=float).reshape(5, 5)
+
+
+def step_to_time_of_day(env, time_of_day):
+    while env.time_of_day != time_of_day:
+        env.env_step((0, 0), (0, 0))
+
+
+def test_reward_array_matches_lookup_reward():
+    env = SolarEnv(VALUE_ARRAY, roll_frequency=2)
+    for time_of_day in range(4):
+        step_to_time_of_day(env, time_of_day)
+        rows, columns = np.indices(env.get_env_shape())
+        np.testing.assert_array_equal(env.lookup_reward((rows, columns)), env.reward_array)
+
+
+def test_set_reward_array_keeps_the_time_of_day():
+    env = SolarEnv(VALUE_ARRAY, roll_frequency=2)
+    step_to_time_of_day(env, 2)
+    # Cache the rolled array, which the new values must replace
+    env.get_reward_array()
+    new_array = VALUE_ARRAY[::-1] * 10
+    env.reward_array = new_array
+    np.testing.assert_array_equal(env.reward_array, new_array)
+    assert env.lookup_reward((1, 3)) == new_array[1, 3]
+    assert env.time_of_day == 2
+
+    # Later times of day roll the new values
+    step_to_time_of_day(env, 3)
+    np.testing.assert_array_equal(env.reward_array, np.roll(np.roll(new_array, 1, axis=0), 1, axis=1))
+    assert env.lookup_reward((2, 4)) == new_array[1, 3]
+
+
+def test_time_of_day_max_wraps_the_day():
+    env = SolarEnv(VALUE_ARRAY, roll_frequency=1, time_of_day_max=3)
+    times_of_day = []
+    for i in range(6):
+        env.env_step((0, 0), (0, 0))
+        times_of_day.append(env.time_of_day)
+    assert times_of_day == [1, 2, 0, 1, 2, 0]
@@ -0,0 +1,49 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import experiment_functions as ef
+import step_profiler
+from solar_env import SolarEnv
+
+EXPERIMENT_SETTINGS = {'seed': 1, 'day_partitions': 24, 'actor_step_size': 0.1, 'critic_step_size': 0.1,
+                       'avg_reward_step_size': 0.01, 'temperature': 0.5, 'logging_interval': 100,
+                       'hide_progress_bar': True}
+VALUE_ARRAY = np.linspace(0, 1, 49).reshape(7, 7)
+
+
+class FailingEnv(SolarEnv):
+    def __init__(self, value_array, failing_step):
+        super().__init__(value_array)
+        self.failing_step = failing_step
+
+    def env_step(self, action_tuple, last_state_tuple):
+        if self.total_steps + 1 == self.failing_step:
+            raise RuntimeError('env failed')
+        return super().env_step(action_tuple, last_state_tuple)
+
+
+def test_profiled_experiment_matches_unprofiled():
+    total_reward, _ = ef.run_agent_experiment(SolarEnv(VALUE_ARRAY), 500, **EXPERIMENT_SETTINGS)
+    profiler = step_profiler.StepProfiler(print_summary=False)
+    profiled_total_reward, _ = ef.run_agent_experiment(SolarEnv(VALUE_ARRAY), 500, profiler=profiler,
+                                                       **EXPERIMENT_SETTINGS)
+    assert profiled_total_reward == total_reward
+    phase_stats = profiler.get_phase_stats()
+    assert phase_stats['run_agent_experiment;run_experiment_step'].calls == 500
+    assert phase_stats['run_agent_experiment;run_experiment_step;index_conversion'].calls == 1000
+    assert phase_stats['run_agent_experiment;handle_event'].calls == 5
+
+
+def test_failed_experiment_removes_wrappers_and_stops_tracing():
+    env = FailingEnv(VALUE_ARRAY, 50)
+    profiler = step_profiler.StepProfiler(track_allocations=True, print_summary=False)
+    agent = ef.SoftmaxAgent(0.1, 0.1, 0.01, 0.5, VALUE_ARRAY.shape, 10, 24)
+    agent.agent_start()
+    with pytest.raises(RuntimeError, match='env failed'):
+        ef.run_agent_experiment(env, 500, agent=agent, profiler=profiler, **EXPERIMENT_SETTINGS)
+    assert not tracemalloc.is_tracing()
+    assert not set(step_profiler.AGENT_PHASES) & set(vars(agent))
+    assert not set(step_profiler.ENV_PHASES) & set(vars(env))
+    assert profiler.instrumented == []
@@ -0,0 +1,22 @@
+import pytest
+
+import sweep_runner
+
+from conftest import INDOOR_DATA_PATH
+
+
+def test_create_halving_budgets():
+    assert sweep_runner.create_halving_budgets(10, 100, eta=3) == [10, 30, 90, 100]
+    assert sweep_runner.create_halving_budgets(100, 100) == [100]
+
+
+@pytest.mark.parametrize('min_steps, max_steps, eta', [(0, 100, 3), (-5, 100, 3), (10, 100, 1), (10, 100, 0.5),
+                                                       (200, 100, 3)])
+def test_create_halving_budgets_rejects_invalid_settings(min_steps, max_steps, eta):
+    with pytest.raises(ValueError):
+        sweep_runner.create_halving_budgets(min_steps, max_steps, eta=eta)
+
+
+def test_hyperband_rejects_invalid_settings():
+    with pytest.raises(ValueError, match='eta'):
+        sweep_runner.run_hyperband(INDOOR_DATA_PATH, 500, 10, 100, 1, 24, eta=1, hide_progress_bar=True)
@@ -0,0 +1,79 @@
+import numpy as np
+
+import arduino_interface
+from arduino_interface import NOMINAL
+from simulated_arduino import SimulatedArduino, SimulatedSerial
+from telemetry_recorder import RECORD_DTYPE, RecordRingBuffer, TelemetryRecorder, load_records
+
+
+def create_records(start, count):
+    records = np.zeros(count, dtype=RECORD_DTYPE)
+    records['timestamp'] = np.arange(start, start + count)
+    return records
+
+
+def record(serial_device, output_path, record_count, **recorder_kwargs):
+    with TelemetryRecorder(serial_device, output_path, request_interval=0.001, read_timeout=0.001,
+                           **recorder_kwargs) as recorder:
+        assert recorder.wait_for_records(record_count, 5)
+    return recorder
+
+
+def test_ring_buffer_overwrites_oldest_records():
+    ring_buffer = RecordRingBuffer(4)
+    ring_buffer.append(create_records(0, 3))
+    ring_buffer.append(create_records(3, 3))
+    records, end_index, dropped_count = ring_buffer.get_since(0)
+    assert records['timestamp'].tolist() == [2, 3, 4, 5]
+    assert (end_index, dropped_count) == (6, 2)
+    assert ring_buffer.get_latest(3)['timestamp'].tolist() == [3, 4, 5]
+    ring_buffer.append(create_records(6, 9))
+    assert ring_buffer.get_latest(10)['timestamp'].tolist() == [11, 12, 13, 14]
+
+
+def test_records_ascii_responses(tmp_path):
+    output_path = str(tmp_path / 'telemetry.csv')
+    recorder = record(SimulatedSerial(SimulatedArduino(), timeout=1), output_path, 20)
+    records_df = recorder.load_records()
+    assert len(records_df) == recorder.get_record_count() >= 20
+    assert (records_df['state'] == NOMINAL).all()
+    assert not records_df.isna().any().any()
+    assert len(recorder.get_live_view(5)) == 5
+
+
+def test_records_binary_frames(tmp_path):
+    output_path = str(tmp_path / 'telemetry.csv')
+    serial_device = SimulatedSerial(SimulatedArduino(), timeout=1)
+    assert arduino_interface.set_binary_mode(serial_device, reset_output=False)
+    recorder = record(serial_device, output_path, 20, binary_frames=True)
+    records_df = recorder.load_records()
+    assert len(records_df) == recorder.get_record_count() >= 20
+    assert (records_df['state'] == NOMINAL).all()
+    assert recorder.frame_parser.skipped_bytes == 0
+
+
+def test_flushes_while_recording_and_repairs_partial_rows(tmp_path):
+    output_path = str(tmp_path / 'telemetry.csv')
+    serial_device = SimulatedSerial(SimulatedArduino(), timeout=1)
+    recorder = TelemetryRecorder(serial_device, output_path, request_interval=0.001, read_timeout=0.001,
+                                 flush_interval=0.01)
+    with recorder:
+        assert recorder.wait_for_records(10, 5)
+        recorder.flush()
+        flushed_count = len(load_records(output_path))
+        assert flushed_count >= 10
+    # A row cut short by a crash is dropped before the next flush appends to the file
+    with open(output_path, 'a') as output_file:
+        output_file.write('1.0,1111,0.5')
+    record(serial_device, output_path, 5)
+    records_df = load_records(output_path)
+    assert len(records_df) >= recorder.get_record_count() + 5
+    assert not records_df.isna().any().any()
+
+
+def test_counts_records_overwritten_before_a_flush(tmp_path):
+    output_path = str(tmp_path / 'telemetry.csv')
+    recorder = record(SimulatedSerial(SimulatedArduino(), timeout=1), output_path, 50, capacity=8,
+                      flush_interval=60)
+    assert recorder.get_dropped_records() == recorder.get_record_count() - 8
+    assert len(recorder.load_records()) == 8
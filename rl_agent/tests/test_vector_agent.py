@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import experiment_functions as ef
+from benchmarks.results import time_best
+from rl_agent import VectorSoftmaxAgent
+from solar_env import SolarEnv, VectorSolarEnv
+
+AGENT_SETTINGS = {'actor_step_size': 0.1, 'critic_step_size': 0.1, 'avg_reward_step_size': 0.01, 'temperature': 0.5,
+                  'rolling_steps_measurement': 10, 'day_partitions': 24}
+VALUE_ARRAY = np.linspace(0, 1, 49).reshape(7, 7)
+
+
+@pytest.mark.parametrize('agent_settings', [{},
+                                            {'table_storage': 'lazy', 'critic_means': 'running'},
+                                            {'action_space': 'local', 'neighborhood_radius': 1,
+                                             'table_dtype': np.float32}])
+def test_single_stream_matches_softmax_agent(agent_settings):
+    steps = 2000
+    total_reward = ef.run_agent_experiment(SolarEnv(VALUE_ARRAY, roll_frequency=50), steps, 1, logging_interval=None,
+                                           hide_progress_bar=True, **AGENT_SETTINGS, **agent_settings)
+    vector_total_reward = ef.run_vector_agent_experiment(VectorSolarEnv([VALUE_ARRAY], roll_frequency=50), steps, 1,
+                                                         hide_progress_bar=True, **AGENT_SETTINGS, **agent_settings)
+    assert vector_total_reward[0] == total_reward
+
+
+def create_agent(num_streams, **settings):
+    agent = VectorSoftmaxAgent(actor_step_size=0.1, critic_step_size=0.5, avg_reward_step_size=0.1,
+                               temperature_value=1, env_shape=VALUE_ARRAY.shape, reward_rolling_avg_window=10,
+                               day_partitions=1, num_streams=num_streams, **settings)
+    agent.agent_start()
+    return agent
+
+
+@pytest.mark.parametrize('critic_means', ['reduce', 'running'])
+def test_streams_average_reward_and_add_updates(critic_means):
+    agent = create_agent(3, critic_means=critic_means)
+    agent.agent_policy()
+    # Every stream starts in the middle state, so the same critic entry takes each stream's update
+    agent.last_action = np.array([4, 4, 9])
+    reward = np.array([1.0, 2.0, 6.0])
+    agent.agent_step(reward, (0, np.array([0, 1, 2])))
+    np.testing.assert_array_equal(agent.get_agent_last_delta(), reward)
+    assert agent.get_agent_avg_reward() == pytest.approx(0.1 * np.mean(reward))
+    critic_row = agent.get_critic_array()[0, agent.agent_shape[1]//2]
+    assert critic_row[4] == pytest.approx(0.5 * (1.0 + 2.0))
+    assert critic_row[9] == pytest.approx(0.5 * 6.0)
+    if critic_means == 'running':
+        np.testing.assert_allclose(agent.critic_sums, agent.get_critic_array().sum(axis=-1))
+
+
+@pytest.mark.parametrize('agent_settings', [{}, {'critic_means': 'running'},
+                                            {'action_space': 'local', 'neighborhood_radius': 1,
+                                             'table_dtype': np.float32}])
+def test_batched_dense_update_matches_stream_updates(agent_settings):
+    # Lazy tables take the streams' updates one after another, dense tables in one batched update
+    steps = 1000
+    total_rewards = [ef.run_vector_agent_experiment(VectorSolarEnv([VALUE_ARRAY] * 4, roll_frequency=50,
+                                                                   phase_offsets=[0, 0, 3, 7]),
+                                                    steps, 1, hide_progress_bar=True, table_storage=table_storage,
+                                                    **AGENT_SETTINGS, **agent_settings)
+                     for table_storage in ['lazy', 'dense']]
+    np.testing.assert_allclose(total_rewards[1], total_rewards[0], rtol=1e-9)
+
+
+def test_batched_dense_update_is_faster_than_stream_updates():
+    num_streams = 8
+    agent = create_agent(num_streams)
+    agent.agent_policy()
+    agent.last_state = (np.zeros(num_streams, dtype=int), np.arange(num_streams) * 5)
+    delta = np.full(num_streams, 0.01)
+    
+    def update_streams():
+        for i in range(num_streams):
+            state = (int(agent.last_state[0][i]), int(agent.last_state[1][i]))
+            agent.update_critic(state, agent.last_action[i], delta[i])
+            agent.update_actor(state, agent.last_action[i], agent.step_softmax_prob[i], delta[i])
+    
+    def update_batched():
+        agent.update_dense_tables(delta)
+    
+    # Best of several repeats, so other load on the machine does not decide the comparison
+    assert time_best(lambda: [update_batched() for i in range(200)], 5) < \
+        time_best(lambda: [update_streams() for i in range(200)], 5)
@@ -0,0 +1,216 @@
+import os
+import json
+import pandas as pd
+import numpy as np
+
+# Scalar metrics logged at each tracking step, matching the create_tracking_dict keys
+SCALAR_DTYPE = np.dtype([
+    ('step', np.int64),
+    ('delta', np.float64),
+    ('rolling_power', np.float64),
+    ('total_energy', np.float64)
+])
+
+# Array snapshots logged at each tracking step
+ARRAY_FIELDS = ('state_visits', 'env_rewards')
+
+# Name of the index file describing the chunks of a tracking directory
+TRACKING_INDEX_FILE = 'tracking.json'
+
+
+def get_chunk_path(directory, field, chunk_index):
+    return os.path.join(directory, field + '_' + str(chunk_index).zfill(5) + '.npy')
+
+
+class TrackingLogger:
+    def __init__(self, directory, env_shape, chunk_size=256, resume_step=None):
+        """
+        Streams tracking metrics of an experiment to disk in fixed-size columnar chunks
+
+            * Scalars go into a preallocated structured buffer, array snapshots into preallocated stacked buffers
+            * Each full buffer is written as one .npy chunk per field and then reused
+            * With resume_step, the chunks an earlier run wrote to the directory are kept up to that step and new
+              rows are appended after them
+
+        Args:
+            directory (str): directory to write chunks to (created if needed)
+            env_shape (tuple): shape of the env reward array and the agent state visits
+        Kwargs:
+            chunk_size (int): number of logged steps held in memory before a flush
+            resume_step (int): step an experiment resumes from, keeping the rows logged before it in the directory,
+                or None to start a new log
+        """
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.env_shape = tuple(env_shape)
+        self.chunk_size = chunk_size
+        self.scalar_buffer = np.zeros(self.chunk_size, dtype=SCALAR_DTYPE)
+        self.array_buffers = {field: np.zeros((self.chunk_size,) + self.env_shape) for field in ARRAY_FIELDS}
+        self.buffer_count = 0
+        self.chunk_lengths = []
+        if resume_step is not None and os.path.exists(os.path.join(self.directory, TRACKING_INDEX_FILE)):
+            self.truncate_chunks(resume_step)
+
+    def truncate_chunks(self, resume_step):
+        """
+        Keep the chunks of an earlier run up to the rows logged before resume_step (steps are logged in order), 
+        removing the rest
+        """
+        with open(os.path.join(self.directory, TRACKING_INDEX_FILE)) as index_file:
+            chunk_lengths = json.load(index_file)['chunk_lengths']
+        for chunk_index in range(len(chunk_lengths)):
+            kept_rows = int(np.sum(np.load(get_chunk_path(self.directory, 'scalars', chunk_index))['step'] < 
+                                   resume_step))
+            if kept_rows == chunk_lengths[chunk_index]:
+                self.chunk_lengths.append(kept_rows)
+                continue
+            if kept_rows > 0:
+                for field in ('scalars',) + ARRAY_FIELDS:
+                    chunk_path = get_chunk_path(self.directory, field, chunk_index)
+                    np.save(chunk_path, np.load(chunk_path)[:kept_rows])
+                self.chunk_lengths.append(kept_rows)
+            break
+        for chunk_index in range(len(self.chunk_lengths), len(chunk_lengths)):
+            for field in ('scalars',) + ARRAY_FIELDS:
+                os.remove(get_chunk_path(self.directory, field, chunk_index))
+        self.write_index()
+
+    def log(self, step, env, agent):
+        """
+        Record the metrics of create_tracking_dict for a step, copying snapshots straight into the buffers
+
+        Args:
+            step (int): the step number of an experiment
+            env (SolarEnv): the environment of an experiment
+            agent (SoftmaxAgent): the agent of an experiment
+        Returns:
+            None
+        """
+        row = self.buffer_count
+        self.scalar_buffer[row] = (step, agent.get_agent_last_delta(), agent.get_agent_rolling_reward(),
+                                   agent.get_agent_total_reward())
+        self.array_buffers['state_visits'][row] = agent.state_visits
+        self.array_buffers['env_rewards'][row] = env.reward_array
+        self.buffer_count += 1
+        if self.buffer_count == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows as the next chunk and update the index file
+        """
+        if self.buffer_count == 0:
+            return
+        chunk_index = len(self.chunk_lengths)
+        np.save(get_chunk_path(self.directory, 'scalars', chunk_index), self.scalar_buffer[:self.buffer_count])
+        for field in ARRAY_FIELDS:
+            np.save(get_chunk_path(self.directory, field, chunk_index), self.array_buffers[field][:self.buffer_count])
+        self.chunk_lengths.append(self.buffer_count)
+        self.buffer_count = 0
+        self.write_index()
+
+    def write_index(self):
+        index = {'chunk_lengths': self.chunk_lengths, 'array_fields': list(ARRAY_FIELDS), 'env_shape': list(self.env_shape)}
+        with open(os.path.join(self.directory, TRACKING_INDEX_FILE + '.tmp'), 'w') as index_file:
+            json.dump(index, index_file)
+        os.replace(os.path.join(self.directory, TRACKING_INDEX_FILE + '.tmp'),
+                   os.path.join(self.directory, TRACKING_INDEX_FILE))
+
+    def close(self):
+        """
+        Flush remaining rows
+
+        Returns:
+            TrackingStore: a reader over the written chunks
+        """
+        self.flush()
+        self.write_index()
+        return TrackingStore(self.directory)
+
+
+class LazyArraySequence:
+    def __init__(self, chunk_arrays, rows=None):
+        """
+        Read-only sequence of array snapshots over memory-mapped chunks, usable as an array list in visualizations
+
+        Args:
+            chunk_arrays (list): memory-mapped chunk arrays of one field
+        Kwargs:
+            rows (numpy array): global row numbers in this sequence, or None for all rows
+        """
+        self.chunk_arrays = chunk_arrays
+        self.chunk_starts = np.cumsum([0] + [len(chunk) for chunk in chunk_arrays])
+        self.rows = np.arange(self.chunk_starts[-1]) if rows is None else np.asarray(rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LazyArraySequence(self.chunk_arrays, self.rows[index])
+        row = self.rows[index]
+        chunk_index = np.searchsorted(self.chunk_starts, row, side='right') - 1
+        return np.asarray(self.chunk_arrays[chunk_index][row - self.chunk_starts[chunk_index]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def select(self, mask):
+        """
+        Args:
+            mask (numpy array): boolean mask over the sequence, e.g. from a condition on the scalar df
+        Returns:
+            LazyArraySequence: the selected snapshots
+        """
+        return LazyArraySequence(self.chunk_arrays, self.rows[np.asarray(mask)])
+
+    def to_list(self):
+        return list(self)
+
+
+class TrackingStore:
+    def __init__(self, directory):
+        """
+        Lazy reader for a directory written by TrackingLogger
+
+        Args:
+            directory (str): the tracking directory
+        """
+        self.directory = directory
+        with open(os.path.join(self.directory, TRACKING_INDEX_FILE)) as index_file:
+            self.index = json.load(index_file)
+        self.num_chunks = len(self.index['chunk_lengths'])
+
+    def get_scalar_df(self):
+        """
+        Returns:
+            DataFrame: the scalar metrics of every logged step (same columns as the tracking df)
+        """
+        if self.num_chunks == 0:
+            return pd.DataFrame(np.zeros(0, dtype=SCALAR_DTYPE))
+        return pd.DataFrame(np.concatenate([np.load(get_chunk_path(self.directory, 'scalars', i))
+                                            for i in range(self.num_chunks)]))
+
+    def get_tracking_df(self):
+        """
+        Returns:
+            DataFrame: the tracking df of run_agent_experiment, with the array snapshots as columns of arrays
+        """
+        tracking_df = self.get_scalar_df()
+        for field in ARRAY_FIELDS:
+            tracking_df[field] = [np.array(snapshot) for snapshot in self.get_array_sequence(field)]
+        return tracking_df[['step', 'delta', 'rolling_power', 'state_visits', 'total_energy', 'env_rewards']]
+
+    def get_array_sequence(self, field):
+        """
+        Args:
+            field (str): one of ARRAY_FIELDS
+        Returns:
+            LazyArraySequence: the snapshots of the field, memory-mapped from disk
+        """
+        return LazyArraySequence([np.load(get_chunk_path(self.directory, field, i), mmap_mode='r')
+                                  for i in range(self.num_chunks)])
+
+    def __len__(self):
+        return sum(self.index['chunk_lengths'])
@@ -13,6 +13,20 @@ import tqdm
 from tqdm import tqdm
 
 
+def get_progress_df(progress_df):
+    """
+    Get the scalar tracking df of an experiment
+    
+    Args:
+        progress_df (DataFrame): The tracking df generated during an experiment, or a tracking.TrackingStore
+    Returns:
+        DataFrame: the tracking df (scalar columns only for a TrackingStore)
+    """
+    if hasattr(progress_df, 'get_scalar_df'):
+        return progress_df.get_scalar_df()
+    return progress_df
+
+
 def heatmap(array, show_values=False, width=600, height=600):
     """
     Plot a heatmap of an array
@@ -139,7 +153,7 @@ def plot_rolling_power(progress_df, exp_env, height=600, width=800, plot_title='
     Creates a visualization to assess agent performance
     
     Args:
-        progress_df (DataFrame): The tracking df generated during an experiment
+        progress_df (DataFrame): The tracking df generated during an experiment (or a tracking.TrackingStore)
         exp_env (SolarEnv): The environment used in the experiment
     Kwargs:
         width (int): Width of the plot
@@ -147,6 +161,7 @@ def plot_rolling_power(progress_df, exp_env, height=600, width=800, plot_title='
     Returns:
         None
     """
+    progress_df = get_progress_df(progress_df)
     max_output = exp_env.get_reward_array().max()
     progress_df['env_max'] = max_output
     progress_df['optimal_energy'] = progress_df['step'].astype(float) * max_output
@@ -172,7 +187,7 @@ def plot_energy_by_day(progress_df, exp_env, height=600, width=800, day_incremen
     Creates a visualization to assess agent performance
     
     Args:
-        progress_df (DataFrame): The tracking df generated during an experiment
+        progress_df (DataFrame): The tracking df generated during an experiment (or a tracking.TrackingStore)
         exp_env (SolarEnv): The environment used in the experiment
     Kwargs:
         width (int): Width of the plot
@@ -183,6 +198,7 @@ def plot_energy_by_day(progress_df, exp_env, height=600, width=800, day_incremen
     Returns:
         None
     """
+    progress_df = get_progress_df(progress_df)
     max_output = exp_env.get_reward_array().max()
     progress_df['env_max'] = max_output
     progress_df['optimal_energy'] = progress_df['step'].astype(float) * max_output